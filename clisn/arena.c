@@ -0,0 +1,117 @@
+#include <stdlib.h>
+#include <string.h>
+#include "arena.h"
+
+#define ARENA_ALIGN 8
+#define ARENA_FIRST_BLOCK_SIZE (8 * 1024)
+#define ARENA_MAX_BLOCK_SIZE (1024 * 1024)
+
+/* a block kept by Arena_reset is never larger than this */
+#define ARENA_MAX_RETAINED_SIZE (1024 * 1024)
+
+struct ArenaBlock {
+    struct ArenaBlock *next;
+    size_t size;
+    size_t used;
+    union {
+        double d;
+        void *p;
+        long long l;
+    } data[1]; /* aligned start of the payload */
+};
+
+#define BLOCK_DATA(block) ((char *)(block)->data)
+
+static ArenaBlock* new_block(size_t size, ArenaBlock *next) {
+    ArenaBlock *block;
+
+    block = (ArenaBlock *)malloc(sizeof(ArenaBlock) + size);
+    if(!block)
+        return NULL;
+    block->next = next;
+    block->size = size;
+    block->used = 0;
+    return block;
+}
+
+Arena* Arena_new(void) {
+    Arena *arena = (Arena *)malloc(sizeof(Arena));
+    if(!arena)
+        return NULL;
+    arena->head = NULL;
+    arena->next_block_size = ARENA_FIRST_BLOCK_SIZE;
+    return arena;
+}
+
+void* Arena_alloc(Arena *arena, size_t size) {
+    ArenaBlock *block;
+    void *ret;
+
+    size = (size + ARENA_ALIGN - 1) & ~(size_t)(ARENA_ALIGN - 1);
+    block = arena->head;
+    if(!block || block->size - block->used < size) {
+        size_t block_size = arena->next_block_size;
+
+        if(block_size < size)
+            block_size = size;
+        if(arena->next_block_size < ARENA_MAX_BLOCK_SIZE)
+            arena->next_block_size *= 2;
+
+        if(block && size > ARENA_MAX_BLOCK_SIZE / 4) {
+            /* a large chunk gets its own block behind the current one,
+             * so that the space left in the current one is not wasted */
+            block = new_block(size, block->next);
+            if(!block)
+                abort();
+            arena->head->next = block;
+            block->used = size;
+            return BLOCK_DATA(block);
+        }
+        block = new_block(block_size, arena->head);
+        if(!block)
+            abort();
+        arena->head = block;
+    }
+    ret = BLOCK_DATA(block) + block->used;
+    block->used += size;
+    return ret;
+}
+
+char* Arena_strndup(Arena *arena, const char *str, size_t len) {
+    char *ret = (char *)Arena_alloc(arena, len + 1);
+    memcpy(ret, str, len);
+    ret[len] = 0;
+    return ret;
+}
+
+void Arena_reset(Arena *arena) {
+    ArenaBlock *block, *next, *kept;
+
+    kept = NULL;
+    for(block = arena->head; block; block = next) {
+        next = block->next;
+        if(block->size <= ARENA_MAX_RETAINED_SIZE &&
+           (!kept || kept->size < block->size)) {
+            if(kept)
+                free(kept);
+            kept = block;
+        } else {
+            free(block);
+        }
+    }
+    if(kept) {
+        kept->next = NULL;
+        kept->used = 0;
+    }
+    arena->head = kept;
+}
+
+void Arena_remove(Arena *arena) {
+    ArenaBlock *block, *next;
+
+    for(block = arena->head; block; block = next) {
+        next = block->next;
+        free(block);
+    }
+    free(arena);
+}
@@ -0,0 +1,31 @@
+#ifndef _ARENA_H
+# define _ARENA_H
+/*
+ * Region allocator
+ *
+ * Tokens, AST nodes, argument cells and strings of one parse are bump
+ * allocated from an arena and released together by Arena_reset or
+ * Arena_remove. Nothing allocated from an arena is freed one by one.
+ */
+#include <stddef.h>
+
+#if defined(_MSC_VER)
+# define ARENA_THREAD_LOCAL __declspec(thread)
+#else
+# define ARENA_THREAD_LOCAL __thread
+#endif
+
+typedef struct ArenaBlock ArenaBlock;
+
+typedef struct Arena {
+    ArenaBlock *head; /* block being filled. older blocks follow */
+    size_t next_block_size;
+} Arena;
+
+Arena* Arena_new(void);
+void* Arena_alloc(Arena *arena, size_t size);
+char* Arena_strndup(Arena *arena, const char *str, size_t len);
+/* release everything but one block, which is kept for the next parse */
+void Arena_reset(Arena *arena);
+void Arena_remove(Arena *arena);
+#endif //!defined(_ARENA_H)
@@ -10,13 +10,13 @@
     # define NULL ((void *) 0)
     #endif
 
-    #define RM_TOKEN(x) Lexer_remove_token(x)
+    /* text of a token, which is not null-terminated */
+    #define TOKEN_DSTR(tok) dsstring_slice((tok)->text, (tok)->text_len)
 
 }
 
 %name LEMONParse
 %token_type { LexToken * }
-%token_destructor { RM_TOKEN($$); }
 %default_type { ASTHD * }
 %type argument { ASTMISC_OneArg }
 %type arguments { ASTDS_Arguments }
@@ -25,13 +25,10 @@
 %type vert_arg_expr { ASTMISC_OneArg }
 %stack_size 1024
 
-
-%default_destructor { ast_free($$); }
-%destructor arguments { astds_free_arguments(&$$); }
-%destructor argument { astmisc_remove_onearg(&$$); }
-%destructor arg_stub { astds_free_arguments(&$$); }
-%destructor vert_arg_exprs { astds_free_arguments(&$$); }
-%destructor vert_arg_expr { astmisc_remove_onearg(&$$); }
+/*
+ * No destructors: tokens and nodes live in the arena of the parse,
+ * which is released as a whole.
+ */
 
 %extra_argument { ParseResult* parser_result }
 
@@ -75,9 +72,8 @@ exprs(A) ::= expr(B). {
     A->loc = loc;
 }
 
-exprs(A) ::= NEWLINE(tokB). {
+exprs(A) ::= NEWLINE. {
     A = NULL;
-    RM_TOKEN(tokB);
 }
 
 exprs(A) ::= exprs(DST) expr(ELEM).  {
@@ -109,7 +105,6 @@ exprs(A) ::= exprs(DST) NEWLINE(tokC). {
     if (DST) {
         TRACK_NT(A, DST, tokC);
     }
-    RM_TOKEN(tokC);
 }
 
 expr(A) ::= normal_expr(B). { 
@@ -144,9 +139,8 @@ expr(A) ::= small_expr(B) DEFASSIGN normal_expr(C). {
 /* INTERMEDIATE */
 /* doc -> "Hello world!" */
 expr(A) ::= NAME(tokB) ARROW normal_expr(C). {
-    A = ast_arrow(tokB->text, C);
+    A = ast_arrow(TOKEN_DSTR(tokB), C);
     TRACK_TN(A, tokB, C);
-    RM_TOKEN(tokB);
 }
 /* INTERMEDIATE */
 /* "doc" -> "Hello world!" */
@@ -203,9 +197,8 @@ or_expr(A) ::= and_expr(B). {
 }
 
 or_expr(A) ::= or_expr(B) DPIPE(tokOP) and_expr(C). {
-    A = ast_binop(tokOP->text, B, C);
+    A = ast_binop(TOKEN_DSTR(tokOP), B, C);
     TRACK_NN(A, B, C);
-    RM_TOKEN(tokOP);
 }
 
 and_expr(A) ::= comp_expr(B). { 
@@ -213,9 +206,8 @@ and_expr(A) ::= comp_expr(B). {
     TRACK_N(A, B);
 }
 and_expr(A) ::= and_expr(B) DAMP(tokOP) comp_expr(C). {
-    A = ast_binop(tokOP->text, B, C);
+    A = ast_binop(TOKEN_DSTR(tokOP), B, C);
     TRACK_NN(A, B, C);
-    RM_TOKEN(tokOP);
 }
 
 comp_expr(A) ::= pipe_expr(B). { 
@@ -223,36 +215,30 @@ comp_expr(A) ::= pipe_expr(B). {
     TRACK_N(A, B);
 }
 comp_expr(A) ::= comp_expr(B) LT(tokOP) pipe_expr(C).{
-    A = ast_binop(tokOP->text, B, C);
+    A = ast_binop(TOKEN_DSTR(tokOP), B, C);
     TRACK_NN(A, B, C);
-    RM_TOKEN(tokOP);
 }
 
 comp_expr(A) ::= comp_expr(B) GT(tokOP) pipe_expr(C).{
-    A = ast_binop(tokOP->text, B, C);
+    A = ast_binop(TOKEN_DSTR(tokOP), B, C);
     TRACK_NN(A, B, C);
-    RM_TOKEN(tokOP);
 }
 comp_expr(A) ::= comp_expr(B) LTE(tokOP) pipe_expr(C).{
-    A = ast_binop(tokOP->text, B, C);
+    A = ast_binop(TOKEN_DSTR(tokOP), B, C);
     TRACK_NN(A, B, C);
-    RM_TOKEN(tokOP);
 }
 
 comp_expr(A) ::= comp_expr(B) GTE(tokOP) pipe_expr(C).{
-    A = ast_binop(tokOP->text, B, C);
+    A = ast_binop(TOKEN_DSTR(tokOP), B, C);
     TRACK_NN(A, B, C);
-    RM_TOKEN(tokOP);
 }
 comp_expr(A) ::= comp_expr(B) EQ(tokOP) pipe_expr(C).{
-    A = ast_binop(tokOP->text, B, C);
+    A = ast_binop(TOKEN_DSTR(tokOP), B, C);
     TRACK_NN(A, B, C);
-    RM_TOKEN(tokOP);
 }
 comp_expr(A) ::= comp_expr(B) NEQ(tokOP) pipe_expr(C).{
-    A = ast_binop(tokOP->text, B, C);
+    A = ast_binop(TOKEN_DSTR(tokOP), B, C);
     TRACK_NN(A, B, C);
-    RM_TOKEN(tokOP);
 }
 
 pipe_expr(A) ::= amp_expr(B). { 
@@ -260,9 +246,8 @@ pipe_expr(A) ::= amp_expr(B). {
     TRACK_N(A, B);
 }
 pipe_expr(A) ::= pipe_expr(B) PIPE(tokOP) amp_expr(C). {
-    A = ast_binop(tokOP->text, B, C);
+    A = ast_binop(TOKEN_DSTR(tokOP), B, C);
     TRACK_NN(A, B, C);
-    RM_TOKEN(tokOP);
 }
 
 amp_expr(A) ::= arith_expr(B). { 
@@ -270,9 +255,8 @@ amp_expr(A) ::= arith_expr(B). {
     TRACK_N(A, B);
 }
 amp_expr(A) ::= amp_expr(B) AMP(tokOP) arith_expr(C). {
-    A = ast_binop(tokOP->text, B, C);
+    A = ast_binop(TOKEN_DSTR(tokOP), B, C);
     TRACK_NN(A, B, C);
-    RM_TOKEN(tokOP);
 }
 
 arith_expr(A) ::= term_expr(B). { 
@@ -280,14 +264,12 @@ arith_expr(A) ::= term_expr(B). {
     TRACK_N(A, B);
 }
 arith_expr(A) ::= arith_expr(B) PLUS(tokOP) term_expr(C).{
-    A = ast_binop(tokOP->text, B, C);
+    A = ast_binop(TOKEN_DSTR(tokOP), B, C);
     TRACK_NN(A, B, C);
-    RM_TOKEN(tokOP);
 }
 arith_expr(A) ::= arith_expr(B) MINUS(tokOP) term_expr(C).{
-    A = ast_binop(tokOP->text, B, C);
+    A = ast_binop(TOKEN_DSTR(tokOP), B, C);
     TRACK_NN(A, B, C);
-    RM_TOKEN(tokOP);
 }
 
 term_expr(A) ::= factor_expr(B). { 
@@ -295,19 +277,16 @@ term_expr(A) ::= factor_expr(B). {
     TRACK_N(A, B);
 }
 term_expr(A) ::= term_expr(B) STAR(tokOP) factor_expr(C).{
-    A = ast_binop(tokOP->text, B, C);
+    A = ast_binop(TOKEN_DSTR(tokOP), B, C);
     TRACK_NN(A, B, C);
-    RM_TOKEN(tokOP);
 }
 term_expr(A) ::= term_expr(B) SLASH(tokOP) factor_expr(C).{ 
-    A = ast_binop(tokOP->text, B, C);
+    A = ast_binop(TOKEN_DSTR(tokOP), B, C);
     TRACK_NN(A, B, C);
-    RM_TOKEN(tokOP);
 }
 term_expr(A) ::= term_expr(B) PERCENT(tokOP) factor_expr(C).{ 
-    A = ast_binop(tokOP->text, B, C);
+    A = ast_binop(TOKEN_DSTR(tokOP), B, C);
     TRACK_NN(A, B, C);
-    RM_TOKEN(tokOP);
 }
 
 factor_expr(A) ::= power_expr(B). {
@@ -315,19 +294,16 @@ factor_expr(A) ::= power_expr(B). {
     TRACK_N(A, B);
 }
 factor_expr(A) ::= PLUS(tokOP) factor_expr(B).{ 
-    A = ast_unop(tokOP->text, B); 
+    A = ast_unop(TOKEN_DSTR(tokOP), B); 
     TRACK_TN(A, tokOP, B);
-    RM_TOKEN(tokOP);
 }
 factor_expr(A) ::= MINUS(tokOP) factor_expr(B).{ 
-    A = ast_unop(tokOP->text, B); 
+    A = ast_unop(TOKEN_DSTR(tokOP), B); 
     TRACK_TN(A, tokOP, B);
-    RM_TOKEN(tokOP);
 }
 factor_expr(A) ::= BANG(tokOP) factor_expr(B).{ 
-    A = ast_unop(tokOP->text, B); 
+    A = ast_unop(TOKEN_DSTR(tokOP), B); 
     TRACK_TN(A, tokOP, B);
-    RM_TOKEN(tokOP);
 }
 
 power_expr(A) ::= par_expr(B). { 
@@ -335,16 +311,13 @@ power_expr(A) ::= par_expr(B). {
     TRACK_N(A, B);
 }
 power_expr(A) ::= par_expr(B) DSTAR(tokOP) factor_expr(C). { 
-    A = ast_binop(tokOP->text, B, C);
+    A = ast_binop(TOKEN_DSTR(tokOP), B, C);
     TRACK_NN(A, B, C);
-    RM_TOKEN(tokOP);
 }
 
 par_expr(A) ::= LPAR(tokL) small_expr(B) RPAR(tokR). {
     A = B; 
     TRACK_TT(A, tokL, tokR);
-    RM_TOKEN(tokL);
-    RM_TOKEN(tokR);
 }
 par_expr(A) ::= dexpr_head(B). { 
     A = B;
@@ -359,9 +332,8 @@ dexpr_head(A) ::= access_expr(B). {
 dexpr_head(A) ::= NAME(tok_LABELL) access_expr(HEAD). {
     ASTLoc loc;
     MERGE_ASTLOC(loc, *tok_LABELL, HEAD->loc);
-    A = astmisc_dexpr_lookahead(HEAD, tok_LABELL->text, NULL); 
+    A = astmisc_dexpr_lookahead(HEAD, TOKEN_DSTR(tok_LABELL), NULL); 
     A->loc = loc;
-    RM_TOKEN(tok_LABELL);
 }
 
 access_expr(A) ::= atom(B). { 
@@ -374,9 +346,8 @@ access_expr(A) ::= atom(B) trailers(TRAILERS). {
 }
 
 id(A) ::= NAME(tokB). { 
-    A = ast_name(tokB->text);
+    A = ast_name(TOKEN_DSTR(tokB));
     TRACK_T(A, tokB);
-    RM_TOKEN(tokB);
 }
 
 atom(A) ::= strings(B). { 
@@ -384,28 +355,24 @@ atom(A) ::= strings(B). {
     TRACK_N(A, B);
 }
 atom(A) ::= BOOL(tokB). {
-    if(!strcmp(tokB->text, "true")) 
+    if(tokB->text_len == 4 && !strncmp(tokB->text, "true", 4)) 
         A = ast_true_literal();
     else
         A = ast_false_literal();
 
     TRACK_T(A, tokB);
-    RM_TOKEN(tokB);
 }
 atom(A) ::= INTEGER(tokB). { 
-    A = ast_integer_literal(tokB->text);
+    A = ast_integer_literal(TOKEN_DSTR(tokB));
     TRACK_T(A, tokB);
-    RM_TOKEN(tokB);
 }
 atom(A) ::= FLOAT(tokB).{ 
-    A = ast_float_literal(tokB->text); 
+    A = ast_float_literal(TOKEN_DSTR(tokB)); 
     TRACK_T(A, tokB);
-    RM_TOKEN(tokB);
 }
 atom(A) ::= NULLOBJ(tokB). {
     A = ast_null_literal(); 
     TRACK_T(A, tokB);
-    RM_TOKEN(tokB);
 }
 atom(A) ::= id(B). {
     A = B;
@@ -414,43 +381,37 @@ atom(A) ::= id(B). {
 
 /* strings yield AST_Name */
 strings(A) ::= STRING(tokB). {
-    A = ast_sliced_string_literal(tokB->text, 1, tokB->text_len - 2);
+    A = ast_sliced_string_literal(TOKEN_DSTR(tokB), 1, tokB->text_len - 2);
     TRACK_T(A, tokB);
-    RM_TOKEN(tokB);
 }
 strings(A) ::= LONGSTRING(tokB). {
     // LONG STRING has format of '''...''' or """..."""
-    A = ast_sliced_string_literal(tokB->text, 3, tokB->text_len - 6);
+    A = ast_sliced_string_literal(TOKEN_DSTR(tokB), 3, tokB->text_len - 6);
     TRACK_T(A, tokB);
-    RM_TOKEN(tokB);
 }
 strings(A) ::= strings(B) STRING(tokC). { 
     ASTDS_String dstr;
     if(tokC->text_len >= 2) {
-        dstr = make_dsstring(tokC->text + 1, tokC->text_len - 2);
+        dstr = dsstring_slice(tokC->text + 1, tokC->text_len - 2);
     } else {
-        dstr = dsstring_from_str("");
+        dstr = dsstring_slice("", 0);
     }
-    ast_string_literal_append(B, dstr.str);
-    free_dsstring(&dstr);
+    ast_string_literal_append(B, dstr);
     A = B;
     TRACK_NT(A, B, tokC);
-    RM_TOKEN(tokC);
 }
 
 strings(A) ::= strings(B) LONGSTRING(tokC). {
     // HACK
     ASTDS_String dstr;
     if(tokC->text_len >= 6) {
-        dstr = make_dsstring(tokC->text + 3, tokC->text_len - 6);
+        dstr = dsstring_slice(tokC->text + 3, tokC->text_len - 6);
     } else {
-        dstr = dsstring_from_str("");
+        dstr = dsstring_slice("", 0);
     }
-    ast_string_literal_append(B, dstr.str);
-    free_dsstring(&dstr);
+    ast_string_literal_append(B, dstr);
     A = B;
     TRACK_NT(A, B, tokC);
-    RM_TOKEN(tokC);
 }
 
 trailers(A) ::= trailer(B). {
@@ -469,53 +430,39 @@ trailers(A) ::= trailers(SCOPE) trailer(B). {
 
 /* foo.x */
 trailer(A) ::= DOT(tokB) NAME(tokC). { 
-    A = ast_access_attr(NULL, tokC->text);
+    A = ast_access_attr(NULL, TOKEN_DSTR(tokC));
     TRACK_TT(A, tokB, tokC);
-    RM_TOKEN(tokB);
-    RM_TOKEN(tokC);
 }
 /* foo[x]*/
 trailer(A) ::= LBRKT(tokL) or_expr(B) RBRKT(tokR). { 
     A = ast_access_array(NULL, B);
     TRACK_TT(A, tokL, tokR);
-    RM_TOKEN(tokL);
-    RM_TOKEN(tokR);
 }
 /* foo[:]*/
 trailer(A) ::= LBRKT(tokL) COLUMN RBRKT(tokR). { 
     A = ast_slice_nolr(NULL); 
     TRACK_TT(A, tokL, tokR);
-    RM_TOKEN(tokL);
-    RM_TOKEN(tokR);
 }
 /* foo[x:]*/
 trailer(A) ::= LBRKT(tokL) or_expr(LEFT) COLUMN RBRKT(tokR). { 
     A = ast_slice_l(NULL, LEFT); 
     TRACK_TT(A, tokL, tokR);
-    RM_TOKEN(tokL);
-    RM_TOKEN(tokR);
 }
 /* foo[:y]*/
 trailer(A) ::= LBRKT(tokL) COLUMN or_expr(RIGHT) RBRKT(tokR). { 
     A = ast_slice_r(NULL, RIGHT); 
     TRACK_TT(A, tokL, tokR);
-    RM_TOKEN(tokL);
-    RM_TOKEN(tokR);
 }
 /* foo[x:y]*/
 trailer(A) ::= LBRKT(tokL) or_expr(LEFT) COLUMN or_expr(RIGHT) RBRKT(tokR). { 
     A = ast_slice_lr(NULL, LEFT, RIGHT); 
     TRACK_TT(A, tokL, tokR);
-    RM_TOKEN(tokL);
-    RM_TOKEN(tokR);
 }
 
 /* foo(x, y) : simple application, treated as special case */
 trailer(A) ::= LPAR(tokL) arguments(ARGS) RPAR(tokR). { 
     A = ast_inline_app(NULL, ARGS);
     TRACK_TT(A, tokL, tokR);
-    RM_TOKEN(tokL);
-    RM_TOKEN(tokR);
 }
 /* foo() */
 trailer(A) ::= LPAR(tokL) RPAR(tokR). { 
@@ -525,8 +472,6 @@ trailer(A) ::= LPAR(tokL) RPAR(tokR). {
     ARG_TRACK_TT(arg_info, tokL, tokR);
     A = ast_inline_app(NULL, arg_info);
     TRACK_TT(A, tokL, tokR);
-    RM_TOKEN(tokL);
-    RM_TOKEN(tokR);
 }
 
 argument(A) ::= small_expr(B). { 
@@ -535,9 +480,8 @@ argument(A) ::= small_expr(B). {
 }
 
 argument(A) ::= NAME(tokB) ASSIGN small_expr(C). { 
-    A = astmisc_onearg_pair(tokB->text, C); 
+    A = astmisc_onearg_pair(TOKEN_DSTR(tokB), C); 
     ARG_TRACK_TN(A, tokB, C);
-    RM_TOKEN(tokB);
 }
 argument(A) ::= strings(B) ASSIGN small_expr(C). {
     A = astmisc_onearg_pair_with_literal_del(B, C);
@@ -546,22 +490,18 @@ argument(A) ::= strings(B) ASSIGN small_expr(C). {
 argument(A) ::= STAR(tokL) small_expr(B). { 
     A = astmisc_onearg_star(B); 
     ARG_TRACK_TN(A, tokL, B);
-    RM_TOKEN(tokL);
 }
 argument(A) ::= DSTAR(tokL) small_expr(B). { 
     A = astmisc_onearg_dstar(B); 
     ARG_TRACK_TN(A, tokL, B);
-    RM_TOKEN(tokL);
 }
 argument(A) ::= AMP(tokL) small_expr(B). { 
     A = astmisc_onearg_amp(B); 
     ARG_TRACK_TN(A, tokL, B);
-    RM_TOKEN(tokL);
 }
 argument(A) ::= DAMP(tokL) small_expr(B). { 
     A = astmisc_onearg_damp(B); 
     ARG_TRACK_TN(A, tokL, B);
-    RM_TOKEN(tokL);
 }
 
 arguments(A) ::= argument(B). {
@@ -601,16 +541,17 @@ vert_xexpr(A) ::= small_expr(B) GT_NEWLINE NEWLINE arg_stub(C) DMINUS_NEWLINE NE
 }
 
 stub(A) ::= INDENT(tokL) exprs(B) DEDENT(tokR). { 
+    if(!B) {
+        /* only line continuations in the block. rules using stub expect a suite */
+        pres_set_error(parser_result, PARSE_ERR_SYNTAX_ERROR, "expected an indented expression");
+        B = ast_suite_cons_normal(ast_name(dsstring_slice("", 0)), NULL);
+    }
     A = B; 
     TRACK_TT(A, tokL, tokR);
-    RM_TOKEN(tokL);
-    RM_TOKEN(tokR);
 }
 arg_stub(A) ::= INDENT(tokL) vert_arg_exprs(B) DEDENT(tokR). { 
     A = B; 
     ARG_TRACK_TT(A, tokL, tokR);
-    RM_TOKEN(tokL);
-    RM_TOKEN(tokR);
 }
 
 vert_arg_exprs(A) ::= vert_arg_expr(B). {
@@ -636,21 +577,17 @@ vert_arg_expr(A) ::= expr(B). {
 vert_arg_expr(A) ::= STAR(tokL) normal_expr(B). { 
     A = astmisc_onearg_star(B); 
     ARG_TRACK_TN(A, tokL, B);
-    RM_TOKEN(tokL);
 }
 vert_arg_expr(A) ::= DSTAR(tokL) normal_expr(B). { 
     A = astmisc_onearg_dstar(B); 
     ARG_TRACK_TN(A, tokL, B);
-    RM_TOKEN(tokL);
 }
 vert_arg_expr(A) ::= AMP(tokL) normal_expr(B). { 
     A = astmisc_onearg_amp(B); 
     ARG_TRACK_TN(A, tokL, B);
-    RM_TOKEN(tokL);
 }
 vert_arg_expr(A) ::= DAMP(tokL) normal_expr(B). { 
     A = astmisc_onearg_damp(B); 
     ARG_TRACK_TN(A, tokL, B);
-    RM_TOKEN(tokL);
 }
 
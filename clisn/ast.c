@@ -10,20 +10,46 @@
 /* TODO: change me */
 #define AST_NODE_TAG 10 
 
+/*
+ * Every node, argument cell and string is allocated from the arena of the
+ * parse running in this thread. The whole tree is released with the arena.
+ */
+static ARENA_THREAD_LOCAL Arena *current_arena = NULL;
+
+Arena* ast_use_arena(Arena *arena) {
+    Arena *prev = current_arena;
+    current_arena = arena;
+    return prev;
+}
+
+static inline void* ast_alloc(size_t size) {
+    return Arena_alloc(current_arena, size);
+}
+
 /* 
  * ASTDS_String stuffs
  */
 ASTDS_String make_dsstring(const char *str, int len) {
     ASTDS_String s;
+    char *copied;
 
-    s.str = (char *)malloc(len + 1);
+    copied = (char *)ast_alloc(len + 1);
+    memcpy(copied, str, len);
+    copied[len] = 0;
+    s.str = copied;
     s.len = len;
-    s.str[len] = 0;
-    strncpy(s.str, str, len);
 
     return s;
 }
 
+/* refers to str without copying it */
+ASTDS_String dsstring_slice(const char *str, int len) {
+    ASTDS_String s;
+    s.str = str;
+    s.len = len;
+    return s;
+}
+
 ASTDS_String empty_dsstring() {
     ASTDS_String ret;
     ret.len = 0;
@@ -35,28 +61,29 @@ int dsstring_empty(ASTDS_String *dstr) {
     return dstr->str == NULL;
 }
 
-void free_dsstring(ASTDS_String *dstr) {
-    if(!dsstring_empty(dstr)) {
-        free(dstr->str);
-    }
+int dsstring_equals(ASTDS_String *dstr, const char *str) {
+    return dstr->str &&
+           strlen(str) == dstr->len &&
+           !memcmp(dstr->str, str, dstr->len);
 }
 
 ASTDS_String dsstring_from_str(const char *str) {
     return make_dsstring(str, strlen(str));
 }
 
-void dsstring_append(ASTDS_String *dstr, const char *src) {
-    unsigned int src_len, len;
+void dsstring_append(ASTDS_String *dstr, ASTDS_String src) {
     if(dsstring_empty(dstr)) {
-        *dstr = dsstring_from_str(src);
-    } else if (!(*src)) {
+        *dstr = src;
+    } else if (!src.len) {
         // PASS
     } else {
-        src_len = strlen(src);
-        len = dstr->len;
-        dstr->str = (char *)realloc(dstr->str, src_len + len + 1);
-        dstr->str[src_len + len] = 0;
-        strcpy(dstr->str + len, src);
+        char *str;
+        str = (char *)ast_alloc(dstr->len + src.len + 1);
+        memcpy(str, dstr->str, dstr->len);
+        memcpy(str + dstr->len, src.str, src.len);
+        str[dstr->len + src.len] = 0;
+        dstr->str = str;
+        dstr->len += src.len;
     }
 }
 
@@ -64,7 +91,7 @@ void dsstring_append(ASTDS_String *dstr, const char *src) {
  * AST Stuffs
  */
 static ASTHD* ast_make(short node_type, unsigned int size) {
-    ASTHD *ret = (ASTHD *)malloc(size);
+    ASTHD *ret = (ASTHD *)ast_alloc(size);
     ret->tag = AST_NODE_TAG;
     ret->node_type = node_type;
     return ret;
@@ -87,11 +114,11 @@ AST_Suite* reverse_suite(AST_Suite *suite) {
 
 
 
-ASTHD* ast_access_attr(ASTHD *scope, const char *str) {
+ASTHD* ast_access_attr(ASTHD *scope, ASTDS_String attr) {
     AST_Trailer *trailer = (AST_Trailer *)ast_make(asttype_trailer, sizeof(AST_Trailer));
     trailer->scope = scope;
     trailer->trailer_type = trailer_attr;
-    trailer->as.attr = dsstring_from_str(str);
+    trailer->as.attr = attr;
     return &trailer->hd;
 }
 
@@ -144,9 +171,9 @@ ASTHD* ast_slice_nolr(ASTHD *scope) {
 
 }
 
-ASTHD* ast_name(const char *str) {
+ASTHD* ast_name(ASTDS_String dstr) {
     AST_Name *name = (AST_Name *)ast_make(asttype_name, sizeof(AST_Name));
-    name->dstr = dsstring_from_str(str);
+    name->dstr = dstr;
     return &name->hd;
 }
 
@@ -158,37 +185,36 @@ ASTHD* ast_string_literal(const char *str) {
     return &literal->hd;
 }
 
-ASTHD* ast_sliced_string_literal(const char *str, int start, int slice_len) {
+ASTHD* ast_sliced_string_literal(ASTDS_String text, int start, int slice_len) {
     AST_Literal *literal = (AST_Literal *)ast_make(asttype_literal, sizeof(AST_Literal));
 
-    int len = strlen(str);
-    if(start + slice_len > len) {
-        literal->dstr = dsstring_from_str("");
+    if(slice_len < 0 || start + slice_len > (int)text.len) {
+        literal->dstr = dsstring_slice("", 0);
     } else {
-        literal->dstr = make_dsstring(str + start, slice_len);
+        literal->dstr = dsstring_slice(text.str + start, slice_len);
     }
 
     literal->literal_type = literal_string;
     return &literal->hd;
 }
 
-void ast_string_literal_append(ASTHD *ast, char *str) {
+void ast_string_literal_append(ASTHD *ast, ASTDS_String dstr) {
     AST_Literal *literal = (AST_Literal *)ast;
-    dsstring_append(&literal->dstr, str);
+    dsstring_append(&literal->dstr, dstr);
 }
 
-ASTHD* ast_integer_literal(const char *str) {
+ASTHD* ast_integer_literal(ASTDS_String dstr) {
     AST_Literal *literal = (AST_Literal *)ast_make(asttype_literal, sizeof(AST_Literal));
 
     literal->literal_type = literal_integer;
-    literal->dstr = dsstring_from_str(str);
+    literal->dstr = dstr;
     return &literal->hd;
 }
-ASTHD* ast_float_literal(const char *str) {
+ASTHD* ast_float_literal(ASTDS_String dstr) {
     AST_Literal *literal = (AST_Literal *)ast_make(asttype_literal, sizeof(AST_Literal));
 
     literal->literal_type = literal_float;
-    literal->dstr = dsstring_from_str(str);
+    literal->dstr = dstr;
     return &literal->hd;
 }
 ASTHD* ast_null_literal() {
@@ -218,18 +244,18 @@ ASTHD* ast_false_literal() {
     return &literal->hd;
 }
 
-ASTHD* ast_binop(const char *binop_str, ASTHD *lhs, ASTHD *rhs) {
+ASTHD* ast_binop(ASTDS_String binop_str, ASTHD *lhs, ASTHD *rhs) {
     AST_BinOp *binop = (AST_BinOp *)ast_make(asttype_binop, sizeof(AST_BinOp));
 
-    binop->binop_str = dsstring_from_str(binop_str);
+    binop->binop_str = binop_str;
     binop->lhs = lhs;
     binop->rhs = rhs;
 
     return &binop->hd;
 }
-ASTHD* ast_unop(const char *unop_str, ASTHD *param) {
+ASTHD* ast_unop(ASTDS_String unop_str, ASTHD *param) {
     AST_UnOp *unop = (AST_UnOp *)ast_make(asttype_unop, sizeof(AST_UnOp));
-    unop->unop_str = dsstring_from_str(unop_str);
+    unop->unop_str = unop_str;
     unop->param = param;
 
     return &unop->hd;
@@ -281,8 +307,6 @@ ASTHD* ast_suite_cons_arrow_del(AST_Arrow *arrow, ASTHD *dst) {
     suite->param = arrow->param;
     suite->next = (AST_Suite *)dst;
 
-    ast_shallow_remove(&arrow->hd);
-
     return &suite->hd;
 }
 
@@ -301,13 +325,13 @@ ASTHD* ast_xexpr_single(ASTHD *head_expr, ASTDS_Arguments argument,
     return &xexpr->hd;
 }
 
-ASTHD* ast_xexpr_double(const char *head_label_str, ASTHD *head_expr, ASTDS_Arguments argument,
+ASTHD* ast_xexpr_double(ASTDS_String head_label, ASTHD *head_expr, ASTDS_Arguments argument,
                         ASTHD *vert_suite) {
     AST_XExpr *xexpr = (AST_XExpr *)ast_make(asttype_xexpr, sizeof(AST_XExpr));
 
     xexpr->has_head_label = 1;
     xexpr->has_vert_suite = !!vert_suite;
-    xexpr->head_label = dsstring_from_str(head_label_str);
+    xexpr->head_label = head_label;
     xexpr->head_expr = head_expr;
     xexpr->arg_info = argument;
     xexpr->vert_suite = vert_suite;
@@ -322,7 +346,7 @@ void ast_xexpr_set_vert_suite(AST_XExpr *xexpr, AST_Suite *vert_suite) {
 
 
 ASTDS_PosArg* astds_singlearg_cons(ASTHD *elem, ASTDS_PosArg* parg) {
-    ASTDS_PosArg *ret = (ASTDS_PosArg *)malloc(sizeof(ASTDS_PosArg));
+    ASTDS_PosArg *ret = (ASTDS_PosArg *)ast_alloc(sizeof(ASTDS_PosArg));
 
     ret->param = elem;
     ret->next = parg;
@@ -331,7 +355,7 @@ ASTDS_PosArg* astds_singlearg_cons(ASTHD *elem, ASTDS_PosArg* parg) {
 }
 
 ASTDS_KwdArg* astds_kwdarg_cons(ASTDS_String dstr, ASTHD *elem, ASTDS_KwdArg *karg) {
-    ASTDS_KwdArg *ret = (ASTDS_KwdArg *)malloc(sizeof(ASTDS_KwdArg));
+    ASTDS_KwdArg *ret = (ASTDS_KwdArg *)ast_alloc(sizeof(ASTDS_KwdArg));
 
     ret->name = dstr;
     ret->param = elem;
@@ -375,9 +399,9 @@ ASTHD* ast_inline_app(ASTHD *scope, ASTDS_Arguments arg_info) {
     return &iapp->hd;
 }
 
-ASTHD* ast_arrow(const char *str, ASTHD *param) {
+ASTHD* ast_arrow(ASTDS_String name, ASTHD *param) {
     AST_Arrow *arrow = (AST_Arrow *)ast_make(asttype_imd_arrow, sizeof(AST_Arrow));
-    arrow->name = dsstring_from_str(str);
+    arrow->name = name;
     arrow->param = param;
     return &arrow->hd;
 }
@@ -387,160 +411,9 @@ ASTHD* ast_arrow_with_literal_del(AST_Literal *literal, ASTHD *param) {
     arrow->name = literal->dstr;
     arrow->param = param;
 
-    ast_shallow_remove(&literal->hd);
     return &arrow->hd;
 }
 
-void ast_shallow_remove(ASTHD *ast) {
-    free(ast);
-}
-
-static void ast_free_trailer(ASTHD *ast) {
-    AST_Trailer *trailer = (AST_Trailer *)ast;
-    switch(trailer->trailer_type) {
-        case trailer_attr:
-            free_dsstring(&trailer->as.attr);
-            break;
-        case trailer_array:
-            ast_free(trailer->as.index_param);
-            break;
-        case trailer_lrslice:
-        case trailer_lslice:
-        case trailer_rslice:
-        case trailer_noslice:
-            ast_free(trailer->as.slice_indices.left);
-            ast_free(trailer->as.slice_indices.right);
-            break;
-    }
-    ast_free(trailer->scope);
-}
-
-static void ast_free_name(ASTHD *ast) {
-    AST_Name *name = (AST_Name *)ast;
-    free_dsstring(&name->dstr);
-}
-
-static void ast_free_literal(ASTHD *ast) {
-    AST_Literal *literal = (AST_Literal *)ast;
-    free_dsstring(&literal->dstr);
-}
-
-static void ast_free_binop(ASTHD *ast) {
-    AST_BinOp *binop = (AST_BinOp *)ast;
-    free_dsstring(&binop->binop_str);
-    ast_free(binop->lhs);
-    ast_free(binop->rhs);
-}
-
-static void ast_free_unop(ASTHD *ast) {
-    AST_UnOp *unop = (AST_UnOp *)ast;
-
-    free_dsstring(&unop->unop_str);
-    ast_free(unop->param);
-}
-
-static void ast_free_imd_inline_app(ASTHD *ast) {
-    AST_InlineApp *iapp = (AST_InlineApp *)ast;
-    astds_free_arguments(&iapp->arg_info);
-    ast_free(iapp->scope);
-}
-
-static void ast_free_imd_arrow(ASTHD *ast) {
-    AST_Arrow *arrow = (AST_Arrow *)ast;
-    free_dsstring(&arrow->name);
-    ast_free(arrow->param);
-}
-
-static void ast_free_assign(ASTHD *ast) {
-    AST_Assign *assign = (AST_Assign *)ast;
-    switch(assign->lvalue_type) {
-        case lvalue_name:
-            free_dsstring(&assign->lvalue_as.name);
-            break;
-        case lvalue_attr:
-            free_dsstring(&assign->lvalue_as.attr.name);
-            ast_free(assign->lvalue_as.attr.scope);
-            break;
-        case lvalue_array:
-            ast_free(assign->lvalue_as.array.scope);
-            ast_free(assign->lvalue_as.array.index);
-            break;
-    }
-    ast_free(assign->param);
-}
-
-void astds_free_arguments(ASTDS_Arguments *arguments) {
-    free_singlearg(arguments->pargs);
-    free_kwdarg(arguments->kargs);
-    if(arguments->has_star)
-        ast_free(arguments->star);
-    if(arguments->has_dstar)
-        ast_free(arguments->dstar);
-    if(arguments->has_amp)
-        ast_free(arguments->amp);
-    if(arguments->has_damp)
-        ast_free(arguments->damp);
-}
-
-static void ast_free_xexpr(ASTHD *ast) {
-    AST_XExpr *xexpr = (AST_XExpr *)ast;
-    
-    free_dsstring(&xexpr->head_label);
-    ast_free(xexpr->head_expr);
-    astds_free_arguments(&xexpr->arg_info);
-
-    ast_free(xexpr->vert_suite);
-}
-
-static void ast_free_suite(ASTHD *ast) {
-    AST_Suite *suite, *next;
-    for(suite = (AST_Suite *)ast; suite; suite = next) {
-        next = suite->next;
-        free_dsstring(&suite->arrow_lstring);
-        ast_free(suite->param);
-        if(&suite->hd != ast)
-            ast_shallow_remove(&suite->hd);
-    }
-}
-
-void ast_free(ASTHD *ast) {
-    if(!ast)
-        return;
-    switch(ast->node_type) {
-        case asttype_trailer:
-            ast_free_trailer(ast);
-            break;
-        case asttype_name:
-            ast_free_name(ast);
-            break;
-        case asttype_literal:
-            ast_free_literal(ast);
-            break;
-        case asttype_binop:
-            ast_free_binop(ast);
-            break;
-        case asttype_unop:
-            ast_free_unop(ast);
-            break;
-        case asttype_assign:
-            ast_free_assign(ast);
-            break;
-        case asttype_suite:
-            ast_free_suite(ast);
-            break;
-        case asttype_xexpr:
-            ast_free_xexpr(ast);
-            break;
-        case asttype_imd_inline_app:
-            ast_free_imd_inline_app(ast);
-            break;
-        case asttype_imd_arrow:
-            ast_free_imd_arrow(ast);
-            break;
-    }
-    free(ast);
-}
-
 static void trailer_visit(ASTHD *ast, ast_visitor_fun visitor, void *arg) {
     AST_Trailer *trailer = (AST_Trailer *)ast;
 
@@ -660,29 +533,9 @@ void ast_visit(ASTHD **root, ast_visitor_fun visitor, void *arg) {
     visitor(root, arg);
 }
 
-void free_singlearg(ASTDS_PosArg* parg) {
-    ASTDS_PosArg *p, *next;
-    for(p = parg; p; p = next) {
-        next = p->next;
-        ast_free(p->param);
-        free(p);
-    }
-}
-
-void free_kwdarg(ASTDS_KwdArg* karg) {
-    ASTDS_KwdArg *p, *next;
-    for(p = karg; p; p = next) {
-        next = p->next;
-        free_dsstring(&p->name);
-        ast_free(p->param);
-        free(p);
-    }
-}
-
 ASTDS_String astds_strip_del_name(ASTHD *name) {
     ASTDS_String ret;
     ret = ((AST_Name *)name)->dstr;
-    ast_shallow_remove(name);
 
     return ret;
 }
@@ -691,7 +544,6 @@ ASTDS_String astds_strip_del_literal(ASTHD *literal) {
     ASTDS_String ret;
     ret = ((AST_Literal *)literal)->dstr;
 
-    ast_shallow_remove(literal);
     return ret;
 }
 /*
@@ -711,7 +563,9 @@ static void print_indent(int indent) {
         printf(" ");
 }
 static void println() { printf("\n"); }
-static void print_dsstring(ASTDS_String *dstr) { printf("%s", dstr->str); }
+static void print_dsstring(ASTDS_String *dstr) { printf("%.*s", (int)dstr->len, dstr->str); }
+/* fmt has one %.*s for dstr */
+static void print_dsstring_in(const char *fmt, ASTDS_String *dstr) { printf(fmt, (int)dstr->len, dstr->str); }
 static void print_arguments(ASTDS_Arguments *arg_info, int indent) {
     ASTDS_PosArg *pa;
     ASTDS_KwdArg *ka;
@@ -756,7 +610,7 @@ static void print_trailer(ASTHD *ast, int indent) {
     print_locinfo(ast);
     switch(trailer->trailer_type) {
         case trailer_attr:
-            printf("Attr(%s):\n", trailer->as.attr.str);
+            print_dsstring_in("Attr(%.*s):\n", &trailer->as.attr);
             print_ast(trailer->scope, indent+2);
             break;
         case trailer_array:
@@ -794,7 +648,7 @@ static void print_trailer(ASTHD *ast, int indent) {
 static void print_name(ASTHD *ast, int indent) {
     print_indent(indent);
     print_locinfo(ast);
-    printf("Name(%s)", ((AST_Name *)ast)->dstr.str);
+    print_dsstring_in("Name(%.*s)", &((AST_Name *)ast)->dstr);
     println();
 }
 
@@ -829,7 +683,7 @@ static void print_binop(ASTHD *ast, int indent) {
     AST_BinOp *binop = (AST_BinOp *)ast;
     print_indent(indent);
     print_locinfo(ast);
-    printf("Bin(%s):\n", binop->binop_str.str);
+    print_dsstring_in("Bin(%.*s):\n", &binop->binop_str);
     print_ast(binop->lhs, indent+2);
     print_ast(binop->rhs, indent+2);
     println();
@@ -839,7 +693,7 @@ static void print_unop(ASTHD *ast, int indent) {
     AST_UnOp *unop = (AST_UnOp *)ast;
     print_indent(indent);
     print_locinfo(ast);
-    printf("Un(%s):\n", unop->unop_str.str);
+    print_dsstring_in("Un(%.*s):\n", &unop->unop_str);
     print_ast(unop->param, indent+2);
     println();
 }
@@ -852,11 +706,11 @@ static void print_assign(ASTHD *ast, int indent) {
     switch(assign->lvalue_type) {
         case lvalue_name:
             print_indent(indent+2);
-            printf("to name -> %s\n", assign->lvalue_as.name.str);
+            print_dsstring_in("to name -> %.*s\n", &assign->lvalue_as.name);
             break;
         case lvalue_attr:
             print_indent(indent+2);
-            printf("Attr(%s) Of\n ->", assign->lvalue_as.attr.name.str);
+            print_dsstring_in("Attr(%.*s) Of\n ->", &assign->lvalue_as.attr.name);
             print_ast(assign->lvalue_as.attr.scope, indent+2);
             break;
         case lvalue_array:
@@ -881,7 +735,7 @@ static void print_suite(ASTHD *ast, int indent) {
     for(suite = (AST_Suite *)ast; suite; suite = suite->next) {
         if(suite->is_arrow) {
             print_indent(indent+2);
-            printf("%s ARROW(=>)\n", suite->arrow_lstring.str);
+            print_dsstring_in("%.*s ARROW(=>)\n", &suite->arrow_lstring);
         }
         print_ast(suite->param, indent + 2);
     }
@@ -3,6 +3,7 @@
 /*
  * Abstract Syntax Tree(AST)
  */
+#include "arena.h"
 
 /*
  * The definitions of several types of syntax node
@@ -35,9 +36,14 @@ typedef struct {
     ASTLoc loc;
 } ASTHD;
 
+/*
+ * str is not always null-terminated. Texts of tokens are slices of the
+ * source buffer unless escape sequences had to be processed, so the
+ * source has to outlive the AST. Use len.
+ */
 typedef struct {
     unsigned int len;
-    char *str; /* can be null. in this case, len is 0 */
+    const char *str; /* can be null. in this case, len is 0 */
 } ASTDS_String;
 
 typedef struct ASTDS_PosArg {
@@ -258,9 +264,16 @@ typedef struct {
     int parse_errcode;
 } ASTParseError;
 
+/*
+ * Nodes built by the functions below are allocated from the arena set by
+ * ast_use_arena in the calling thread, and are freed only with the arena.
+ * Returns the arena which was set before.
+ */
+Arena* ast_use_arena(Arena *arena);
+
 AST_Suite* reverse_suite(AST_Suite* suite);
 
-ASTHD* ast_access_attr(ASTHD *scope, const char *str);
+ASTHD* ast_access_attr(ASTHD *scope, ASTDS_String attr);
 ASTHD* ast_access_array(ASTHD *scope, ASTHD *index_param);
 
 ASTHD* ast_slice_lr(ASTHD *scope, ASTHD *left, ASTHD *right);
@@ -268,19 +281,19 @@ ASTHD* ast_slice_l(ASTHD *scope, ASTHD *left);
 ASTHD* ast_slice_r(ASTHD *scope, ASTHD *right);
 ASTHD* ast_slice_nolr(ASTHD *scope); // foo[:]
 
-ASTHD* ast_name(const char *str);
+ASTHD* ast_name(ASTDS_String dstr);
 ASTHD* ast_string_literal(const char *str);
-ASTHD* ast_sliced_string_literal(const char *str, int start, int len);
-void ast_string_literal_append(ASTHD *ast, char *str);
-ASTHD* ast_integer_literal(const char *str);
-ASTHD* ast_float_literal(const char *raw_str);
+ASTHD* ast_sliced_string_literal(ASTDS_String text, int start, int len);
+void ast_string_literal_append(ASTHD *ast, ASTDS_String dstr);
+ASTHD* ast_integer_literal(ASTDS_String dstr);
+ASTHD* ast_float_literal(ASTDS_String raw_dstr);
 ASTHD* ast_null_literal();
 ASTHD* ast_true_literal();
 ASTHD* ast_false_literal();
 
 
-ASTHD* ast_binop(const char *binop_str, ASTHD *lhs, ASTHD *rhs);
-ASTHD* ast_unop(const char *unop_str, ASTHD *param);
+ASTHD* ast_binop(ASTDS_String binop_str, ASTHD *lhs, ASTHD *rhs);
+ASTHD* ast_unop(ASTDS_String unop_str, ASTHD *param);
 
 ASTHD* ast_assign_name(short assign_type, ASTDS_String dstr, ASTHD *param);
 ASTHD* ast_assign_attr(short assign_type, ASTHD *scope, ASTDS_String attr_dstr, ASTHD *param);
@@ -291,20 +304,14 @@ ASTHD* ast_suite_cons_arrow_del(AST_Arrow *arrow, ASTHD *dst);
 
 ASTHD* ast_xexpr_single(ASTHD *head_expr, ASTDS_Arguments argument,
                         ASTHD *vert_suite); 
-ASTHD* ast_xexpr_double(const char *head_label_str, ASTHD *head_expr, ASTDS_Arguments argument,
+ASTHD* ast_xexpr_double(ASTDS_String head_label, ASTHD *head_expr, ASTDS_Arguments argument,
                         ASTHD *vert_suite);
 
 void ast_xexpr_set_vert_suite(AST_XExpr *xexpr, AST_Suite *vert_suite);
 
-void ast_free(ASTHD *ast);
-
 ASTDS_PosArg* astds_singlearg_cons(ASTHD *elem, ASTDS_PosArg* sarg);
 ASTDS_KwdArg* astds_kwdarg_cons(ASTDS_String dstr, ASTHD *elem, ASTDS_KwdArg *karg);
 
-void free_singlearg(ASTDS_PosArg* parg);
-void free_kwdarg(ASTDS_KwdArg* karg);
-void astds_free_arguments(ASTDS_Arguments *arguments);
-
 ASTDS_Arguments astds_arguments(ASTDS_PosArg *pargs,
                                 ASTDS_KwdArg *kargs,
                                 ASTHD *star,
@@ -313,17 +320,16 @@ ASTDS_Arguments astds_arguments(ASTDS_PosArg *pargs,
                                 ASTHD *damp);
 ASTDS_Arguments astds_empty_arguments();
 ASTHD* ast_inline_app(ASTHD *scope, ASTDS_Arguments arg_info);
-ASTHD* ast_arrow(const char *str, ASTHD *param);
+ASTHD* ast_arrow(ASTDS_String name, ASTHD *param);
 ASTHD* ast_arrow_with_literal_del(AST_Literal *literal, ASTHD *param);
 
-void ast_shallow_remove(ASTHD *ast);
-
 ASTDS_String make_dsstring(const char *str, int len);
+ASTDS_String dsstring_slice(const char *str, int len);
 ASTDS_String empty_dsstring();
 int dsstring_empty(ASTDS_String *dstr);
-void free_dsstring(ASTDS_String *dstr);
+int dsstring_equals(ASTDS_String *dstr, const char *str);
 ASTDS_String dsstring_from_str(const char *str);
-void dsstring_append(ASTDS_String *dstr, const char *src);
+void dsstring_append(ASTDS_String *dstr, ASTDS_String src);
 
 ASTDS_String astds_strip_del_name(ASTHD *name) ;
 ASTDS_String astds_strip_del_literal(ASTHD *literal);
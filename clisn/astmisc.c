@@ -13,11 +13,6 @@ void pres_set_error(ParseResult *pres, int err_code, const char *err_msg) {
     strncpy(pres->err_msg, err_msg, PARSE_MAX_ERR_MSG_CNT - 1);
 }
 
-void remove_parse_result(ParseResult *pres, int remove_ast) {
-    if(remove_ast && pres->result_ast)
-        ast_free(pres->result_ast);
-}
-
 ASTMISC_OneArg astmisc_onearg_pos(ASTHD *ast) {
     ASTMISC_OneArg ret;
     ret.type = onearg_pos;
@@ -26,10 +21,10 @@ ASTMISC_OneArg astmisc_onearg_pos(ASTHD *ast) {
 
     return ret;
 }
-ASTMISC_OneArg astmisc_onearg_pair(const char *str, ASTHD *value) {
+ASTMISC_OneArg astmisc_onearg_pair(ASTDS_String name, ASTHD *value) {
     ASTMISC_OneArg ret;
     ret.type = onearg_pair;
-    ret.name = dsstring_from_str(str);
+    ret.name = name;
     ret.value = value;
 
     return ret;
@@ -40,7 +35,6 @@ ASTMISC_OneArg astmisc_onearg_pair_with_literal_del(ASTHD *literal, ASTHD *value
     ret.name = ((AST_Literal *)literal)->dstr;
     ret.value = value;
 
-    ast_shallow_remove(literal);
     return ret;
 }
 ASTMISC_OneArg astmisc_onearg_pair_with_arrow_del(ASTHD *arrow) {
@@ -49,7 +43,6 @@ ASTMISC_OneArg astmisc_onearg_pair_with_arrow_del(ASTHD *arrow) {
     ret.name = ((AST_Arrow *)arrow)->name;
     ret.value = ((AST_Arrow *)arrow)->param;
 
-    ast_shallow_remove(arrow);
     return ret;
 
 }
@@ -82,10 +75,6 @@ ASTMISC_OneArg astmisc_onearg_damp(ASTHD *ast) {
     return ret;
 }
 
-void astmisc_remove_onearg(ASTMISC_OneArg *oarg) {
-    free_dsstring(&oarg->name);
-}
-
 void astmisc_check_arg_order(ASTMISC_OneArg new_onearg, ASTDS_Arguments arg_info, ParseResult *pres) {
     switch(new_onearg.type) {
         case onearg_pos:
@@ -165,13 +154,11 @@ ASTHD* astmisc_make_assign(short assign_type, ASTHD *lvalue, ASTHD *param, Parse
                     ASTHD *ret;
 
                     ret = ast_assign_attr(assign_type, scope, trailer->as.attr, param);
-                    ast_shallow_remove(&trailer->hd);
                     return ret;
                 } else if(trailer_type == trailer_array) {
                     ASTHD *ret;
 
                     ret = ast_assign_array(assign_type, scope, trailer->as.index_param, param);
-                    ast_shallow_remove(&trailer->hd);
                     return ret;
                 } 
             }
@@ -180,8 +167,6 @@ ASTHD* astmisc_make_assign(short assign_type, ASTHD *lvalue, ASTHD *param, Parse
 
     pres_set_error(pres, PARSE_ERR_ILLEGAL_LVALUE, "invalid l-value for definition/assignment");
     // HACK
-    ast_free(lvalue);
-    ast_free(param);
     return ast_string_literal("ERROR");
 }
 
@@ -227,15 +212,13 @@ void astmisc_args_prepend(ASTMISC_OneArg B, ASTDS_Arguments *C) {
 static ASTHD *imd_inline_to_single_xexpr(AST_InlineApp *iapp, ASTHD *vert_suite) {
     ASTHD *inside_scope = iapp->scope;
     ASTHD *ret = ast_xexpr_single(inside_scope, iapp->arg_info, vert_suite);
-    ast_shallow_remove(&iapp->hd);
 
     return ret;
 }
 
-static ASTHD *imd_inline_to_double_xexpr(AST_InlineApp *iapp, char *head_name, ASTHD *vert_suite) {
+static ASTHD *imd_inline_to_double_xexpr(AST_InlineApp *iapp, ASTDS_String head_name, ASTHD *vert_suite) {
     ASTHD *inside_scope = iapp->scope;
     ASTHD *ret = ast_xexpr_double(head_name, inside_scope, iapp->arg_info, vert_suite);
-    ast_shallow_remove(&iapp->hd);
 
     return ret;
 }
@@ -308,7 +291,7 @@ ASTHD *astmisc_vert_lookahead(ASTHD* scope, ASTHD *vert_suite, ASTDS_Arguments *
     }
 }
 
-ASTHD* astmisc_dexpr_lookahead(ASTHD *scope, char *head_name, ASTHD *vert_suite) {
+ASTHD* astmisc_dexpr_lookahead(ASTHD *scope, ASTDS_String head_name, ASTHD *vert_suite) {
     if(scope->node_type == asttype_imd_inline_app) {
         return imd_inline_to_double_xexpr((AST_InlineApp *)scope, head_name, vert_suite);
     } else {
@@ -328,7 +311,6 @@ ASTHD *convert_inline_app_to_xexpr(ASTHD *ast) {
         AST_InlineApp *iapp = (AST_InlineApp *)ast;
 
         ret = ast_xexpr_single(iapp->scope, iapp->arg_info, NULL);
-        ast_shallow_remove(ast);
         return ret;
     } else {
         return ast;
@@ -373,7 +355,6 @@ static void app_line_changer(ASTHD **p_ast, void *arg) {
         iapp = (AST_InlineApp *)root;
         ret = ast_xexpr_single(iapp->scope, iapp->arg_info, NULL);
         ret->loc = root->loc;
-        ast_shallow_remove(root);
         *p_ast = ret;
     }
 }
@@ -89,17 +89,16 @@ typedef struct {
     char err_msg[PARSE_MAX_ERR_MSG_CNT];
     int err_code;
 
-    /* this field may not be NULL even if error occurred. In that case, user should release it manually. */
+    /* this field may not be NULL even if error occurred. It lives in the arena of the parse. */
     ASTHD *result_ast;
 } ParseResult;
 
 void init_parse_result(ParseResult *pres);
 void pres_set_error(ParseResult *pres, int err_code, const char *err_msg);
-void remove_parse_result(ParseResult *pres, int remove_ast);
 
 
 ASTHD *astmisc_vert_lookahead(ASTHD* scope, ASTHD *vert_suite, ASTDS_Arguments *p_args);
-ASTHD* astmisc_dexpr_lookahead(ASTHD *scope, char *head_name, ASTHD *vert_suite);
+ASTHD* astmisc_dexpr_lookahead(ASTHD *scope, ASTDS_String head_name, ASTHD *vert_suite);
 ASTHD *astmisc_trailer_set_leaf_scope(ASTHD* trailers, ASTHD *leaf_scope);
 
 enum {
@@ -119,14 +118,13 @@ typedef struct {
 } ASTMISC_OneArg;
 
 ASTMISC_OneArg astmisc_onearg_pos(ASTHD *);
-ASTMISC_OneArg astmisc_onearg_pair(const char *str, ASTHD *value);
+ASTMISC_OneArg astmisc_onearg_pair(ASTDS_String name, ASTHD *value);
 ASTMISC_OneArg astmisc_onearg_pair_with_literal_del(ASTHD *literal, ASTHD *value);
 ASTMISC_OneArg astmisc_onearg_pair_with_arrow_del(ASTHD *arrow);
 ASTMISC_OneArg astmisc_onearg_star(ASTHD *);
 ASTMISC_OneArg astmisc_onearg_dstar(ASTHD *);
 ASTMISC_OneArg astmisc_onearg_amp(ASTHD *);
 ASTMISC_OneArg astmisc_onearg_damp(ASTHD *);
-void astmisc_remove_onearg(ASTMISC_OneArg *oarg);
 
 void astmisc_check_arg_order(ASTMISC_OneArg, ASTDS_Arguments, ParseResult *);
 ASTHD* astmisc_make_assign(short assign_type, ASTHD *lvalue, ASTHD *param, ParseResult *);
@@ -39,7 +39,14 @@ typedef struct {
     int curcol;
 
     int is_recording;
-    char *recording_buf;
+    /*
+     * Text of a token in a buffer is the slice starting at record_start.
+     * It is copied into recording_buf only when an escape sequence has to
+     * be replaced(record_copied). Texts are always copied for files.
+     */
+    int record_start;
+    int record_copied;
+    char *recording_buf; /* reused by every token */
     int recording_len;
     int recording_size;
 } Stream;
@@ -50,8 +57,9 @@ static inline void Stream_init_with_file(Stream* stream, FILE *file) {
     stream->curline = 1;
     stream->curcol = 1;
 
-    stream->recording_buf = NULL;
     stream->is_recording = 0;
+    stream->record_start = 0;
+    stream->record_copied = 1;
     stream->recording_len = 0;
 
     stream->as.file = file;
@@ -62,8 +70,9 @@ static inline void Stream_init_with_buffer(Stream* stream, const char* buffer, i
     stream->curline = 1;
     stream->curcol = 1;
 
-    stream->recording_buf = NULL;
     stream->is_recording = 0;
+    stream->record_start = 0;
+    stream->record_copied = 0;
     stream->recording_len = 0;
 
     stream->as.string.idx = 0;
@@ -71,33 +80,55 @@ static inline void Stream_init_with_buffer(Stream* stream, const char* buffer, i
     stream->as.string.buffer = buffer;
 }
 
+#define INITIAL_RECORDING_BUFFER_SIZE 256
+static inline void Stream_init_record(Stream* stream) {
+    stream->is_recording = 0;
+    stream->recording_size = INITIAL_RECORDING_BUFFER_SIZE;
+    stream->recording_buf = (char *)malloc(stream->recording_size * sizeof(char));
+    stream->recording_buf[0] = 0;
+    stream->recording_len = 0;
+}
+
 static inline void Stream_remove(Stream* stream) {
     if (stream->recording_buf) {
         free(stream->recording_buf);
     }
 }
 
-#define INITIAL_RECORDING_BUFFER_SIZE 16
 static inline void Stream_start_record(Stream* stream) {
-    if (stream->recording_buf) {
-        free(stream->recording_buf);
-    }
-
     stream->is_recording = 1;
-    stream->recording_size = INITIAL_RECORDING_BUFFER_SIZE;
-    stream->recording_buf = (char *)malloc(stream->recording_size * sizeof(char));
     stream->recording_buf[0] = 0;
     stream->recording_len = 0;
+    stream->record_copied = stream->is_file;
+    if (!stream->is_file) {
+        stream->record_start = stream->as.string.idx;
+    }
 }
 
-static inline char* Stream_end_record(Stream* stream) {
-    char* result = stream->recording_buf;
-
+static inline void Stream_end_record(Stream* stream) {
     stream->is_recording = 0;
-    stream->recording_size = 0;
-    stream->recording_buf = NULL;
-    stream->recording_len = 0;
-    return result;
+}
+
+static inline void Stream_reserve_record(Stream* stream, int len) {
+    if (len + 1 >= stream->recording_size) {
+        while (len + 1 >= stream->recording_size) {
+            stream->recording_size *= 2;
+        }
+        stream->recording_buf = (char *)realloc(stream->recording_buf, sizeof(char) * stream->recording_size);
+    }
+}
+
+/*
+ * Text recorded last. It is a slice of the buffer unless it had to be
+ * copied, in which case the copy is allocated from arena.
+ */
+static inline const char* Stream_record_text(Stream* stream, Arena *arena, unsigned int *len) {
+    if (stream->record_copied) {
+        *len = stream->recording_len;
+        return Arena_strndup(arena, stream->recording_buf, stream->recording_len);
+    }
+    *len = stream->as.string.idx - stream->record_start;
+    return stream->as.string.buffer + stream->record_start;
 }
 
 static inline void Stream_clear_record(Stream* stream) {
@@ -105,6 +136,10 @@ static inline void Stream_clear_record(Stream* stream) {
     if (stream->recording_buf) {
         stream->recording_buf[0] = 0;
     }
+    if (!stream->is_file) {
+        stream->record_copied = 0;
+        stream->record_start = stream->as.string.idx;
+    }
 }
 /*
  *
@@ -123,6 +158,15 @@ static inline void Stream_clear_record(Stream* stream) {
  */
 
 static inline void Stream_replace_record(Stream* stream, int pop_cnt, char* push_str, int push_strlen)  {
+    if (!stream->record_copied) {
+        int len = stream->as.string.idx - stream->record_start;
+
+        Stream_reserve_record(stream, len);
+        memcpy(stream->recording_buf, stream->as.string.buffer + stream->record_start, len);
+        stream->recording_buf[len] = 0;
+        stream->recording_len = len;
+        stream->record_copied = 1;
+    }
     if (stream->recording_len < pop_cnt) {
         stream->recording_len = 0;
     } else {
@@ -130,12 +174,7 @@ static inline void Stream_replace_record(Stream* stream, int pop_cnt, char* push
     }
 
     if (stream->recording_buf) {
-        if (stream->recording_len + push_strlen + 1 >= stream->recording_size) {
-            while (stream->recording_len + push_strlen + 1 >= stream->recording_size) {
-                stream->recording_size *= 2;
-            }
-            stream->recording_buf = (char *)realloc(stream->recording_buf, sizeof(char) * stream->recording_size);
-        }
+        Stream_reserve_record(stream, stream->recording_len + push_strlen);
         char *p = stream->recording_buf;
         int i;
         for (i = 0; i < push_strlen; i++) {
@@ -162,7 +201,7 @@ static inline int Stream_pop(Stream* stream) {
     } else {
         if (stream->as.string.idx >= stream->as.string.len)
             return CHAR_EOF;
-        result = stream->as.string.buffer[stream->as.string.idx++];
+        result = (unsigned char)stream->as.string.buffer[stream->as.string.idx++];
     }
     if (result == '\n') {
         stream->curline++;
@@ -171,7 +210,7 @@ static inline int Stream_pop(Stream* stream) {
         stream->curcol++;
     }
 
-    if (stream->is_recording) {
+    if (stream->is_recording && stream->record_copied) {
         if (stream->recording_len + 1 >= stream->recording_size) {
             stream->recording_size *= 2;
             stream->recording_buf = (char *)realloc(stream->recording_buf, sizeof(char) * stream->recording_size);
@@ -197,7 +236,7 @@ static inline int Stream_peek(Stream* stream) {
     } else {
         if (stream->as.string.idx >= stream->as.string.len)
             return CHAR_EOF;
-        result = stream->as.string.buffer[stream->as.string.idx];
+        result = (unsigned char)stream->as.string.buffer[stream->as.string.idx];
     }
     return result;
 }
@@ -227,10 +266,14 @@ typedef struct Lexer {
     int last_error_code;
 
     char repr_indent_char;
+
+    LexLineStart line_start; /* of the line being lexed */
+    int ended_at_line_start;
+
+    Arena *arena; /* tokens are allocated from it */
 } Lexer;
 
-static inline Lexer* init_lexer() {
-    Lexer *lexer = (Lexer *)malloc(sizeof(Lexer));
+static inline void init_lexer(Lexer *lexer, Arena *arena) {
     // set up indent stack
     lexer->ind_stack[0] = 0;
     lexer->ind_stack_len = 1;
@@ -246,18 +289,41 @@ static inline Lexer* init_lexer() {
     lexer->repr_indent_char = 0;
     lexer->is_newline_phase = 0;
     lexer->is_end = 0;
+
+    lexer->line_start.sline = 1;
+    lexer->line_start.first_line = 1;
+    lexer->line_start.indent_char = 0;
+    lexer->line_start.dedented = 0;
+    lexer->ended_at_line_start = 0;
+
+    lexer->arena = arena;
+}
+
+Lexer* Lexer_new(void) {
+    Lexer *lexer = (Lexer *)malloc(sizeof(Lexer));
+    Stream_init_record(&lexer->stream);
     return lexer;
 }
 
-Lexer* Lexer_init_with_file(FILE *file) {
-    Lexer* lexer = init_lexer();
+void Lexer_reset_with_file(Lexer *lexer, FILE *file, Arena *arena) {
+    init_lexer(lexer, arena);
     Stream_init_with_file(&lexer->stream, file);
-    return lexer;
 }
 
-Lexer* Lexer_init_with_bytes(const char* bytes, int len) {
-    Lexer* lexer = init_lexer();
+void Lexer_reset_with_bytes(Lexer *lexer, const char* bytes, int len, Arena *arena) {
+    init_lexer(lexer, arena);
     Stream_init_with_buffer(&lexer->stream, bytes, len);
+}
+
+Lexer* Lexer_init_with_file(FILE *file, Arena *arena) {
+    Lexer* lexer = Lexer_new();
+    Lexer_reset_with_file(lexer, file, arena);
+    return lexer;
+}
+
+Lexer* Lexer_init_with_bytes(const char* bytes, int len, Arena *arena) {
+    Lexer* lexer = Lexer_new();
+    Lexer_reset_with_bytes(lexer, bytes, len, arena);
     return lexer;
 }
 
@@ -296,6 +362,16 @@ static inline int ind_stack_empty(Lexer *lexer) {
     return (lexer->ind_stack_len == 0);
 }
 
+void Lexer_continue_at_line(Lexer *lexer, const LexLineStart *at) {
+    lexer->stream.curline = at->sline;
+    lexer->repr_indent_char = at->indent_char;
+    lexer->is_newline_phase = 1;
+    if (at->dedented) {
+        // a level which the first line closes, as it did in the other source
+        ind_stack_push(lexer, 1);
+    }
+}
+
 static void flush_ind_stack(Lexer *lexer) {
     int t;
 
@@ -436,6 +512,8 @@ static inline int lex_once(Lexer *lexer) {
         return TOKEN_EOF;
     } else if (lexer->is_newline_phase) {
         lexer->is_newline_phase = 0;
+        lexer->line_start.sline = lexer->stream.curline;
+        lexer->line_start.indent_char = lexer->repr_indent_char;
 
         int next_indent_level = 0;
         int lookahead = Stream_peek(&lexer->stream);
@@ -470,11 +548,14 @@ static inline int lex_once(Lexer *lexer) {
         if (lookahead == CHAR_EOF) {
             flush_ind_stack(lexer);
             lexer->is_end = 1;
+            lexer->ended_at_line_start = 1;
             Stream_clear_record(&lexer->stream);
             return lex_once(lexer);
         }
+        lexer->line_start.first_line = lexer->stream.curline;
 
         int t = ind_stack_peek(lexer);
+        lexer->line_start.dedented = t > next_indent_level;
         if (ind_stack_empty(lexer)) {
             error(lexer, LEXERR_FATAL_ERROR, "FATAL INDENT ERROR");
             return TOKEN_ERROR;
@@ -769,7 +850,8 @@ static inline int lex_once(Lexer *lexer) {
 
 LexToken* Lexer_lex(Lexer *lexer, LexError *lexerr) {
     LexToken* result;
-    char *text;
+    const char *text;
+    unsigned int text_len;
     int sline, eline, scol, ecol;
 
     sline = lexer->stream.curline;
@@ -777,20 +859,20 @@ LexToken* Lexer_lex(Lexer *lexer, LexError *lexerr) {
 
     Stream_start_record(&lexer->stream);
     int token = lex_once(lexer);
-    text = Stream_end_record(&lexer->stream);
+    Stream_end_record(&lexer->stream);
 
     if (token == TOKEN_EOF) {
-        free(text);
         return NULL;
     }
+    text = Stream_record_text(&lexer->stream, lexer->arena, &text_len);
 
     eline = lexer->stream.curline;
     ecol = lexer->stream.curcol;
 
-    result = (LexToken *)malloc(sizeof(LexToken));
+    result = (LexToken *)Arena_alloc(lexer->arena, sizeof(LexToken));
     result->token = token;
     result->text = text;
-    result->text_len = strlen(text);
+    result->text_len = text_len;
     result->sline = sline;
     result->eline = eline;
     result->scol = scol;
@@ -806,10 +888,6 @@ LexToken* Lexer_lex(Lexer *lexer, LexError *lexerr) {
     return result;
 }
 
-void Lexer_remove_token(LexToken *tok) {
-    free(tok->text);
-    free(tok);
-}
 int Lexer_current_line(Lexer *lexer) {
     return lexer->stream.curline;
 }
@@ -818,6 +896,22 @@ int Lexer_current_col(Lexer *lexer) {
     return lexer->stream.curcol;
 }
 
+int Lexer_indent_depth(Lexer *lexer) {
+    return lexer->ind_stack_len - 1;
+}
+
+char Lexer_indent_char(Lexer *lexer) {
+    return lexer->repr_indent_char;
+}
+
+void Lexer_line_start(Lexer *lexer, LexLineStart *out) {
+    *out = lexer->line_start;
+}
+
+int Lexer_ended_at_line_start(Lexer *lexer) {
+    return lexer->ended_at_line_start;
+}
+
 void Lexer_remove(Lexer *lexer) {
     Stream_remove(&lexer->stream);
     free(lexer);
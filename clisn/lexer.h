@@ -1,4 +1,5 @@
 #include <stdio.h>
+#include "arena.h"
 
 #define YY_MAX_STACK_SIZE 1024
 #define LEXERR_MAX_STRING_CNT 128
@@ -25,19 +26,49 @@ typedef struct LexError {
 typedef struct LexToken {
     int error_occurred;
     int token;
-    char *text;
+    /* not null-terminated. it may point into the bytes being lexed */
+    const char *text;
     unsigned int text_len;
 
     int sline, eline;
     int scol, ecol;
 } LexToken;
 
-Lexer* Lexer_init_with_file(FILE *file);
-Lexer* Lexer_init_with_bytes(const char* bytes, int len);
+/*
+ * Where a line began. Lines holding only spaces and comments are skipped
+ * before a line, so sline(where skipping began) may be less than
+ * first_line(where its first token is).
+ */
+typedef struct LexLineStart {
+    int sline;
+    int first_line;
+    char indent_char; /* indentation character known before skipping. 0 if none */
+    char dedented; /* whether it closed lines indented more than it */
+} LexLineStart;
+
+/*
+ * Tokens are allocated from the arena given to the lexer and live as long
+ * as the arena does. A lexer can be reset to scan another source.
+ */
+Lexer* Lexer_new(void);
+void Lexer_reset_with_file(Lexer *lexer, FILE *file, Arena *arena);
+void Lexer_reset_with_bytes(Lexer *lexer, const char* bytes, int len, Arena *arena);
+/*
+ * Called right after a reset when the source continues another one at a
+ * line of indentation level 0, which began as at tells.
+ */
+void Lexer_continue_at_line(Lexer *lexer, const LexLineStart *at);
+Lexer* Lexer_init_with_file(FILE *file, Arena *arena);
+Lexer* Lexer_init_with_bytes(const char* bytes, int len, Arena *arena);
 LexToken* Lexer_lex(Lexer *lexer, LexError *lexerr);
 void Lexer_last_error(LexError *err);
 
-void Lexer_remove_token(LexToken *);
 int Lexer_current_line(Lexer *lexer);
 int Lexer_current_col(Lexer *lexer);
+int Lexer_indent_depth(Lexer *lexer);
+char Lexer_indent_char(Lexer *lexer);
+/* of the line of the last token */
+void Lexer_line_start(Lexer *lexer, LexLineStart *out);
+/* whether the source ended with a NEWLINE, outside brackets and strings */
+int Lexer_ended_at_line_start(Lexer *lexer);
 void Lexer_remove(Lexer *lexer);
@@ -5,6 +5,7 @@
 
 int main() {
     FILE *f;
+    Arena *arena;
     Lexer *lexer;
     LexToken *lexres;
     LexError lexerr;
@@ -15,10 +16,12 @@ int main() {
     lst_cnt = 0;
 
     f = fopen("lextest.lidl", "r");
-    lexer = Lexer_init_with_file(f);
+    arena = Arena_new();
+    lexer = Lexer_init_with_file(f, arena);
     while(1) {
         int token;
-        char* text;
+        const char* text;
+        int text_len;
         lexres = Lexer_lex(lexer, &lexerr);
         if (!lexres) {
             printf("EOF\n");
@@ -26,10 +29,10 @@ int main() {
         }
         token = lexres->token;
         text = lexres->text;
+        text_len = lexres->text_len;
         if(lexres->error_occurred) {
             printf("ERROR! error code=>%d\nerror msg=>%s\n", lexerr.code, lexerr.msg);
             printf("(%d, %d)-(%d, %d)\n", lexres->sline, lexres->scol, lexres->sline, lexres->ecol - 1);
-            Lexer_remove_token(lexres);
             break;
         } else { 
             switch(token) {
@@ -47,10 +50,12 @@ int main() {
                     break;
             }
         }
-        printf("%d\t %s (%d)\n", token, text, (int)strlen(text));
-        Lexer_remove_token(lexres);
+        if(text != lexres->text)
+            text_len = strlen(text);
+        printf("%d\t %.*s (%d)\n", token, text_len, text, text_len);
     }
     fclose(f);
     Lexer_remove(lexer);
+    Arena_remove(arena);
     return 0;
 }
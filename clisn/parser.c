@@ -50,15 +50,85 @@ static void suite_reverser(ASTHD **ast, void *arg) {
     }
 }
 
-static ASTHD* do_parse(Lexer* lexer, LexParseError *err_out) {
+struct Parser {
+    Lexer *lexer;
+    void *lemon_parser;
+    Arena *arena; /* holds tokens and the AST of the last parse */
+
+    LexLineStart *blocks; /* of the last parse */
+    int blocks_cnt;
+    int blocks_capacity;
+};
+
+Parser* Parser_new(void) {
+    Parser *parser = (Parser *)malloc(sizeof(Parser));
+
+    parser->lexer = Lexer_new();
+    parser->lemon_parser = LEMONParseAlloc(malloc);
+    parser->arena = Arena_new();
+    parser->blocks = NULL;
+    parser->blocks_cnt = 0;
+    parser->blocks_capacity = 0;
+    return parser;
+}
+
+void Parser_remove(Parser *parser) {
+    Lexer_remove(parser->lexer);
+    LEMONParseFree(parser->lemon_parser, free);
+    Arena_remove(parser->arena);
+    free(parser->blocks);
+    free(parser);
+}
+
+Arena* Parser_detach_arena(Parser *parser) {
+    Arena *ret = parser->arena;
+    parser->arena = Arena_new();
+    return ret;
+}
+
+const LexLineStart* Parser_blocks(Parser *parser, int *cnt) {
+    *cnt = parser->blocks_cnt;
+    return parser->blocks;
+}
+
+char Parser_indent_char(Parser *parser) {
+    return Lexer_indent_char(parser->lexer);
+}
+
+int Parser_ended_at_line_start(Parser *parser) {
+    return Lexer_ended_at_line_start(parser->lexer);
+}
+
+static void add_block(Parser *parser, int first_sline) {
+    LexLineStart *block;
+
+    if(parser->blocks_cnt == parser->blocks_capacity) {
+        parser->blocks_capacity = parser->blocks_capacity? parser->blocks_capacity * 2 : 64;
+        parser->blocks = (LexLineStart *)realloc(parser->blocks,
+                                                 sizeof(LexLineStart) * parser->blocks_capacity);
+        if(!parser->blocks)
+            abort();
+    }
+    block = &parser->blocks[parser->blocks_cnt];
+    Lexer_line_start(parser->lexer, block);
+    if(parser->blocks_cnt == 0) {
+        // the first block owns whatever precedes it
+        block->sline = first_sline;
+    }
+    parser->blocks_cnt++;
+}
+
+static ASTHD* do_parse(Parser *parser, int first_sline, int skip_dedent, LexParseError *err_out) {
+    Lexer *lexer = parser->lexer;
     LexToken *lextok;
     LexError lexerr;
     ParseResult parseres;
-    void *parser;
+    Arena *prev_arena;
     int success;
+    int after_newline;
 
     int token;
-    char *text;
+    const char *text;
     int tok_sline, tok_eline, tok_scol, tok_ecol;
     
 #ifdef _BENCHMARK
@@ -68,10 +138,12 @@ static ASTHD* do_parse(Lexer* lexer, LexParseError *err_out) {
 
     err_out->error_occurred = 0;
 
-    parser = LEMONParseAlloc(malloc);
+    prev_arena = ast_use_arena(parser->arena);
     init_parse_result(&parseres);
+    parser->blocks_cnt = 0;
 
     success = 1;
+    after_newline = 1;
     do {
         lextok = Lexer_lex(lexer, &lexerr);
         if(!lextok) { // EOF
@@ -90,11 +162,11 @@ static ASTHD* do_parse(Lexer* lexer, LexParseError *err_out) {
             tok_scol = lextok->scol;
             tok_ecol = lextok->ecol;
 #ifdef _DBG_VERBOSE
-            DBG_LOG("feeding(%d)[line:%d~%d, col:%d~%d]:%s\n",
+            DBG_LOG("feeding(%d)[line:%d~%d, col:%d~%d]:%.*s\n",
                      token,
                      lextok->sline, lextok->eline,
                      lextok->scol, lextok->ecol - 1,
-                     text);
+                     (int)lextok->text_len, text);
 #endif
         }
         if(lextok && lextok->error_occurred) {
@@ -107,14 +179,26 @@ static ASTHD* do_parse(Lexer* lexer, LexParseError *err_out) {
             err_out->ecol = tok_ecol;
             strncpy(err_out->err_msg, lexerr.msg, MAX_LEX_PARSE_ERROR_MSG);
             success = 0;
-
-            // Parser is supposed to free tokens which are fed to itself. 
-            // But, here is not the case, freeing lextok is our duty here
-            // because the token is not fed to parser yet.
-            Lexer_remove_token(lextok); 
             break;
         }
-        LEMONParse(parser, token, lextok, &parseres);
+        if(token == DEDENT && skip_dedent) {
+            // made by Lexer_continue_at_line. the grammar does not expect it
+            skip_dedent = 0;
+            continue;
+        }
+        /*
+         * A top-level expression begins a block, that is the first token
+         * of a line at indentation level 0 except '--' continuing the one
+         * before.
+         */
+        if(token == NEWLINE) {
+            after_newline = 1;
+        } else if(token && token != INDENT && token != DEDENT) {
+            if(after_newline && token != DMINUS_NEWLINE && Lexer_indent_depth(lexer) == 0)
+                add_block(parser, first_sline);
+            after_newline = 0;
+        }
+        LEMONParse(parser->lemon_parser, token, lextok, &parseres);
         if(parseres.error_occurred) {
             err_out->error_occurred = 1;
             err_out->is_lexerr = 0;
@@ -136,9 +220,13 @@ static ASTHD* do_parse(Lexer* lexer, LexParseError *err_out) {
         // Change all intermediates to complete syntax form
         astmisc_convert_all_inline_app(&parseres.result_ast);
     } else {
-        remove_parse_result(&parseres, 1);
+        // The lemon parser may be stopped in the middle of the input.
+        // Its stack only refers to the arena, so it is simply replaced.
+        LEMONParseFree(parser->lemon_parser, free);
+        parser->lemon_parser = LEMONParseAlloc(malloc);
+        parseres.result_ast = NULL;
     }
-    LEMONParseFree(parser, free);
+    ast_use_arena(prev_arena);
 
 #ifdef _BENCHMARK
     gettimeofday(&ed, NULL);
@@ -147,25 +235,22 @@ static ASTHD* do_parse(Lexer* lexer, LexParseError *err_out) {
     return parseres.result_ast;
 }
 
-ASTHD* parse_file(FILE *f, LexParseError *err_out) {
-    Lexer *lexer;
-    ASTHD *ret;
-
-    lexer = Lexer_init_with_file(f);
-    ret = do_parse(lexer, err_out);
-    Lexer_remove(lexer);
-
-    return ret;
+ASTHD* Parser_parse_file(Parser *parser, FILE *f, LexParseError *err_out) {
+    Arena_reset(parser->arena);
+    Lexer_reset_with_file(parser->lexer, f, parser->arena);
+    return do_parse(parser, 1, 0, err_out);
 }
 
+ASTHD* Parser_parse_bytes(Parser *parser, const char *bytes, int len, LexParseError *err_out) {
+    Arena_reset(parser->arena);
+    Lexer_reset_with_bytes(parser->lexer, bytes, len, parser->arena);
+    return do_parse(parser, 1, 0, err_out);
+}
 
-ASTHD* parse_bytes(const char *bytes, int len, LexParseError *err_out) {
-    Lexer *lexer;
-    ASTHD *ret;
-
-    lexer = Lexer_init_with_bytes(bytes, len);
-    ret = do_parse(lexer, err_out);
-    Lexer_remove(lexer);
-
-    return ret;
+ASTHD* Parser_parse_bytes_at(Parser *parser, const char *bytes, int len, const LexLineStart *at,
+                             LexParseError *err_out) {
+    Arena_reset(parser->arena);
+    Lexer_reset_with_bytes(parser->lexer, bytes, len, parser->arena);
+    Lexer_continue_at_line(parser->lexer, at);
+    return do_parse(parser, at->sline, at->dedented, err_out);
 }
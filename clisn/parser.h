@@ -11,5 +11,36 @@ typedef struct {
     int sline, eline, scol, ecol;
 } LexParseError;
 
-ASTHD* parse_file(FILE *f, LexParseError *err_out);
-ASTHD* parse_bytes(const char *bytes, int len, LexParseError *err_out);
+/*
+ * A parser can be reused for any number of parses. The AST returned by
+ * Parser_parse_* lives in the arena of the parser, so it is valid until
+ * the next parse or Parser_remove, unless the arena is taken away with
+ * Parser_detach_arena beforehand.
+ */
+typedef struct Parser Parser;
+
+Parser* Parser_new(void);
+void Parser_remove(Parser *parser);
+ASTHD* Parser_parse_file(Parser *parser, FILE *f, LexParseError *err_out);
+/* strings in the AST may be slices of bytes, so bytes has to outlive the AST */
+ASTHD* Parser_parse_bytes(Parser *parser, const char *bytes, int len, LexParseError *err_out);
+/*
+ * Parse bytes which continue another source at a line of indentation level
+ * 0, e.g. some lines of it cut out at the start of a block. at tells how
+ * the line began in the other source(see Parser_blocks).
+ */
+ASTHD* Parser_parse_bytes_at(Parser *parser, const char *bytes, int len, const LexLineStart *at,
+                             LexParseError *err_out);
+/* the arena holding the last AST, now owned by the caller. the parser gets a new one */
+Arena* Parser_detach_arena(Parser *parser);
+
+/*
+ * Every top-level expression of the last parse begins a block, which lasts
+ * until the next one. Where the first line of each block began, in order.
+ * The first block also owns the lines before it.
+ */
+const LexLineStart* Parser_blocks(Parser *parser, int *cnt);
+/* the indentation character found by the last parse, 0 if none */
+char Parser_indent_char(Parser *parser);
+/* whether the last parse ended right after a NEWLINE outside brackets and strings */
+int Parser_ended_at_line_start(Parser *parser);
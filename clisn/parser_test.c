@@ -6,20 +6,21 @@
 
 int main() {
     FILE *fp;
+    Parser *parser;
     LexParseError err;
     ASTHD *ast;
 
     fp = fopen("lextest.lidl", "r");
+    parser = Parser_new();
 
 #ifdef USE_FILE
-    ast = parse_file(fp, &err);
+    ast = Parser_parse_file(parser, fp, &err);
     if(err.error_occurred) {
         printf("ERROR!\n");
         printf("%s\n", err.err_msg);
     } else {
         printf("==>result<==\n");
         ast_dbg_print(ast);
-        ast_free(ast);
     }
 #elif defined(USE_BYTES)
     char *source;
@@ -32,7 +33,7 @@ int main() {
     source = (char *)calloc(len + 1, 1);
     fread(source, 1, len, fp);
 
-    ast = parse_bytes(source, len, &err);
+    ast = Parser_parse_bytes(parser, source, len, &err);
     if(err.error_occurred) {
         printf("ERROR!\n");
         printf("line:%d-%d\n", err.sline, err.eline);
@@ -41,7 +42,6 @@ int main() {
     } else {
         printf("==>result<==\n");
         ast_dbg_print(ast);
-        ast_free(ast);
     }
 
     free(source);
@@ -49,5 +49,6 @@ int main() {
 # error "specify kind of error test"
 #endif
     fclose(fp);
+    Parser_remove(parser);
     return 0;
 }
@@ -8,6 +8,12 @@
 #include <Python.h>
 #include <stdio.h>
 #include <stdlib.h>
+#include <string.h>
+#include <limits.h>
+#include <errno.h>
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/stat.h>
 
 #include "clisn/ast.h"
 #include "clisn/parser.h"
@@ -88,7 +94,7 @@ static PyObject* dictify_trailer(ASTHD *ast) {
         case trailer_attr:
             {
                 PyObject *attr;
-                attr = PyString_FromString(trailer->as.attr.str);
+                attr = PyString_FromStringAndSize(trailer->as.attr.str, trailer->as.attr.len);
                 trailer_type = PyString_FromString("attr");
                 PyDict_SetItemString(ret, "attr", attr);
                 Py_XDECREF(attr);
@@ -146,7 +152,7 @@ static PyObject* dictify_name(ASTHD *ast) {
     AST_Name *name = (AST_Name *)ast;
     PyObject *ret;
 
-    ret = Py_BuildValue("{s:s,s:s}", "type", "name", "name", name->dstr.str);
+    ret = Py_BuildValue("{s:s,s:s#}", "type", "name", "name", name->dstr.str, (int)name->dstr.len);
 
     return ret;
 }
@@ -175,10 +181,10 @@ static PyObject* dictify_literal(ASTHD *ast) {
             literal_type_name = "unknown";
             break;
     }
-    ret = Py_BuildValue("{s:s,s:s,s:s}",
+    ret = Py_BuildValue("{s:s,s:s,s:s#}",
             "type", "literal", 
             "literal_type", literal_type_name,
-            "content", literal->dstr.str);
+            "content", literal->dstr.str, (int)literal->dstr.len);
 
 
     return ret;
@@ -193,9 +199,9 @@ static PyObject* dictify_literal(ASTHD *ast) {
 static PyObject* dictify_binop(ASTHD *ast) {
     AST_BinOp *binop = (AST_BinOp *)ast;
 
-    return Py_BuildValue("{s:s,s:s,s:N,s:N}", 
+    return Py_BuildValue("{s:s,s:s#,s:N,s:N}", 
             "type", "binop",
-            "op", binop->binop_str.str,
+            "op", binop->binop_str.str, (int)binop->binop_str.len,
             "lhs", dictify_ast(binop->lhs),
             "rhs", dictify_ast(binop->rhs));
 } 
@@ -206,9 +212,9 @@ static PyObject* dictify_binop(ASTHD *ast) {
  */ 
 static PyObject* dictify_unop(ASTHD *ast) {
     AST_UnOp *unop = (AST_UnOp *)ast;
-    return Py_BuildValue("{s:s,s:s,s:N}",
+    return Py_BuildValue("{s:s,s:s#,s:N}",
             "type", "unop",
-            "op", unop->unop_str.str,
+            "op", unop->unop_str.str, (int)unop->unop_str.len,
             "param", dictify_ast(unop->param));
 }
 
@@ -251,7 +257,7 @@ static PyObject* dictify_assign(ASTHD *ast) {
         case lvalue_name:
             {
             PyObject *lvalue_name;
-            lvalue_name = PyString_FromString(assign->lvalue_as.name.str);
+            lvalue_name = PyString_FromStringAndSize(assign->lvalue_as.name.str, assign->lvalue_as.name.len);
             
             PyDict_SetItemString(ret, "lvalue_name", lvalue_name);
             Py_XDECREF(lvalue_name);
@@ -262,7 +268,7 @@ static PyObject* dictify_assign(ASTHD *ast) {
         case lvalue_attr:
             {
             PyObject *lvalue_name, *lvalue_scope;
-            lvalue_name = PyString_FromString(assign->lvalue_as.attr.name.str);
+            lvalue_name = PyString_FromStringAndSize(assign->lvalue_as.attr.name.str, assign->lvalue_as.attr.name.len);
             lvalue_scope = dictify_ast(assign->lvalue_as.attr.scope);
             PyDict_SetItemString(ret, "lvalue_name", lvalue_name);
             PyDict_SetItemString(ret, "lvalue_scope", lvalue_scope);
@@ -324,10 +330,10 @@ static PyObject* dictify_suite(ASTHD *ast) {
     for(p = suite; p; p = p->next) {
         PyObject* item;
         if(p->is_arrow) {
-            item = Py_BuildValue("{s:O,s:N,s:s}",
+            item = Py_BuildValue("{s:O,s:N,s:s#}",
                     "is_arrow", Py_True,
                     "param", dictify_ast(p->param),
-                    "arrow_lstring", p->arrow_lstring.str);
+                    "arrow_lstring", p->arrow_lstring.str, (int)p->arrow_lstring.len);
         } else {
             item = Py_BuildValue("{s:O,s:N}",
                     "is_arrow", Py_False,
@@ -385,7 +391,7 @@ static PyObject* dictify_arguments(ASTDS_Arguments* arguments) {
     for(kp = arguments->kargs; kp; kp = kp->next) {
         PyList_SET_ITEM(
                 karg_lst, i,
-                Py_BuildValue("sN", kp->name.str, dictify_ast(kp->param)));
+                Py_BuildValue("s#N", kp->name.str, (int)kp->name.len, dictify_ast(kp->param)));
         i++;
     }
 
@@ -448,7 +454,7 @@ static PyObject* dictify_xexpr(ASTHD *ast) {
 
     if(xexpr->has_head_label) {
         PyObject *hn;
-        hn = PyString_FromString(xexpr->head_label.str);
+        hn = PyString_FromStringAndSize(xexpr->head_label.str, xexpr->head_label.len);
         PyDict_SetItemString(ret, "head_label", hn);
         Py_XDECREF(hn);
     }
@@ -526,86 +532,1586 @@ static PyObject* safe_dictify_ast(ASTHD *ast) {
     }
 }
 
-static PyObject* str2lisn(PyObject *self, PyObject* args) {
-    const char* source; // barrowed
-    int source_size;
-    LexParseError err;
-    ASTHD *ast;
+/*
+ * Lazily materialized LISN nodes
+ *
+ * loads(..., lazy=True) returns LISNNode objects instead of dicts. A node
+ * is a read-only mapping with the same keys and values as the dict which
+ * dictify_ast would build, but its values are built from the C AST only
+ * when they are accessed, and then cached in the node. Keys and constant
+ * strings are interned once, names are interned, and locinfo is
+ * a Location, that is a 4-tuple (sline, eline, scol, ecol) which also
+ * accepts those names as keys and compares equal to the locinfo dict.
+ * Nodes are not dict instances; to_dict() returns the eager form.
+ *
+ * Every node keeps a reference to the _LISNTree which owns the arena of
+ * the C AST and the source string, so that the AST is freed when the last
+ * node of it is gone.
+ */
+
+enum {
+    K_type, K_locinfo,
+    K_scope, K_trailer_type, K_attr, K_index_param, K_left_slice, K_right_slice,
+    K_name,
+    K_literal_type, K_content,
+    K_op, K_lhs, K_rhs, K_param,
+    K_lvalue_type, K_lvalue_name, K_lvalue_scope, K_lvalue_index,
+    K_exprs, K_is_arrow, K_arrow_lstring,
+    K_has_head_label, K_has_vert_suite, K_arg_info, K_head_expr, K_head_label, K_vert_suite,
+    K_pargs, K_kargs,
+    K_has_star, K_has_dstar, K_has_amp, K_has_damp,
+    K_star, K_dstar, K_amp, K_damp,
+    K_COUNT
+};
+
+static const char *key_names[K_COUNT] = {
+    "type", "locinfo",
+    "scope", "trailer_type", "attr", "index_param", "left_slice", "right_slice",
+    "name",
+    "literal_type", "content",
+    "op", "lhs", "rhs", "param",
+    "lvalue_type", "lvalue_name", "lvalue_scope", "lvalue_index",
+    "exprs", "is_arrow", "arrow_lstring",
+    "has_head_label", "has_vert_suite", "arg_info", "head_expr", "head_label", "vert_suite",
+    "pargs", "kargs",
+    "has_star", "has_dstar", "has_amp", "has_damp",
+    "star", "dstar", "amp", "damp"
+};
+
+static PyObject *key_strings[K_COUNT]; /* interned */
+static PyObject *key_indices; /* key string -> K_* */
+
+/* interned string values */
+enum {
+    S_trailer, S_name, S_literal, S_binop, S_unop, S_assign, S_suite, S_xexpr,
+    S_attr, S_array, S_slice,
+    S_string, S_integer, S_float, S_unknown,
+    S_assign_normal, S_assign_def,
+    S_COUNT
+};
+
+static const char *const_names[S_COUNT] = {
+    "trailer", "name", "literal", "binop", "unop", "assign", "suite", "xexpr",
+    "attr", "array", "slice",
+    "string", "integer", "float", "unknown",
+    "=", ":="
+};
+
+static PyObject *const_strings[S_COUNT];
+
+#define MAX_NODE_KEYS 12
+
+enum {
+    node_ast,        /* ASTHD* except for suites */
+    node_suite,      /* AST_Suite*, NULL for an empty suite */
+    node_suite_item, /* AST_Suite* */
+    node_arguments   /* ASTDS_Arguments* */
+};
+
+typedef struct {
+    PyObject_HEAD
+    ASTHD *ast; /* NULL for an empty suite */
+    Arena *arena; /* holds ast */
+    PyObject *source; /* str whose bytes strings of ast are sliced from */
+} LISNTreeObject;
+
+typedef struct {
+    PyObject_HEAD
+    PyObject *tree;   /* LISNTreeObject which owns ptr */
+    void *ptr;
+    short kind;
+    short has_loc;
+    PyObject **slots; /* values in order of node_keys(), NULL until accessed */
+} LISNNodeObject;
+
+static PyTypeObject LISNTree_Type = {PyVarObject_HEAD_INIT(NULL, 0)};
+static PyTypeObject LISNNode_Type = {PyVarObject_HEAD_INIT(NULL, 0)};
+static PyTypeObject Location_Type = {PyVarObject_HEAD_INIT(NULL, 0)};
+
+static void lisntree_dealloc(LISNTreeObject *self) {
+    Arena_remove(self->arena);
+    Py_XDECREF(self->source);
+    PyObject_Del(self);
+}
+
+/*
+ * Location
+ */
+static const char *location_names[4] = {"sline", "eline", "scol", "ecol"};
+
+static PyObject* make_location(int sline, int eline, int scol, int ecol) {
+    PyObject *loc;
+    int values[4];
+    int i;
+
+    values[0] = sline; values[1] = eline; values[2] = scol; values[3] = ecol;
+    loc = Location_Type.tp_alloc(&Location_Type, 4);
+    if(!loc) {
+        return NULL;
+    }
+    for(i = 0; i < 4; i++) {
+        PyObject *value = PyInt_FromLong(values[i]);
+        if(!value) {
+            Py_DECREF(loc);
+            return NULL;
+        }
+        PyTuple_SET_ITEM(loc, i, value);
+    }
+    return loc;
+}
+
+static PyObject* location_new(PyTypeObject *type, PyObject *args, PyObject *kwds) {
+    static char *kwlist[] = {"sline", "eline", "scol", "ecol", NULL};
+    int sline, eline, scol, ecol;
+
+    if(!PyArg_ParseTupleAndKeywords(args, kwds, "iiii:Location", kwlist,
+                                    &sline, &eline, &scol, &ecol)) {
+        return NULL;
+    }
+    return make_location(sline, eline, scol, ecol);
+}
+
+static int location_index(PyObject *key) {
+    int i;
+    char *s;
+
+    if(!PyString_Check(key)) {
+        return -1;
+    }
+    s = PyString_AS_STRING(key);
+    for(i = 0; i < 4; i++) {
+        if(!strcmp(s, location_names[i])) {
+            return i;
+        }
+    }
+    return -1;
+}
+
+static PyObject* location_subscript(PyObject *self, PyObject *key) {
+    int i;
+    if(PyString_Check(key)) {
+        i = location_index(key);
+        if(i < 0) {
+            PyErr_SetObject(PyExc_KeyError, key);
+            return NULL;
+        }
+        Py_INCREF(PyTuple_GET_ITEM(self, i));
+        return PyTuple_GET_ITEM(self, i);
+    }
+    return PyTuple_Type.tp_as_mapping->mp_subscript(self, key);
+}
+
+static int location_contains(PyObject *self, PyObject *key) {
+    if(location_index(key) >= 0) {
+        return 1;
+    }
+    return PyTuple_Type.tp_as_sequence->sq_contains(self, key);
+}
+
+static PyObject* location_get(PyObject *self, PyObject *args) {
+    PyObject *key, *failobj = Py_None;
+    int i;
+
+    if(!PyArg_UnpackTuple(args, "get", 1, 2, &key, &failobj)) {
+        return NULL;
+    }
+    i = location_index(key);
+    if(i < 0) {
+        Py_INCREF(failobj);
+        return failobj;
+    }
+    Py_INCREF(PyTuple_GET_ITEM(self, i));
+    return PyTuple_GET_ITEM(self, i);
+}
+
+static PyObject* location_to_dict(PyObject *self) {
+    return Py_BuildValue("{s:O,s:O,s:O,s:O}",
+            "sline", PyTuple_GET_ITEM(self, 0),
+            "eline", PyTuple_GET_ITEM(self, 1),
+            "scol", PyTuple_GET_ITEM(self, 2),
+            "ecol", PyTuple_GET_ITEM(self, 3));
+}
+
+/*
+ * A location is equal to the locinfo dict which dictify_ast builds, so that
+ * lazy nodes compare equal to eager ones even after dict(node)
+ */
+static PyObject* location_richcompare(PyObject *self, PyObject *other, int op) {
+    PyObject *d, *ret;
+
+    if(!PyDict_Check(other) || !PyObject_TypeCheck(self, &Location_Type)) {
+        return PyTuple_Type.tp_richcompare(self, other, op);
+    }
+    if(op != Py_EQ && op != Py_NE) {
+        Py_INCREF(Py_NotImplemented);
+        return Py_NotImplemented;
+    }
+    d = location_to_dict(self);
+    if(!d) {
+        return NULL;
+    }
+    ret = PyObject_RichCompare(d, other, op);
+    Py_DECREF(d);
+    return ret;
+}
+
+static PyObject* location_reduce(PyObject *self) {
+    return Py_BuildValue("O(OOOO)", (PyObject *)&Location_Type,
+            PyTuple_GET_ITEM(self, 0),
+            PyTuple_GET_ITEM(self, 1),
+            PyTuple_GET_ITEM(self, 2),
+            PyTuple_GET_ITEM(self, 3));
+}
+
+static PyObject* location_repr(PyObject *self) {
+    return PyString_FromFormat("Location(sline=%ld, eline=%ld, scol=%ld, ecol=%ld)",
+            PyInt_AsLong(PyTuple_GET_ITEM(self, 0)),
+            PyInt_AsLong(PyTuple_GET_ITEM(self, 1)),
+            PyInt_AsLong(PyTuple_GET_ITEM(self, 2)),
+            PyInt_AsLong(PyTuple_GET_ITEM(self, 3)));
+}
+
+static PyMappingMethods location_as_mapping = {
+    0,                  /* mp_length, inherited */
+    location_subscript, /* mp_subscript */
+    0                   /* mp_ass_subscript */
+};
+
+static PySequenceMethods location_as_sequence;
+
+static PyMethodDef location_methods[] = {
+    {"get", location_get, METH_VARARGS, "get(key[, default]) as a dict of locations"},
+    {"to_dict", (PyCFunction)location_to_dict, METH_NOARGS, "dict of sline, eline, scol and ecol"},
+    {"__reduce__", (PyCFunction)location_reduce, METH_NOARGS, NULL},
+    {NULL, NULL, 0, NULL}
+};
+
+/*
+ * LISNNode
+ */
+static PyObject* make_node(PyObject *tree, void *ptr, short kind, short has_loc) {
+    LISNNodeObject *node;
+
+    node = PyObject_New(LISNNodeObject, &LISNNode_Type);
+    if(!node) {
+        return NULL;
+    }
+    Py_INCREF(tree);
+    node->tree = tree;
+    node->ptr = ptr;
+    node->kind = kind;
+    node->has_loc = has_loc;
+    node->slots = NULL;
+    return (PyObject *)node;
+}
+
+static PyObject* make_ast_node(PyObject *tree, ASTHD *ast) {
+    char err_msg[128];
+    if(!ast) {
+        PyErr_SetString(LISNSyntaxException, "Internal Error. make_ast_node(NULL).");
+        return NULL;
+    }
+    switch(ast->node_type) {
+        case asttype_suite:
+            return make_node(tree, ast, node_suite, 1);
+        case asttype_trailer:
+        case asttype_name:
+        case asttype_literal:
+        case asttype_binop:
+        case asttype_unop:
+        case asttype_assign:
+        case asttype_xexpr:
+            return make_node(tree, ast, node_ast, 1);
+        default:
+            snprintf(err_msg, 128, "Internal Error. Unknown type %d.", ast->node_type);
+            PyErr_SetString(LISNSyntaxException, err_msg);
+            return NULL;
+    }
+}
+
+static PyObject* make_optional_ast_node(PyObject *tree, ASTHD *ast) {
+    if(!ast) {
+        Py_INCREF(Py_None);
+        return Py_None;
+    }
+    return make_ast_node(tree, ast);
+}
+
+static PyObject* dsstring_value(ASTDS_String *dstr, int intern) {
+    PyObject *ret;
+
+    if(!dstr->str) {
+        Py_INCREF(Py_None);
+        return Py_None;
+    }
+    ret = PyString_FromStringAndSize(dstr->str, dstr->len);
+    if(ret && intern) {
+        PyString_InternInPlace(&ret);
+    }
+    return ret;
+}
+
+static PyObject* const_value(int s) {
+    Py_INCREF(const_strings[s]);
+    return const_strings[s];
+}
+
+static PyObject* bool_value(int b) {
+    return PyBool_FromLong(b);
+}
+
+/*
+ * Fill keys with K_* of node in the order of slots
+ *
+ * Returns -
+ *     the number of keys
+ */
+static int node_keys(LISNNodeObject *node, int *keys) {
+    int n = 0;
+
+    switch(node->kind) {
+        case node_ast:
+        {
+            ASTHD *ast = (ASTHD *)node->ptr;
+            keys[n++] = K_type;
+            switch(ast->node_type) {
+                case asttype_trailer:
+                    keys[n++] = K_scope;
+                    keys[n++] = K_trailer_type;
+                    switch(((AST_Trailer *)ast)->trailer_type) {
+                        case trailer_attr:
+                            keys[n++] = K_attr;
+                            break;
+                        case trailer_array:
+                            keys[n++] = K_index_param;
+                            break;
+                        default:
+                            keys[n++] = K_left_slice;
+                            keys[n++] = K_right_slice;
+                            break;
+                    }
+                    break;
+                case asttype_name:
+                    keys[n++] = K_name;
+                    break;
+                case asttype_literal:
+                    keys[n++] = K_literal_type;
+                    keys[n++] = K_content;
+                    break;
+                case asttype_binop:
+                    keys[n++] = K_op;
+                    keys[n++] = K_lhs;
+                    keys[n++] = K_rhs;
+                    break;
+                case asttype_unop:
+                    keys[n++] = K_op;
+                    keys[n++] = K_param;
+                    break;
+                case asttype_assign:
+                    keys[n++] = K_op;
+                    keys[n++] = K_param;
+                    keys[n++] = K_lvalue_type;
+                    switch(((AST_Assign *)ast)->lvalue_type) {
+                        case lvalue_name:
+                            keys[n++] = K_lvalue_name;
+                            break;
+                        case lvalue_attr:
+                            keys[n++] = K_lvalue_name;
+                            keys[n++] = K_lvalue_scope;
+                            break;
+                        case lvalue_array:
+                            keys[n++] = K_lvalue_index;
+                            keys[n++] = K_lvalue_scope;
+                            break;
+                    }
+                    break;
+                case asttype_xexpr:
+                    keys[n++] = K_has_head_label;
+                    keys[n++] = K_has_vert_suite;
+                    keys[n++] = K_arg_info;
+                    keys[n++] = K_head_expr;
+                    if(((AST_XExpr *)ast)->has_head_label)
+                        keys[n++] = K_head_label;
+                    if(((AST_XExpr *)ast)->has_vert_suite)
+                        keys[n++] = K_vert_suite;
+                    break;
+            }
+            break;
+        }
+        case node_suite:
+            keys[n++] = K_type;
+            keys[n++] = K_exprs;
+            break;
+        case node_suite_item:
+            keys[n++] = K_is_arrow;
+            keys[n++] = K_param;
+            if(((AST_Suite *)node->ptr)->is_arrow)
+                keys[n++] = K_arrow_lstring;
+            break;
+        case node_arguments:
+        {
+            ASTDS_Arguments *arguments = (ASTDS_Arguments *)node->ptr;
+            keys[n++] = K_pargs;
+            keys[n++] = K_kargs;
+            keys[n++] = K_has_star;
+            keys[n++] = K_has_dstar;
+            keys[n++] = K_has_amp;
+            keys[n++] = K_has_damp;
+            if(arguments->has_star) keys[n++] = K_star;
+            if(arguments->has_dstar) keys[n++] = K_dstar;
+            if(arguments->has_amp) keys[n++] = K_amp;
+            if(arguments->has_damp) keys[n++] = K_damp;
+            break;
+        }
+    }
+    if(node->has_loc) {
+        keys[n++] = K_locinfo;
+    }
+    return n;
+}
+
+static PyObject* materialize_suite_exprs(LISNNodeObject *node) {
+    AST_Suite *p;
+    Py_ssize_t len, i;
+    PyObject *exprs;
+
+    len = 0;
+    for(p = (AST_Suite *)node->ptr; p; p = p->next) {
+        len++;
+    }
+    exprs = PyList_New(len);
+    if(!exprs) {
+        return NULL;
+    }
+    i = 0;
+    for(p = (AST_Suite *)node->ptr; p; p = p->next) {
+        PyObject *item = make_node(node->tree, p, node_suite_item, 0);
+        if(!item) {
+            Py_DECREF(exprs);
+            return NULL;
+        }
+        PyList_SET_ITEM(exprs, i, item);
+        i++;
+    }
+    return exprs;
+}
+
+static PyObject* materialize_pargs(LISNNodeObject *node) {
+    ASTDS_PosArg *pp;
+    Py_ssize_t len, i;
+    PyObject *pargs;
+
+    len = 0;
+    for(pp = ((ASTDS_Arguments *)node->ptr)->pargs; pp; pp = pp->next) {
+        len++;
+    }
+    pargs = PyList_New(len);
+    if(!pargs) {
+        return NULL;
+    }
+    i = 0;
+    for(pp = ((ASTDS_Arguments *)node->ptr)->pargs; pp; pp = pp->next) {
+        PyObject *param = make_ast_node(node->tree, pp->param);
+        if(!param) {
+            Py_DECREF(pargs);
+            return NULL;
+        }
+        PyList_SET_ITEM(pargs, i, param);
+        i++;
+    }
+    return pargs;
+}
+
+static PyObject* materialize_kargs(LISNNodeObject *node) {
+    ASTDS_KwdArg *kp;
+    Py_ssize_t len, i;
+    PyObject *kargs;
+
+    len = 0;
+    for(kp = ((ASTDS_Arguments *)node->ptr)->kargs; kp; kp = kp->next) {
+        len++;
+    }
+    kargs = PyList_New(len);
+    if(!kargs) {
+        return NULL;
+    }
+    i = 0;
+    for(kp = ((ASTDS_Arguments *)node->ptr)->kargs; kp; kp = kp->next) {
+        PyObject *pair = Py_BuildValue("NN",
+                dsstring_value(&kp->name, 1),
+                make_ast_node(node->tree, kp->param));
+        if(!pair) {
+            Py_DECREF(kargs);
+            return NULL;
+        }
+        PyList_SET_ITEM(kargs, i, pair);
+        i++;
+    }
+    return kargs;
+}
+
+static PyObject* materialize_literal_type(AST_Literal *literal) {
+    switch(literal->literal_type) {
+        case literal_string:
+            return const_value(S_string);
+        case literal_integer:
+            return const_value(S_integer);
+        case literal_float:
+            return const_value(S_float);
+        default:
+            return const_value(S_unknown);
+    }
+}
+
+static PyObject* materialize_trailer_type(AST_Trailer *trailer) {
+    switch(trailer->trailer_type) {
+        case trailer_attr:
+            return const_value(S_attr);
+        case trailer_array:
+            return const_value(S_array);
+        default:
+            return const_value(S_slice);
+    }
+}
+
+static PyObject* materialize_lvalue_type(AST_Assign *assign) {
+    switch(assign->lvalue_type) {
+        case lvalue_name:
+            return const_value(S_name);
+        case lvalue_attr:
+            return const_value(S_attr);
+        case lvalue_array:
+            return const_value(S_array);
+        default:
+            return const_value(S_unknown);
+    }
+}
+
+static PyObject* materialize_ast(LISNNodeObject *node, int key) {
+    ASTHD *ast = (ASTHD *)node->ptr;
+    PyObject *tree = node->tree;
+
+    switch(ast->node_type) {
+        case asttype_trailer:
+        {
+            AST_Trailer *trailer = (AST_Trailer *)ast;
+            switch(key) {
+                case K_type: return const_value(S_trailer);
+                case K_scope: return make_optional_ast_node(tree, trailer->scope);
+                case K_trailer_type: return materialize_trailer_type(trailer);
+                case K_attr: return dsstring_value(&trailer->as.attr, 1);
+                case K_index_param: return make_ast_node(tree, trailer->as.index_param);
+                case K_left_slice: return make_optional_ast_node(tree, trailer->as.slice_indices.left);
+                case K_right_slice: return make_optional_ast_node(tree, trailer->as.slice_indices.right);
+            }
+            break;
+        }
+        case asttype_name:
+            switch(key) {
+                case K_type: return const_value(S_name);
+                case K_name: return dsstring_value(&((AST_Name *)ast)->dstr, 1);
+            }
+            break;
+        case asttype_literal:
+            switch(key) {
+                case K_type: return const_value(S_literal);
+                case K_literal_type: return materialize_literal_type((AST_Literal *)ast);
+                case K_content: return dsstring_value(&((AST_Literal *)ast)->dstr, 0);
+            }
+            break;
+        case asttype_binop:
+        {
+            AST_BinOp *binop = (AST_BinOp *)ast;
+            switch(key) {
+                case K_type: return const_value(S_binop);
+                case K_op: return dsstring_value(&binop->binop_str, 1);
+                case K_lhs: return make_ast_node(tree, binop->lhs);
+                case K_rhs: return make_ast_node(tree, binop->rhs);
+            }
+            break;
+        }
+        case asttype_unop:
+        {
+            AST_UnOp *unop = (AST_UnOp *)ast;
+            switch(key) {
+                case K_type: return const_value(S_unop);
+                case K_op: return dsstring_value(&unop->unop_str, 1);
+                case K_param: return make_ast_node(tree, unop->param);
+            }
+            break;
+        }
+        case asttype_assign:
+        {
+            AST_Assign *assign = (AST_Assign *)ast;
+            switch(key) {
+                case K_type: return const_value(S_assign);
+                case K_op:
+                    switch(assign->assign_type) {
+                        case assign_normal: return const_value(S_assign_normal);
+                        case assign_def: return const_value(S_assign_def);
+                        default: return PyString_FromString("");
+                    }
+                case K_param: return make_ast_node(tree, assign->param);
+                case K_lvalue_type: return materialize_lvalue_type(assign);
+                case K_lvalue_name:
+                    if(assign->lvalue_type == lvalue_name)
+                        return dsstring_value(&assign->lvalue_as.name, 1);
+                    return dsstring_value(&assign->lvalue_as.attr.name, 1);
+                case K_lvalue_scope:
+                    if(assign->lvalue_type == lvalue_attr)
+                        return make_ast_node(tree, assign->lvalue_as.attr.scope);
+                    return make_ast_node(tree, assign->lvalue_as.array.scope);
+                case K_lvalue_index: return make_ast_node(tree, assign->lvalue_as.array.index);
+            }
+            break;
+        }
+        case asttype_xexpr:
+        {
+            AST_XExpr *xexpr = (AST_XExpr *)ast;
+            switch(key) {
+                case K_type: return const_value(S_xexpr);
+                case K_has_head_label: return bool_value(xexpr->has_head_label);
+                case K_has_vert_suite: return bool_value(xexpr->has_vert_suite);
+                case K_arg_info: return make_node(tree, &xexpr->arg_info, node_arguments, 0);
+                case K_head_expr: return make_ast_node(tree, xexpr->head_expr);
+                case K_head_label: return dsstring_value(&xexpr->head_label, 1);
+                case K_vert_suite: return make_node(tree, xexpr->vert_suite, node_suite, 0);
+            }
+            break;
+        }
+    }
+    PyErr_SetString(LISNSyntaxException, "Internal Error. Unknown key of LISN node.");
+    return NULL;
+}
+
+static PyObject* materialize(LISNNodeObject *node, int key) {
+    if(key == K_locinfo) {
+        ASTHD *ast = (ASTHD *)node->ptr;
+        if(!ast) {
+            /* Top-level empty suite */
+            return make_location(1, 1, 1, 1);
+        }
+        return make_location(ast->loc.sline, ast->loc.eline, ast->loc.scol, ast->loc.ecol);
+    }
+    switch(node->kind) {
+        case node_ast:
+            return materialize_ast(node, key);
+        case node_suite:
+            if(key == K_type)
+                return const_value(S_suite);
+            return materialize_suite_exprs(node);
+        case node_suite_item:
+        {
+            AST_Suite *item = (AST_Suite *)node->ptr;
+            switch(key) {
+                case K_is_arrow: return bool_value(item->is_arrow);
+                case K_param: return make_ast_node(node->tree, item->param);
+                case K_arrow_lstring: return dsstring_value(&item->arrow_lstring, 1);
+            }
+            break;
+        }
+        case node_arguments:
+        {
+            ASTDS_Arguments *arguments = (ASTDS_Arguments *)node->ptr;
+            switch(key) {
+                case K_pargs: return materialize_pargs(node);
+                case K_kargs: return materialize_kargs(node);
+                case K_has_star: return bool_value(arguments->has_star);
+                case K_has_dstar: return bool_value(arguments->has_dstar);
+                case K_has_amp: return bool_value(arguments->has_amp);
+                case K_has_damp: return bool_value(arguments->has_damp);
+                case K_star: return make_ast_node(node->tree, arguments->star);
+                case K_dstar: return make_ast_node(node->tree, arguments->dstar);
+                case K_amp: return make_ast_node(node->tree, arguments->amp);
+                case K_damp: return make_ast_node(node->tree, arguments->damp);
+            }
+            break;
+        }
+    }
+    PyErr_SetString(LISNSyntaxException, "Internal Error. Unknown key of LISN node.");
+    return NULL;
+}
+
+/*
+ * Returns -
+ *     K_* of key, or -1 if key is not a key of any node
+ */
+static int key_index(PyObject *key) {
+    PyObject *idx;
+
+    if(!PyString_Check(key)) {
+        return -1;
+    }
+    idx = PyDict_GetItem(key_indices, key);
+    if(!idx) {
+        return -1;
+    }
+    return (int)PyInt_AS_LONG(idx);
+}
+
+/*
+ * Returns -
+ *     borrowed reference to the value of key(K_*), NULL if node doesn't
+ *     have the key (without exception set) or on error (with exception set)
+ */
+static PyObject* node_value(LISNNodeObject *node, int key) {
+    int keys[MAX_NODE_KEYS];
+    int n, i;
+
+    n = node_keys(node, keys);
+    for(i = 0; i < n; i++) {
+        if(keys[i] == key) {
+            break;
+        }
+    }
+    if(i == n) {
+        return NULL;
+    }
+    if(!node->slots) {
+        node->slots = PyMem_New(PyObject *, n);
+        if(!node->slots) {
+            PyErr_NoMemory();
+            return NULL;
+        }
+        memset(node->slots, 0, sizeof(PyObject *) * n);
+    }
+    if(!node->slots[i]) {
+        node->slots[i] = materialize(node, key);
+    }
+    return node->slots[i];
+}
+
+static void lisnnode_dealloc(LISNNodeObject *self) {
+    if(self->slots) {
+        int keys[MAX_NODE_KEYS];
+        int n, i;
+        n = node_keys(self, keys);
+        for(i = 0; i < n; i++) {
+            Py_XDECREF(self->slots[i]);
+        }
+        PyMem_Free(self->slots);
+    }
+    Py_DECREF(self->tree);
+    PyObject_Del(self);
+}
+
+static Py_ssize_t lisnnode_length(LISNNodeObject *self) {
+    int keys[MAX_NODE_KEYS];
+    return node_keys(self, keys);
+}
+
+static PyObject* lisnnode_subscript(LISNNodeObject *self, PyObject *key) {
+    PyObject *value;
+    int idx = key_index(key);
+
+    value = idx >= 0 ? node_value(self, idx) : NULL;
+    if(!value) {
+        if(!PyErr_Occurred()) {
+            PyErr_SetObject(PyExc_KeyError, key);
+        }
+        return NULL;
+    }
+    Py_INCREF(value);
+    return value;
+}
+
+static int lisnnode_contains(LISNNodeObject *self, PyObject *key) {
+    int keys[MAX_NODE_KEYS];
+    int n, i;
+    int idx = key_index(key);
+
+    if(idx < 0) {
+        return 0;
+    }
+    n = node_keys(self, keys);
+    for(i = 0; i < n; i++) {
+        if(keys[i] == idx) {
+            return 1;
+        }
+    }
+    return 0;
+}
+
+static PyObject* lisnnode_get(LISNNodeObject *self, PyObject *args) {
+    PyObject *key, *value, *failobj = Py_None;
+    int idx;
+
+    if(!PyArg_UnpackTuple(args, "get", 1, 2, &key, &failobj)) {
+        return NULL;
+    }
+    idx = key_index(key);
+    value = idx >= 0 ? node_value(self, idx) : NULL;
+    if(!value) {
+        if(PyErr_Occurred()) {
+            return NULL;
+        }
+        value = failobj;
+    }
+    Py_INCREF(value);
+    return value;
+}
+
+static PyObject* lisnnode_has_key(LISNNodeObject *self, PyObject *key) {
+    return PyBool_FromLong(lisnnode_contains(self, key));
+}
+
+/* which: 0 for keys, 1 for values, 2 for items */
+static PyObject* lisnnode_list(LISNNodeObject *self, int which) {
+    int keys[MAX_NODE_KEYS];
+    int n, i;
+    PyObject *result;
+
+    n = node_keys(self, keys);
+    result = PyList_New(n);
+    if(!result) {
+        return NULL;
+    }
+    for(i = 0; i < n; i++) {
+        PyObject *elem;
+        if(which == 0) {
+            elem = key_strings[keys[i]];
+            Py_INCREF(elem);
+        } else {
+            PyObject *value = node_value(self, keys[i]);
+            if(!value) {
+                Py_DECREF(result);
+                return NULL;
+            }
+            if(which == 1) {
+                elem = value;
+                Py_INCREF(elem);
+            } else {
+                elem = PyTuple_Pack(2, key_strings[keys[i]], value);
+                if(!elem) {
+                    Py_DECREF(result);
+                    return NULL;
+                }
+            }
+        }
+        PyList_SET_ITEM(result, i, elem);
+    }
+    return result;
+}
+
+static PyObject* lisnnode_keys(LISNNodeObject *self) {
+    return lisnnode_list(self, 0);
+}
+
+static PyObject* lisnnode_values(LISNNodeObject *self) {
+    return lisnnode_list(self, 1);
+}
+
+static PyObject* lisnnode_items(LISNNodeObject *self) {
+    return lisnnode_list(self, 2);
+}
+
+static PyObject* lisnnode_iter_list(LISNNodeObject *self, int which) {
+    PyObject *lst, *it;
+    lst = lisnnode_list(self, which);
+    if(!lst) {
+        return NULL;
+    }
+    it = PyObject_GetIter(lst);
+    Py_DECREF(lst);
+    return it;
+}
+
+static PyObject* lisnnode_iter(LISNNodeObject *self) {
+    return lisnnode_iter_list(self, 0);
+}
+
+static PyObject* lisnnode_iterkeys(LISNNodeObject *self) {
+    return lisnnode_iter_list(self, 0);
+}
+
+static PyObject* lisnnode_itervalues(LISNNodeObject *self) {
+    return lisnnode_iter_list(self, 1);
+}
+
+static PyObject* lisnnode_iteritems(LISNNodeObject *self) {
+    return lisnnode_iter_list(self, 2);
+}
+
+/*
+ * Deep copy of obj in which nodes and locations are replaced with dicts,
+ * which are the same as what dictify_ast builds
+ */
+static PyObject* to_plain(PyObject *obj) {
+    if(PyObject_TypeCheck(obj, &LISNNode_Type)) {
+        PyObject *items, *result;
+        Py_ssize_t i;
+
+        items = lisnnode_items((LISNNodeObject *)obj);
+        if(!items) {
+            return NULL;
+        }
+        result = PyDict_New();
+        if(!result) {
+            Py_DECREF(items);
+            return NULL;
+        }
+        for(i = 0; i < PyList_GET_SIZE(items); i++) {
+            PyObject *item = PyList_GET_ITEM(items, i);
+            PyObject *value = to_plain(PyTuple_GET_ITEM(item, 1));
+            if(!value || PyDict_SetItem(result, PyTuple_GET_ITEM(item, 0), value) < 0) {
+                Py_XDECREF(value);
+                Py_DECREF(items);
+                Py_DECREF(result);
+                return NULL;
+            }
+            Py_DECREF(value);
+        }
+        Py_DECREF(items);
+        return result;
+    } else if(PyObject_TypeCheck(obj, &Location_Type)) {
+        return location_to_dict(obj);
+    } else if(PyList_Check(obj) || PyTuple_CheckExact(obj)) {
+        Py_ssize_t i, len = PySequence_Fast_GET_SIZE(obj);
+        PyObject *result = PyList_Check(obj) ? PyList_New(len) : PyTuple_New(len);
+        if(!result) {
+            return NULL;
+        }
+        for(i = 0; i < len; i++) {
+            PyObject *elem = to_plain(PySequence_Fast_GET_ITEM(obj, i));
+            if(!elem) {
+                Py_DECREF(result);
+                return NULL;
+            }
+            if(PyList_Check(obj)) {
+                PyList_SET_ITEM(result, i, elem);
+            } else {
+                PyTuple_SET_ITEM(result, i, elem);
+            }
+        }
+        return result;
+    }
+    Py_INCREF(obj);
+    return obj;
+}
+
+static PyObject* lisnnode_to_dict(LISNNodeObject *self) {
+    return to_plain((PyObject *)self);
+}
+
+static PyObject* lisnnode_reduce(LISNNodeObject *self) {
+    /* pickled as a dict */
+    PyObject *d = to_plain((PyObject *)self);
+    if(!d) {
+        return NULL;
+    }
+    return Py_BuildValue("O(N)", (PyObject *)&PyDict_Type, d);
+}
+
+static PyObject* lisnnode_repr(LISNNodeObject *self) {
+    PyObject *d, *ret;
+    d = to_plain((PyObject *)self);
+    if(!d) {
+        return NULL;
+    }
+    ret = PyObject_Repr(d);
+    Py_DECREF(d);
+    return ret;
+}
+
+static PyObject* lisnnode_richcompare(PyObject *self, PyObject *other, int op) {
+    PyObject *lhs, *rhs, *ret;
+
+    if((op != Py_EQ && op != Py_NE) ||
+       !(PyObject_TypeCheck(other, &LISNNode_Type) || PyDict_Check(other)) ||
+       !PyObject_TypeCheck(self, &LISNNode_Type)) {
+        Py_INCREF(Py_NotImplemented);
+        return Py_NotImplemented;
+    }
+    lhs = to_plain(self);
+    if(!lhs) {
+        return NULL;
+    }
+    rhs = to_plain(other);
+    if(!rhs) {
+        Py_DECREF(lhs);
+        return NULL;
+    }
+    ret = PyObject_RichCompare(lhs, rhs, op);
+    Py_DECREF(lhs);
+    Py_DECREF(rhs);
+    return ret;
+}
+
+static PyMappingMethods lisnnode_as_mapping = {
+    (lenfunc)lisnnode_length,       /* mp_length */
+    (binaryfunc)lisnnode_subscript, /* mp_subscript */
+    0                               /* mp_ass_subscript */
+};
+
+static PySequenceMethods lisnnode_as_sequence = {
+    0, 0, 0, 0, 0, 0, 0,
+    (objobjproc)lisnnode_contains,  /* sq_contains */
+    0, 0
+};
+
+static PyMethodDef lisnnode_methods[] = {
+    {"get", (PyCFunction)lisnnode_get, METH_VARARGS, "D.get(k[,d]) -> D[k] if k in D, else d."},
+    {"has_key", (PyCFunction)lisnnode_has_key, METH_O, "D.has_key(k) -> True if D has a key k, else False"},
+    {"keys", (PyCFunction)lisnnode_keys, METH_NOARGS, "D.keys() -> list of D's keys"},
+    {"values", (PyCFunction)lisnnode_values, METH_NOARGS, "D.values() -> list of D's values"},
+    {"items", (PyCFunction)lisnnode_items, METH_NOARGS, "D.items() -> list of D's (key, value) pairs"},
+    {"iterkeys", (PyCFunction)lisnnode_iterkeys, METH_NOARGS, "D.iterkeys() -> an iterator over the keys of D"},
+    {"itervalues", (PyCFunction)lisnnode_itervalues, METH_NOARGS, "D.itervalues() -> an iterator over the values of D"},
+    {"iteritems", (PyCFunction)lisnnode_iteritems, METH_NOARGS, "D.iteritems() -> an iterator over the (key, value) items of D"},
+    {"to_dict", (PyCFunction)lisnnode_to_dict, METH_NOARGS, "the whole subtree as nested dicts, as loads(..., lazy=False) builds"},
+    {"__reduce__", (PyCFunction)lisnnode_reduce, METH_NOARGS, NULL},
+    {NULL, NULL, 0, NULL}
+};
+
+static PyObject* make_lazy_root(ASTHD *ast, Arena *arena, PyObject *source) {
+    LISNTreeObject *tree;
     PyObject *ret;
 
-    if(!PyArg_ParseTuple(args, "s#", &source, &source_size)) {
+    tree = PyObject_New(LISNTreeObject, &LISNTree_Type);
+    if(!tree) {
+        Arena_remove(arena);
         return NULL;
     }
-    ast = parse_bytes(source, source_size, &err);
+    tree->ast = ast;
+    tree->arena = arena;
+    Py_INCREF(source);
+    tree->source = source;
+    if(!ast) {
+        ret = make_node((PyObject *)tree, NULL, node_suite, 1);
+    } else {
+        ret = make_ast_node((PyObject *)tree, ast);
+    }
+    Py_DECREF(tree);
+    return ret;
+}
 
-    if(err.error_occurred) {
-        PyObject *err_tuple;
-
-        err_tuple = Py_BuildValue("sN",
-            err.err_msg,
-            Py_BuildValue("{s:i,s:i,s:i,s:i}",
-                "sline", err.sline,
-                "eline", err.eline,
-                "scol", err.scol,
-                "ecol", err.ecol));
-        if(err.is_lexerr) {
-            PyErr_SetObject(LISNLexerException, err_tuple);
+static int init_lazy_types(PyObject *mod) {
+    int i;
+
+    key_indices = PyDict_New();
+    if(!key_indices) {
+        return -1;
+    }
+    for(i = 0; i < K_COUNT; i++) {
+        PyObject *idx;
+        key_strings[i] = PyString_InternFromString(key_names[i]);
+        idx = PyInt_FromLong(i);
+        if(!key_strings[i] || !idx ||
+           PyDict_SetItem(key_indices, key_strings[i], idx) < 0) {
+            Py_XDECREF(idx);
+            return -1;
+        }
+        Py_DECREF(idx);
+    }
+    for(i = 0; i < S_COUNT; i++) {
+        const_strings[i] = PyString_InternFromString(const_names[i]);
+        if(!const_strings[i]) {
+            return -1;
+        }
+    }
+
+    LISNTree_Type.tp_name = "clisn._LISNTree";
+    LISNTree_Type.tp_basicsize = sizeof(LISNTreeObject);
+    LISNTree_Type.tp_dealloc = (destructor)lisntree_dealloc;
+    LISNTree_Type.tp_flags = Py_TPFLAGS_DEFAULT;
+    if(PyType_Ready(&LISNTree_Type) < 0) {
+        return -1;
+    }
+
+    Location_Type.tp_name = "clisn.Location";
+    Location_Type.tp_base = &PyTuple_Type;
+    Location_Type.tp_new = location_new;
+    Location_Type.tp_repr = location_repr;
+    location_as_sequence = *PyTuple_Type.tp_as_sequence;
+    location_as_sequence.sq_contains = location_contains;
+    Location_Type.tp_as_sequence = &location_as_sequence;
+    Location_Type.tp_as_mapping = &location_as_mapping;
+    Location_Type.tp_richcompare = location_richcompare;
+    Location_Type.tp_hash = PyTuple_Type.tp_hash;
+    Location_Type.tp_methods = location_methods;
+    Location_Type.tp_flags = Py_TPFLAGS_DEFAULT;
+    Location_Type.tp_doc = "(sline, eline, scol, ecol) which can be indexed by those names as well";
+    if(PyType_Ready(&Location_Type) < 0) {
+        return -1;
+    }
+
+    LISNNode_Type.tp_name = "clisn.LISNNode";
+    LISNNode_Type.tp_basicsize = sizeof(LISNNodeObject);
+    LISNNode_Type.tp_dealloc = (destructor)lisnnode_dealloc;
+    LISNNode_Type.tp_repr = (reprfunc)lisnnode_repr;
+    LISNNode_Type.tp_as_mapping = &lisnnode_as_mapping;
+    LISNNode_Type.tp_as_sequence = &lisnnode_as_sequence;
+    LISNNode_Type.tp_hash = PyObject_HashNotImplemented;
+    LISNNode_Type.tp_richcompare = lisnnode_richcompare;
+    LISNNode_Type.tp_iter = (getiterfunc)lisnnode_iter;
+    LISNNode_Type.tp_methods = lisnnode_methods;
+    LISNNode_Type.tp_flags = Py_TPFLAGS_DEFAULT;
+    LISNNode_Type.tp_doc = "Read-only mapping of a LISN node whose values are built when accessed";
+    if(PyType_Ready(&LISNNode_Type) < 0) {
+        return -1;
+    }
+
+    Py_INCREF(&LISNNode_Type);
+    PyModule_AddObject(mod, "LISNNode", (PyObject *)&LISNNode_Type);
+    Py_INCREF(&Location_Type);
+    PyModule_AddObject(mod, "Location", (PyObject *)&Location_Type);
+    return 0;
+}
+
+/*
+ * Parsers which are not in use are kept for the next calls, so that their
+ * lexers, lemon parsers and arenas are reused. More than one can be idle
+ * since threads parse at the same time while the GIL is released.
+ * Only touched with the GIL held.
+ */
+#define MAX_IDLE_PARSERS 8
+static Parser *idle_parsers[MAX_IDLE_PARSERS];
+static int idle_parser_cnt = 0;
+
+static Parser* acquire_parser(void) {
+    if(idle_parser_cnt > 0) {
+        return idle_parsers[--idle_parser_cnt];
+    }
+    return Parser_new();
+}
+
+static void release_parser(Parser *parser) {
+    if(idle_parser_cnt < MAX_IDLE_PARSERS) {
+        idle_parsers[idle_parser_cnt++] = parser;
+    } else {
+        Parser_remove(parser);
+    }
+}
+
+/*
+ * Sources shorter than this are parsed with the GIL held. Handing the GIL
+ * over costs more than parsing them.
+ */
+#define GIL_RELEASE_MIN_SIZE 2048
+
+/*
+ * Parse bytes which neither change nor go away meanwhile, releasing the
+ * GIL if they are long enough. at is NULL for a new source, or tells where
+ * bytes continue another source(see Parser_parse_bytes_at).
+ */
+static ASTHD* run_parser(Parser *parser, const char *bytes, int len, const LexLineStart *at,
+                         LexParseError *err) {
+    ASTHD *ast;
+
+    if(len >= GIL_RELEASE_MIN_SIZE) {
+        Py_BEGIN_ALLOW_THREADS
+        if(at) {
+            ast = Parser_parse_bytes_at(parser, bytes, len, at, err);
         } else {
-            PyErr_SetObject(LISNParserException, err_tuple);
+            ast = Parser_parse_bytes(parser, bytes, len, err);
         }
-        Py_DECREF(err_tuple);
+        Py_END_ALLOW_THREADS
+    } else if(at) {
+        ast = Parser_parse_bytes_at(parser, bytes, len, at, err);
+    } else {
+        ast = Parser_parse_bytes(parser, bytes, len, err);
+    }
+    return ast;
+}
+
+static void set_parse_error(LexParseError *err) {
+    PyObject *err_tuple;
+
+    err_tuple = Py_BuildValue("sN",
+        err->err_msg,
+        Py_BuildValue("{s:i,s:i,s:i,s:i}",
+            "sline", err->sline,
+            "eline", err->eline,
+            "scol", err->scol,
+            "ecol", err->ecol));
+    if(err->is_lexerr) {
+        PyErr_SetObject(LISNLexerException, err_tuple);
+    } else {
+        PyErr_SetObject(LISNParserException, err_tuple);
+    }
+    Py_DECREF(err_tuple);
+}
+
+/*
+ * Parse bytes and build python objects, or set
+ * LISNLexerException/LISNParserException if parsing failed.
+ *
+ * Strings of the C AST are slices of bytes, so a lazy tree keeps source
+ * alive. source has to be an immutable object which owns bytes. If it is
+ * NULL, a lazy tree is built from a copy of bytes instead.
+ *
+ * The GIL is released while lexing and parsing, which need no python
+ * objects. stable tells that bytes neither change nor go away meanwhile
+ * (e.g. they belong to source or to the caller only). Otherwise bytes are
+ * copied first, since another thread could write to the buffer.
+ */
+static PyObject* bytes2lisn(const char *bytes, int len, int lazy, PyObject *source, int stable) {
+    Parser *parser;
+    LexParseError err;
+    ASTHD *ast;
+    PyObject *copied = NULL;
+    PyObject *ret;
+
+    if(source)
+        stable = 1;
+    if((lazy && !source) || (!stable && len >= GIL_RELEASE_MIN_SIZE)) {
+        copied = PyString_FromStringAndSize(bytes, len);
+        if(!copied)
+            return NULL;
+        bytes = PyString_AS_STRING(copied);
+        source = copied;
+        stable = 1;
+    }
+    parser = acquire_parser();
+    if(stable) {
+        ast = run_parser(parser, bytes, len, NULL, &err);
+    } else {
+        ast = Parser_parse_bytes(parser, bytes, len, &err);
+    }
+
+    if(err.error_occurred) {
+        release_parser(parser);
+        Py_XDECREF(copied);
+        set_parse_error(&err);
         return NULL;
     } 
-    ret = safe_dictify_ast(ast);
-    ast_free(ast);
+    if(lazy) {
+        ret = make_lazy_root(ast, Parser_detach_arena(parser), source);
+    } else {
+        ret = safe_dictify_ast(ast);
+    }
+    release_parser(parser);
+    Py_XDECREF(copied);
+    return ret;
+}
+
+static PyObject* str2lisn(PyObject *self, PyObject* args, PyObject *kwds) {
+    static char *kwlist[] = {"source", "lazy", NULL};
+    PyObject *source_obj;
+    const char* source; // barrowed
+    int source_size;
+    int lazy = 0;
+
+    if(!PyArg_ParseTupleAndKeywords(args, kwds, "O|i", kwlist, &source_obj, &lazy)) {
+        return NULL;
+    }
+    if(!PyArg_Parse(source_obj, "s#", &source, &source_size)) {
+        return NULL;
+    }
+    // bytes of a unicode object are its default encoded string, which lives as long as it does
+    return bytes2lisn(source, source_size, lazy,
+                      PyString_Check(source_obj) || PyUnicode_Check(source_obj)? source_obj : NULL,
+                      0);
+}
+
+/*
+ * Parse any object supporting the buffer interface(str, bytearray, buffer,
+ * mmap, ...). Strings, and other buffers too short to release the GIL for,
+ * are parsed in place; longer ones are copied(see bytes2lisn). A lazy tree
+ * is built from a copy of a buffer which may change afterwards.
+ */
+static PyObject* buffer2lisn(PyObject *self, PyObject* args, PyObject *kwds) {
+    static char *kwlist[] = {"buffer", "lazy", NULL};
+    Py_buffer view;
+    int lazy = 0;
+    PyObject *ret;
+
+    if(!PyArg_ParseTupleAndKeywords(args, kwds, "s*|i", kwlist, &view, &lazy)) {
+        return NULL;
+    }
+    if(view.len > INT_MAX) {
+        PyBuffer_Release(&view);
+        PyErr_SetString(PyExc_OverflowError, "buffer is too large to parse");
+        return NULL;
+    }
+    ret = bytes2lisn((const char *)view.buf, (int)view.len, lazy,
+                     view.obj && PyString_Check(view.obj)? view.obj : NULL,
+                     0);
+    PyBuffer_Release(&view);
     return ret;
 }
 
-static PyObject* file2lisn(PyObject *self, PyObject* args) {
+/*
+ * Whole contents of a file, read at once into memory owned by the caller.
+ * Files are not mapped, since another process may truncate or rewrite a
+ * file while it is parsed(e.g. when an editor saves it), and reading
+ * mapped pages past the new end of the file raises SIGBUS.
+ */
+typedef struct {
+    char *data;
+    size_t size;
+} FileContents;
+
+static int FileContents_read(FileContents *contents, const char *file_name) {
+    int fd;
+    struct stat st;
+    size_t capacity;
+    ssize_t n_read;
+
+    contents->data = NULL;
+    contents->size = 0;
+
+    fd = open(file_name, O_RDONLY);
+    if(fd < 0) {
+        return -1;
+    }
+    if(fstat(fd, &st) < 0) {
+        close(fd);
+        return -1;
+    }
+    // one more byte than the size to see the end of a regular file without growing
+    capacity = S_ISREG(st.st_mode)? (size_t)st.st_size + 1 : 4096;
+    contents->data = (char *)malloc(capacity);
+    if(!contents->data) {
+        close(fd);
+        errno = ENOMEM;
+        return -1;
+    }
+    while((n_read = read(fd, contents->data + contents->size, capacity - contents->size)) != 0) {
+        if(n_read < 0) {
+            if(errno == EINTR)
+                continue;
+            free(contents->data);
+            contents->data = NULL;
+            close(fd);
+            return -1;
+        }
+        contents->size += (size_t)n_read;
+        if(contents->size == capacity) {
+            char *grown;
+            capacity *= 2;
+            grown = (char *)realloc(contents->data, capacity);
+            if(!grown) {
+                free(contents->data);
+                contents->data = NULL;
+                close(fd);
+                errno = ENOMEM;
+                return -1;
+            }
+            contents->data = grown;
+        }
+    }
+    close(fd);
+    return 0;
+}
+
+static void FileContents_free(FileContents *contents) {
+    free(contents->data);
+    contents->data = NULL;
+}
+
+static PyObject* file2lisn(PyObject *self, PyObject* args, PyObject *kwds) {
+    static char *kwlist[] = {"file_name", "lazy", NULL};
     const char* file_name; // borrowed
-    LexParseError err;
-    ASTHD *ast;
+    int lazy = 0;
+    FileContents contents;
+    int read_result;
     PyObject *ret;
 
-    if(!PyArg_ParseTuple(args, "s", &file_name)) {
+    if(!PyArg_ParseTupleAndKeywords(args, kwds, "s|i", kwlist, &file_name, &lazy)) {
+        return NULL;
+    }
+    Py_BEGIN_ALLOW_THREADS
+    read_result = FileContents_read(&contents, file_name);
+    Py_END_ALLOW_THREADS
+    if(read_result < 0) {
+        return PyErr_SetFromErrnoWithFilename(PyExc_IOError, (char *)file_name);
+    }
+    if(contents.size > INT_MAX) {
+        FileContents_free(&contents);
+        PyErr_SetString(PyExc_OverflowError, "file is too large to parse");
         return NULL;
     }
-    FILE *fp;
+    // contents are a copy which only this call holds, so they are parsed
+    // in place without the GIL
+    ret = bytes2lisn(contents.data? contents.data : "", (int)contents.size, lazy, NULL, 1);
+    Py_BEGIN_ALLOW_THREADS
+    FileContents_free(&contents);
+    Py_END_ALLOW_THREADS
+    return ret;
+}
+
+static PyObject* indent_char_value(char indent_char) {
+    return PyString_FromStringAndSize(&indent_char, indent_char? 1 : 0);
+}
+
+static PyObject* line_start_value(const LexLineStart *line_start) {
+    return Py_BuildValue("(iiNN)",
+                         line_start->sline,
+                         line_start->first_line,
+                         indent_char_value(line_start->indent_char),
+                         PyBool_FromLong(line_start->dedented));
+}
+
+/*
+ * _loads_blocks(source, at=None)
+ *
+ * Parse a string into dicts like loads, telling where its blocks begin as
+ * well(see Parser_blocks). Each block is given as a tuple
+ * (sline, first_line, indent_char, dedented) of LexLineStart. If at is one
+ * of them, source continues another source at that block(see
+ * Parser_parse_bytes_at).
+ *
+ * Returns -
+ *     (suite, [block, ...], indent_char, ended_at_line_start)
+ */
+static PyObject* str2blocks(PyObject *self, PyObject* args, PyObject *kwds) {
+    static char *kwlist[] = {"source", "at", NULL};
+    PyObject *source_obj;
+    PyObject *at_obj = Py_None;
+    LexLineStart at;
+    Parser *parser;
+    LexParseError err;
+    ASTHD *ast;
+    const LexLineStart *blocks;
+    int blocks_cnt, i;
+    PyObject *suite, *block_list, *ret;
 
-    fp = fopen(file_name, "r");
-    if(!fp) {
-        return PyErr_SetFromErrno(PyExc_IOError);
+    if(!PyArg_ParseTupleAndKeywords(args, kwds, "S|O", kwlist, &source_obj, &at_obj)) {
+        return NULL;
     }
-    ast = parse_file(fp, &err);
-    fclose(fp);
+    if(at_obj != Py_None) {
+        const char *indent_char;
+        int indent_char_len, dedented;
 
-    if(err.error_occurred) {
-        PyObject *err_tuple;
-
-        err_tuple = Py_BuildValue("sN",
-            err.err_msg,
-            Py_BuildValue("{s:i,s:i,s:i,s:i}",
-                "sline", err.sline,
-                "eline", err.eline,
-                "scol", err.scol,
-                "ecol", err.ecol));
-        if(err.is_lexerr) {
-            PyErr_SetObject(LISNLexerException, err_tuple);
-        } else {
-            PyErr_SetObject(LISNParserException, err_tuple);
+        if(!PyArg_ParseTuple(at_obj, "iis#i;at has to be a block",
+                             &at.sline, &at.first_line, &indent_char, &indent_char_len, &dedented)) {
+            return NULL;
+        }
+        if(indent_char_len > 1) {
+            PyErr_SetString(PyExc_ValueError, "indent_char of a block has to be a character or empty");
+            return NULL;
         }
-        Py_DECREF(err_tuple);
+        at.indent_char = indent_char[0];
+        at.dedented = dedented != 0;
+    }
+    if(PyString_GET_SIZE(source_obj) > INT_MAX) {
+        PyErr_SetString(PyExc_OverflowError, "source is too large to parse");
         return NULL;
-    } 
+    }
+    parser = acquire_parser();
+    ast = run_parser(parser, PyString_AS_STRING(source_obj), (int)PyString_GET_SIZE(source_obj),
+                     at_obj != Py_None? &at : NULL, &err);
+    if(err.error_occurred) {
+        release_parser(parser);
+        set_parse_error(&err);
+        return NULL;
+    }
+    suite = safe_dictify_ast(ast);
+    if(!suite) {
+        release_parser(parser);
+        return NULL;
+    }
+
+    blocks = Parser_blocks(parser, &blocks_cnt);
+    block_list = PyList_New(blocks_cnt);
+    if(!block_list) {
+        release_parser(parser);
+        Py_DECREF(suite);
+        return NULL;
+    }
+    for(i = 0; i < blocks_cnt; i++) {
+        PyObject *item = line_start_value(&blocks[i]);
+        if(!item) {
+            release_parser(parser);
+            Py_DECREF(suite);
+            Py_DECREF(block_list);
+            return NULL;
+        }
+        PyList_SET_ITEM(block_list, i, item);
+    }
+    ret = Py_BuildValue("(NNNN)",
+                        suite,
+                        block_list,
+                        indent_char_value(Parser_indent_char(parser)),
+                        PyBool_FromLong(Parser_ended_at_line_start(parser)));
+    release_parser(parser);
+    return ret;
+}
 
-    ret = safe_dictify_ast(ast);
-    ast_free(ast);
+static PyObject *locinfo_key, *sline_key, *eline_key;
+
+static int shift_locinfo_line(PyObject *locinfo, PyObject *key, int delta) {
+    PyObject *value = PyDict_GetItem(locinfo, key);
+    PyObject *shifted;
+    long line;
+    int ret;
+
+    if(!value || !PyInt_Check(value))
+        return 0;
+    line = PyInt_AS_LONG(value);
+    if(line <= 0) // locations of inner suites are meaningless(-1)
+        return 0;
+    shifted = PyInt_FromLong(line + delta);
+    if(!shifted)
+        return -1;
+    ret = PyDict_SetItem(locinfo, key, shifted);
+    Py_DECREF(shifted);
     return ret;
 }
 
+static int shift_lines(PyObject *obj, int delta) {
+    Py_ssize_t i;
+    PyObject *key, *value;
+
+    if(PyList_Check(obj)) {
+        for(i = 0; i < PyList_GET_SIZE(obj); i++) {
+            if(shift_lines(PyList_GET_ITEM(obj, i), delta) < 0)
+                return -1;
+        }
+    } else if(PyTuple_Check(obj)) { // (name, node) of kargs
+        for(i = 0; i < PyTuple_GET_SIZE(obj); i++) {
+            if(shift_lines(PyTuple_GET_ITEM(obj, i), delta) < 0)
+                return -1;
+        }
+    } else if(PyDict_Check(obj)) {
+        PyObject *locinfo = PyDict_GetItem(obj, locinfo_key);
+        if(locinfo && PyDict_Check(locinfo)) {
+            if(shift_locinfo_line(locinfo, sline_key, delta) < 0 ||
+               shift_locinfo_line(locinfo, eline_key, delta) < 0)
+                return -1;
+        }
+        i = 0;
+        while(PyDict_Next(obj, &i, &key, &value)) {
+            if(value != locinfo &&
+               (PyDict_Check(value) || PyList_Check(value) || PyTuple_Check(value))) {
+                if(shift_lines(value, delta) < 0)
+                    return -1;
+            }
+        }
+    }
+    return 0;
+}
+
+/*
+ * _shift_lines(obj, delta)
+ *
+ * Move every dict node in obj(a node or a list of them) by delta lines, in place.
+ */
+static PyObject* shift_lines_func(PyObject *self, PyObject* args) {
+    PyObject *obj;
+    int delta;
+
+    if(!PyArg_ParseTuple(args, "Oi", &obj, &delta)) {
+        return NULL;
+    }
+    if(delta != 0 && shift_lines(obj, delta) < 0) {
+        return NULL;
+    }
+    Py_RETURN_NONE;
+}
+
 static PyMethodDef lisn_methods [] = {
-    {"loads", str2lisn, METH_VARARGS, "loads string to build LISN AST"},
-    {"loads_file", file2lisn, METH_VARARGS, "loads file to build LISN AST"},
+    {"loads", (PyCFunction)str2lisn, METH_VARARGS | METH_KEYWORDS,
+     "loads string to build LISN AST. LISNNode objects are built instead of dicts if lazy is true"},
+    {"loads_file", (PyCFunction)file2lisn, METH_VARARGS | METH_KEYWORDS,
+     "loads file to build LISN AST. LISNNode objects are built instead of dicts if lazy is true"},
+    {"loads_buffer", (PyCFunction)buffer2lisn, METH_VARARGS | METH_KEYWORDS,
+     "loads an object supporting the buffer interface(bytearray, mmap, ...) without making a string of it first. LISNNode objects are built instead of dicts if lazy is true"},
+    {"_loads_blocks", (PyCFunction)str2blocks, METH_VARARGS | METH_KEYWORDS,
+     "loads string to build LISN AST, telling where its top-level blocks begin. used for incremental parsing"},
+    {"_shift_lines", (PyCFunction)shift_lines_func, METH_VARARGS,
+     "moves LISN AST dicts by some lines in place. used for incremental parsing"},
     {NULL, NULL, 0, NULL}
 };
 
@@ -627,4 +2133,10 @@ PyMODINIT_FUNC initclisn(void) {
     LISNParserException = PyErr_NewException("clisn.LISNParserException", LISNSyntaxException, NULL);
     Py_INCREF(LISNParserException);
     PyModule_AddObject(mod, "LISNParserException", LISNParserException);
+
+    locinfo_key = PyString_InternFromString("locinfo");
+    sline_key = PyString_InternFromString("sline");
+    eline_key = PyString_InternFromString("eline");
+
+    init_lazy_types(mod);
 }
@@ -1,4 +1,4 @@
-from clisn import loads, loads_file, \
+from clisn import loads, loads_file, loads_buffer, LISNNode, Location, \
                   LISNSyntaxException, LISNLexerException, LISNParserException
 
 def load_one(s):
@@ -0,0 +1,116 @@
+'''
+Incremental reparsing of edited sources.
+
+Every top-level expression of a source begins a block, which lasts until the
+next one. Lines holding only spaces and comments before an expression belong
+to both blocks around them. When some lines are edited, only the blocks
+overlapping them(and the one before, which indented lines may join) are
+parsed again, and their expressions are spliced into the suite in place of
+the old ones. Expressions after them are moved by the number of lines added
+or removed.
+
+Falls back to parsing the whole source whenever the edited blocks do not
+parse by themselves(e.g. a bracket or a string opened in them is closed
+after them), so that the result is always the same as loads(source).
+
+e.g)
+    doc = IncrementalTree(source)
+    ...
+    # lines 3~4 of source were replaced with lines 3~6 of new_source
+    suite = doc.edit(new_source, 3, 4, 6)
+'''
+from bisect import bisect_right
+from clisn import _loads_blocks, _shift_lines, LISNSyntaxException
+
+
+class IncrementalTree:
+    def __init__(self, source):
+        '''
+        Arguments -
+            source: string to be parsed entirely at first
+        '''
+        self.tree = None
+        # (sline, first_line, indent_char, dedented) of each top-level expression.
+        # None if they could not be told apart
+        self.blocks = None
+        self.parse(source)
+
+    def parse(self, source):
+        '''
+        Parses whole source again
+
+        Returns -
+            suite dict, the same as loads(source)
+        '''
+        self.tree = self.blocks = None
+        tree, blocks, _, _ = _loads_blocks(source)
+        if len(blocks) == len(tree["exprs"]):
+            self.blocks = blocks
+        self.tree = tree
+        return tree
+
+    def edit(self, source, sline, eline, new_eline):
+        '''
+        Updates the suite after lines sline~eline(1-based, inclusive) of the
+        last source were replaced with lines sline~new_eline of source. The
+        suite, the lists and the nodes in it are modified in place.
+
+        Returns -
+            suite dict, the same as loads(source)
+        '''
+        blocks = self.blocks
+        if self.tree is None or not blocks:
+            return self.parse(source)
+        delta = new_eline - eline
+
+        # blocks overlapping the edit, and the one before. where a block begins
+        # depends on the NEWLINE of the line before it as well
+        first = max(bisect_right([block[1] for block in blocks], sline) - 2, 0)
+        last = max(bisect_right([block[0] for block in blocks], eline + 1) - 1, first)
+        end = last + 1
+        at_eof = end == len(blocks)
+
+        lines = source.split("\n")
+        region_sline = blocks[first][0]
+        if at_eof:
+            text = "\n".join(lines[region_sline - 1:])
+        else:
+            region_eline = blocks[end][1] + delta - 1
+            text = "\n".join(lines[region_sline - 1:region_eline]) + "\n"
+
+        try:
+            if first == 0:
+                region, new_blocks, indent_char, ended_at_line_start = _loads_blocks(text)
+            else:
+                region, new_blocks, indent_char, ended_at_line_start = \
+                    _loads_blocks(text, blocks[first])
+        except LISNSyntaxException:
+            return self.parse(source)
+        exprs = region["exprs"]
+        if not new_blocks or len(new_blocks) != len(exprs):
+            return self.parse(source)
+        if not at_eof and \
+           (not ended_at_line_start or indent_char != blocks[end][2]):
+            # the blocks after depend on what the region left open
+            return self.parse(source)
+
+        tree_exprs = self.tree["exprs"]
+        _shift_lines(tree_exprs[end:], delta)
+        tree_exprs[first:end] = exprs
+
+        locinfo = self.tree["locinfo"]
+        region_locinfo = region["locinfo"]
+        if first == 0:
+            locinfo["sline"] = region_locinfo["sline"]
+            locinfo["scol"] = region_locinfo["scol"]
+        if at_eof:
+            locinfo["eline"] = region_locinfo["eline"]
+            locinfo["ecol"] = region_locinfo["ecol"]
+        else:
+            locinfo["eline"] += delta
+
+        if delta:
+            blocks[end:] = [(block_sline + delta, first_line + delta, block_indent_char, dedented)
+                            for block_sline, first_line, block_indent_char, dedented in blocks[end:]]
+        blocks[first:end] = new_blocks
+        return self.tree
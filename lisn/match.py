@@ -1,45 +1,35 @@
+import os
+import sys
+import marshal
+import hashlib
+import tempfile
+import cPickle as pickle
 from pprint import pprint
 from clisn import loads
 from itertools import chain
-from functional import car, cdr, cons, llist_to_list, list_to_llist, \
-                       llmap, LNone
+import functional
+from functional import car, cdr, cons, llist_to_list, LNone
 
 def _pull_left_string(s):
-    def _is_space(c):
-        return c == ' ' or c == '\t'
-    length = len(s)
-    idx = 0
-    head_space = 0
-    result = ""
-
-    while idx < length:
-        if _is_space(s[idx]):
-            head_space += 1
-        elif s[idx] == '\n':
-            head_space = 0
-        else:
+    '''
+    Strip leading blank lines, and as much indentation from each line as
+    the first non-blank line has
+    '''
+    lines = s.split("\n")
+    for idx, line in enumerate(lines):
+        first = line.lstrip(" \t")
+        if first:
             break
-        idx += 1
-
-    if idx >= length: # is eof
+    else: # is eof
         return ""
-    
-    while idx < length:
-        c = s[idx]
-        cur_space = 0
-        if c == '\n': # look ahead
-            idx += 1
-            result += "\n"
-            while idx < length and _is_space(s[idx]):
-                cur_space += 1
-                idx += 1
-            new_space = max(cur_space - head_space, 0)
 
-            result += " "*new_space
-        else:
-            result += c
-            idx += 1
-    return result
+    head_space = len(line) - len(first)
+    result = [first]
+    for line in lines[idx + 1:]:
+        stripped = line.lstrip(" \t")
+        cur_space = len(line) - len(stripped)
+        result.append(" "*max(cur_space - head_space, 0) + stripped)
+    return "\n".join(result)
 
 
 class LISNPatternException(Exception): pass
@@ -54,6 +44,31 @@ def make_string_matcher(pat_name):
         return StringMatcher(StringMatcher.EXACT_NAME, pat_name)
 
 
+def discriminator_key(lisn):
+    '''
+    Cheap key of lisn which pattern cases are dispatched on
+
+    Returns -
+        (type, None | head label, None | name | (type of head_expr, None | name))
+    '''
+    _type = lisn["type"]
+    if _type == "xexpr":
+        head_expr = lisn["head_expr"]
+        head_type = head_expr["type"]
+        if head_type == "name":
+            head_key = ("name", head_expr["name"])
+        else:
+            head_key = (head_type, None)
+        if lisn["has_head_label"]:
+            return (_type, lisn["head_label"], head_key)
+        else:
+            return (_type, None, head_key)
+    elif _type == "name":
+        return (_type, None, lisn["name"])
+    else:
+        return (_type, None, None)
+
+
 class LISNMatcher:
     def match(self, lisn):
         '''
@@ -61,6 +76,22 @@ class LISNMatcher:
         '''
         raise NotImplementedError
 
+    def accepts_key(self, key):
+        '''
+        key: discriminator_key of lisn
+
+        Returns -
+            False if lisn can never be matched, which is decided only with key
+        '''
+        return True
+
+    def arity_ranges(self):
+        '''
+        Returns -
+            None | ranges of arguments of xexpr. See XExprMatcher.arity_ranges
+        '''
+        return None
+
 
 class StringMatcher(LISNMatcher):
     EXACT_NAME = 1
@@ -98,6 +129,17 @@ class StringMatcher(LISNMatcher):
         else:
             raise Exception("NOT REACHABLE")
 
+    def accepts_key(self, key):
+        if self._type == self.EXACT_NAME:
+            return key[0] == "name" and key[2] == self.name
+        elif self._type == self.ANY_NAME:
+            return key[0] == "name"
+        else:
+            return True
+
+    def accepts_string(self, s):
+        return self._type != self.EXACT_NAME or s == self.name
+
 
 class XExprMatcher(LISNMatcher):
     def __init__(self, head_expr_matcher, head_label_matcher=None, 
@@ -123,6 +165,37 @@ class XExprMatcher(LISNMatcher):
         self.damp_matcher = damp_matcher
         self.vert_suite_matcher = vert_suite_matcher
 
+    def accepts_key(self, key):
+        _type, head_label, head_key = key
+        if _type != "xexpr":
+            return False
+        if head_key is None: # key of head_expr, which doesn't tell more
+            return True
+        if self.head_label_matcher is None:
+            if head_label is not None:
+                return False
+        elif head_label is None or not self.head_label_matcher.accepts_string(head_label):
+            return False
+        head_type, head_name = head_key
+        return self.head_expr_matcher.accepts_key((head_type, None, head_name))
+
+    def arity_ranges(self):
+        '''
+        Returns -
+            ((min, max) of the number of positional arguments,
+             (min, max) of the number of items in vertical suite)
+            where max is None if unbounded
+        '''
+        if self.pos_matcher:
+            pos_range = self.pos_matcher.arity_range()
+        else:
+            pos_range = (0, 0)
+        if self.vert_suite_matcher:
+            vert_range = self.vert_suite_matcher.arity_range()
+        else:
+            vert_range = (0, 0)
+        return (pos_range, vert_range)
+
     def match(self, lisn):
         result = {}
         if lisn["type"] != "xexpr":
@@ -195,47 +268,40 @@ class XExprMatcher(LISNMatcher):
         return (True, result)
 
 
-def _convert_info_dict(info_dict):
-    if info_dict is LNone:
-        return ()
-    elif isinstance(info_dict, dict):
-        result = {}
-        for key, value in info_dict.items():
-            result[key] = _convert_info_dict(value)
-        return result
-    elif isinstance(info_dict, tuple):
-        p = info_dict
-        result = []
-        while p is not LNone:
-            result.append(_convert_info_dict(car(p)))
-            p = cdr(p)
-        return tuple(result)
-    else:
-        return info_dict
+class PosMatcher:
+    _program = None # compiled lazily by match_pos
 
+    def arity_range(self):
+        '''
+        Returns -
+            (min, None | max) of the length of lists which can be matched
+        '''
+        return (0, None)
 
-class PosMatcher:
     def match_pos(self, lisn_list):
-        # Wrapper function for _match_pos which use llist instead of list and additional formal arguments
-        lisn_llist = list_to_llist(lisn_list) 
-        info_dict = {}
+        '''
+        lisn_list: (lisn | (string, lisn)) list
 
-        success = self._match_pos(lisn_llist, LNone, info_dict)
-        if success:
-            return (True, _convert_info_dict(info_dict))
-        else:
+        Returns -
+            (bool, dict)
+        '''
+        program = self._program
+        if program is None:
+            program = []
+            self._emit(program)
+            program.append((_OP_MATCH, ))
+            program = self._program = tuple(program)
+
+        info_dict = _run_program(program, lisn_list)
+        if info_dict is None:
             return (False, None)
-        
+        else:
+            return (True, info_dict)
 
-    def _match_pos(self, lisn_llist, seq_cont, info_dict):
+    def _emit(self, code):
         '''
-        lisn_llist: (lisn | (string, lisn)) list
-        seq_cont: (matcher x dict) llist 
-            first element of pairs are containing matchers to be matched next
-            second element of pairs is a scope dict
-
-        Returns -
-            bool
+        Append instructions of this matcher to code(instruction list).
+        See _run_program for the instruction set.
         '''
         raise NotImplementedError
 
@@ -255,15 +321,188 @@ class KeywordMatcher:
 #
 # Regex-style matching implementation
 #
+# Positional matchers are compiled into a program of a backtracking VM,
+# much like a regex. The VM runs over a plain list with an index and keeps
+# alternatives in an explicit stack, so it never recurses per element.
+# Threads record what they capture as an event llist, which is shared
+# between a thread and the alternatives it pushed. Dicts of the result
+# are built from the events of the successful thread only.
+#
 
-def _follow_cont(lisn_llist, seq_cont):
-    if lisn_llist is LNone and seq_cont is LNone:
-        return True
-    elif seq_cont is LNone:
-        return False
+_OP_ITEM = 0          # (op, label_matcher, lisn_matcher): match one element
+_OP_SPLIT = 1         # (op, pc, alt_pc): try pc, backtrack to alt_pc
+_OP_JUMP = 2          # (op, pc)
+_OP_OPEN = 3          # (op, ): open a new scope dict
+_OP_CLOSE = 4         # (op, kind, group_name, inherit_group): close the scope
+_OP_STAR_INIT = 5     # (op, group_name): group of kleene star/plus starts
+_OP_SET_NONE = 6      # (op, group_name): optional group is skipped
+_OP_MARK = 7          # (op, ): remember position at the start of an iteration
+_OP_CHECK_PROGRESS = 8 # (op, ): fail if nothing is consumed since the mark
+_OP_JUMP_IF_AT_END = 9 # (op, pc)
+_OP_AT_END = 10       # (op, ): fail unless all elements are consumed
+_OP_FAIL = 11         # (op, )
+_OP_MATCH = 12        # (op, ): succeed if all elements are consumed
+
+# kinds of _OP_CLOSE
+_SCOPE_GROUP = 0
+_SCOPE_OPTIONAL = 1
+_SCOPE_ITERATION = 2
+
+
+def _match_item(label_matcher, lisn_matcher, item):
+    '''
+    Returns -
+        None | dict
+    '''
+    if isinstance(item, tuple):
+        if not label_matcher:
+            return None
+        label_str, single_lisn = item
+        label_suc, label_res = label_matcher.match_string(label_str)
+        if not label_suc:
+            return None
+    else:
+        if label_matcher:
+            return None
+        label_res = None
+        single_lisn = item
+
+    single_suc, single_res = lisn_matcher.match(single_lisn)
+    if not single_suc:
+        return None
+    if label_res:
+        result = dict(label_res)
+        result.update(single_res)
+        return result
     else:
-        mat, scope_dict = car(seq_cont)
-        return mat._match_pos(lisn_llist, cdr(seq_cont), scope_dict)
+        return single_res
+
+
+def _run_program(code, lisn_list):
+    '''
+    Returns -
+        None | dict
+    '''
+    length = len(lisn_list)
+    backtrack_stack = []
+    pc = 0
+    pos = 0
+    events = LNone
+    marks = LNone
+
+    while True:
+        inst = code[pc]
+        op = inst[0]
+        if op == _OP_ITEM:
+            if pos < length:
+                res = _match_item(inst[1], inst[2], lisn_list[pos])
+            else:
+                res = None
+            if res is not None:
+                if res:
+                    events = cons(res, events)
+                pos += 1
+                pc += 1
+                continue
+        elif op == _OP_SPLIT:
+            backtrack_stack.append((inst[2], pos, events, marks))
+            pc = inst[1]
+            continue
+        elif op == _OP_JUMP:
+            pc = inst[1]
+            continue
+        elif op == _OP_OPEN or \
+             op == _OP_CLOSE or \
+             op == _OP_STAR_INIT or \
+             op == _OP_SET_NONE:
+            events = cons(inst, events)
+            pc += 1
+            continue
+        elif op == _OP_MARK:
+            marks = cons(pos, marks)
+            pc += 1
+            continue
+        elif op == _OP_CHECK_PROGRESS:
+            start_pos = car(marks)
+            marks = cdr(marks)
+            if pos > start_pos:
+                pc += 1
+                continue
+        elif op == _OP_JUMP_IF_AT_END:
+            if pos == length:
+                pc = inst[1]
+            else:
+                pc += 1
+            continue
+        elif op == _OP_AT_END:
+            if pos == length:
+                pc += 1
+                continue
+        elif op == _OP_MATCH:
+            if pos == length:
+                return _build_info_dict(events)
+        # fail
+        if not backtrack_stack:
+            return None
+        pc, pos, events, marks = backtrack_stack.pop()
+
+
+def _build_info_dict(events):
+    '''
+    Replay events of the successful thread to build result dict
+    '''
+    scopes = [{}]
+    kleene_groups = [[]] # names of kleene groups of each scope
+
+    def close_scope():
+        scope = scopes.pop()
+        for group_name in kleene_groups.pop():
+            scope[group_name] = tuple(scope[group_name])
+        return scope
+
+    for event in reversed(llist_to_list(events)):
+        if isinstance(event, dict): # result of _OP_ITEM
+            scopes[-1].update(event)
+            continue
+        op = event[0]
+        if op == _OP_OPEN:
+            scopes.append({})
+            kleene_groups.append([])
+        elif op == _OP_CLOSE:
+            _, kind, group_name, inherit_group = event
+            sub_dict = close_scope()
+            parent = scopes[-1]
+            if kind == _SCOPE_ITERATION:
+                if group_name:
+                    parent[group_name].append(sub_dict)
+            elif group_name:
+                parent[group_name] = sub_dict
+            elif inherit_group and (sub_dict or kind == _SCOPE_GROUP):
+                parent.update(sub_dict)
+        elif op == _OP_STAR_INIT:
+            group_name = event[1]
+            if group_name not in scopes[-1]:
+                scopes[-1][group_name] = []
+                kleene_groups[-1].append(group_name)
+        elif op == _OP_SET_NONE:
+            scopes[-1][event[1]] = None
+    return close_scope()
+
+
+def _emit_scope(code, mat, kind, group_name, inherit_group):
+    code.append((_OP_OPEN, ))
+    mat._emit(code)
+    code.append((_OP_CLOSE, kind, group_name, inherit_group))
+
+
+def _emit_kleene_loop(code, submat, group_name):
+    loop_pc = len(code)
+    code.append(None) # _OP_SPLIT
+    code.append((_OP_MARK, ))
+    _emit_scope(code, submat, _SCOPE_ITERATION, group_name, False)
+    code.append((_OP_CHECK_PROGRESS, ))
+    code.append((_OP_JUMP, loop_pc))
+    code[loop_pc] = (_OP_SPLIT, loop_pc + 1, len(code))
 
 
 class PosSingle(PosMatcher):
@@ -271,31 +510,11 @@ class PosSingle(PosMatcher):
         self.lisn_matcher = lisn_matcher
         self.label_matcher = label_matcher
 
-    def _match_pos(self, lisn_llist, seq_cont, info_dict):
-        if lisn_llist is LNone:
-            return False
-        else:
-            item_to_be_matched = car(lisn_llist)
-            if isinstance(item_to_be_matched, tuple):
-                if not self.label_matcher:
-                    return False
-                label_str, single_lisn = item_to_be_matched
-                label_suc, label_res = self.label_matcher.match_string(label_str)
-                if label_suc:
-                    info_dict.update(label_res)
-                else:
-                    return False
-            else:
-                if self.label_matcher:
-                    return False
-                single_lisn = item_to_be_matched
-
-            single_suc, single_res = self.lisn_matcher.match(single_lisn)
-            if single_suc:
-                info_dict.update(single_res)
-                return _follow_cont(cdr(lisn_llist), seq_cont)
-            else:
-                return False
+    def arity_range(self):
+        return (1, 1)
+
+    def _emit(self, code):
+        code.append((_OP_ITEM, self.label_matcher, self.lisn_matcher))
 
 
 class PosOr(PosMatcher):
@@ -304,23 +523,38 @@ class PosOr(PosMatcher):
         self.group_name = group_name
         self.inherit_group = inherit_group
 
-    def _match_pos(self, lisn_llist, seq_cont, info_dict):
-        for mat in self.mats:
-            sub_dict = {}
-            if mat._match_pos(lisn_llist, seq_cont, sub_dict):
-                if self.group_name:
-                    info_dict[self.group_name] = sub_dict
-                elif self.inherit_group:
-                    info_dict.update(sub_dict)
-                return True
-        return False
+    def arity_range(self):
+        ranges = [mat.arity_range() for mat in self.mats]
+        maxes = [_max for _, _max in ranges]
+        return (min(_min for _min, _ in ranges),
+                None if None in maxes else max(maxes))
+
+    def _emit(self, code):
+        if not self.mats:
+            code.append((_OP_FAIL, ))
+            return
+
+        jump_pcs = []
+        for idx, mat in enumerate(self.mats):
+            is_last = idx == len(self.mats) - 1
+            if not is_last:
+                split_pc = len(code)
+                code.append(None) # _OP_SPLIT
+            _emit_scope(code, mat, _SCOPE_GROUP, self.group_name, self.inherit_group)
+            if not is_last:
+                jump_pcs.append(len(code))
+                code.append(None) # _OP_JUMP
+                code[split_pc] = (_OP_SPLIT, split_pc + 1, len(code))
+        for jump_pc in jump_pcs:
+            code[jump_pc] = (_OP_JUMP, len(code))
+
 
 class PosNone(PosMatcher):
-    def _match_pos(self, lisn_llist, seq_cont, info_dict):
-        if lisn_llist is LNone:
-            return _follow_cont(lisn_llist, seq_cont)
-        else:
-            return False
+    def arity_range(self):
+        return (0, 0)
+
+    def _emit(self, code):
+        code.append((_OP_AT_END, ))
 
 
 class PosGroup(PosMatcher):
@@ -329,22 +563,18 @@ class PosGroup(PosMatcher):
         self.mats = mats 
         self.group_name = group_name
         self.inherit_group = inherit_group
-        
-    def _match_pos(self, lisn_llist, seq_cont, info_dict):
-        sub_dict = {}
 
-        res_seq_cont = seq_cont
-        for matcher in self.mats[1:][::-1]:
-            res_seq_cont = cons((matcher, sub_dict),
-                                res_seq_cont)
-        if self.mats[0]._match_pos(lisn_llist, res_seq_cont, sub_dict):
-            if self.group_name:
-                info_dict[self.group_name] = sub_dict
-            elif self.inherit_group:
-                info_dict.update(sub_dict)
-            return True
-        else:
-            return False
+    def arity_range(self):
+        ranges = [mat.arity_range() for mat in self.mats]
+        maxes = [_max for _, _max in ranges]
+        return (sum(_min for _min, _ in ranges),
+                None if None in maxes else sum(maxes))
+
+    def _emit(self, code):
+        code.append((_OP_OPEN, ))
+        for mat in self.mats:
+            mat._emit(code)
+        code.append((_OP_CLOSE, _SCOPE_GROUP, self.group_name, self.inherit_group))
 
 
 class PosOptional(PosMatcher):
@@ -353,25 +583,25 @@ class PosOptional(PosMatcher):
         self.group_name = group_name
         self.inherit_group = inherit_group
 
-    def _match_pos(self, lisn_llist, seq_cont, info_dict):
-        def set_group(sub_dict=None):
-            if self.group_name:
-                info_dict[self.group_name] = sub_dict
-            elif self.inherit_group and sub_dict:
-                info_dict.update(sub_dict)
-
-        if lisn_llist is LNone:
-            set_group(None)
-            return _follow_cont(lisn_llist, seq_cont)
-        else:
-            sub_dict = {}
-            submat = self.submat
-            if submat._match_pos(lisn_llist, seq_cont, sub_dict):
-                set_group(sub_dict)
-                return True
-            else:
-                set_group(None)
-                return _follow_cont(lisn_llist, seq_cont)
+    def arity_range(self):
+        return (0, self.submat.arity_range()[1])
+
+    def _emit(self, code):
+        # submat is not tried at the end of list
+        at_end_pc = len(code)
+        code.append(None) # _OP_JUMP_IF_AT_END
+        split_pc = len(code)
+        code.append(None) # _OP_SPLIT
+        _emit_scope(code, self.submat, _SCOPE_OPTIONAL, self.group_name, self.inherit_group)
+        jump_pc = len(code)
+        code.append(None) # _OP_JUMP
+        skip_pc = len(code)
+        if self.group_name:
+            code.append((_OP_SET_NONE, self.group_name))
+
+        code[at_end_pc] = (_OP_JUMP_IF_AT_END, skip_pc)
+        code[split_pc] = (_OP_SPLIT, split_pc + 1, skip_pc)
+        code[jump_pc] = (_OP_JUMP, len(code))
             
 
 class PosKleeneStar(PosMatcher):
@@ -380,19 +610,13 @@ class PosKleeneStar(PosMatcher):
         self.group_name = group_name
         self.inherit_group = inherit_group
 
-    def _match_pos(self, lisn_llist, seq_cont, info_dict):
-        if self.group_name and self.group_name not in info_dict:
-            info_dict[self.group_name] = LNone 
-            
-        submat = self.submat
-        sub_dict = {}
-        if self.submat._match_pos(lisn_llist, cons((self, info_dict), seq_cont), sub_dict):
-            consed_info = cons(sub_dict, info_dict[self.group_name])
-            if self.group_name:
-                info_dict[self.group_name] = consed_info
-            return True
-        else:
-            return _follow_cont(lisn_llist, seq_cont)
+    def arity_range(self):
+        return (0, None)
+
+    def _emit(self, code):
+        if self.group_name:
+            code.append((_OP_STAR_INIT, self.group_name))
+        _emit_kleene_loop(code, self.submat, self.group_name)
 
 
 class PosKleenePlus(PosMatcher):
@@ -401,24 +625,14 @@ class PosKleenePlus(PosMatcher):
         self.group_name = group_name
         self.inherit_group = inherit_group
 
-    def _match_pos(self, lisn_llist, seq_cont, info_dict):
-        if self.group_name and self.group_name not in info_dict:
-            info_dict[self.group_name] = LNone 
-            
-        submat = self.submat
-        sub_dict = {}
-        
-        if self.submat._match_pos(lisn_llist,
-                                 cons((PosKleeneStar(self.submat,
-                                                     self.group_name),
-                                       info_dict),
-                                      seq_cont),
-                                 sub_dict):
-            if self.group_name:
-                info_dict[self.group_name] = cons(sub_dict, info_dict[self.group_name])
-            return True
-        else:
-            return False
+    def arity_range(self):
+        return (self.submat.arity_range()[0], None)
+
+    def _emit(self, code):
+        if self.group_name:
+            code.append((_OP_STAR_INIT, self.group_name))
+        _emit_scope(code, self.submat, _SCOPE_ITERATION, self.group_name, False)
+        _emit_kleene_loop(code, self.submat, self.group_name)
 
 
 class KwDictStyleMatcher(KeywordMatcher):
@@ -746,50 +960,518 @@ def _compile_string_pattern(pat_s):
     return make_string_matcher(pat_s)
 
 
-def compile_pattern(pat_lisn):
+def compile_pattern(pat_lisn, generate_code=False):
     '''
     lisn -> LISNMatcher
+
+    If generate_code is True, GeneratedMatcher of the interpreted matcher
+    is returned.
     '''
     type_name = pat_lisn["type"]
     if type_name == "name":
-        return _compile_name_pattern(pat_lisn)
+        matcher = _compile_name_pattern(pat_lisn)
     elif type_name == "xexpr":
-        return _compile_xexpr_pattern(pat_lisn)
+        matcher = _compile_xexpr_pattern(pat_lisn)
     else:
         raise Exception("NOT REACHABLE")
 
+    if generate_code:
+        return GeneratedMatcher(matcher)
+    else:
+        return matcher
+
+
+#
+# Code generation
+#
+
+class GeneratedMatcher(LISNMatcher):
+    '''
+    Matcher which runs a python function generated from an interpreted
+    matcher(reference). Fields of lisn are checked in straight-line code and
+    captured values are bound directly into the result dict. Matchers of
+    repetitive positional patterns are still run by the interpreter.
+    '''
+    def __init__(self, reference, generated=None):
+        '''
+        generated: None | (source, constant dict, code object), which is
+                   generated from reference if it is not given
+        '''
+        if generated is None:
+            generated = _MatcherCodeGen().generate(reference)
+        self.reference = reference
+        self.source, self.constants, self.code = generated
+        namespace = dict(self.constants)
+        exec self.code in namespace
+        self.match_fun = namespace["match"]
+
+    def __getstate__(self):
+        return (self.reference, self.source, self.constants, marshal.dumps(self.code))
+
+    def __setstate__(self, state):
+        reference, source, constants, marshaled_code = state
+        self.__init__(reference, (source, constants, marshal.loads(marshaled_code)))
+
+    def match(self, lisn):
+        result = self.match_fun(lisn)
+        if result is None:
+            return (False, None)
+        else:
+            return (True, result)
+
+    def accepts_key(self, key):
+        return self.reference.accepts_key(key)
+
+    def arity_ranges(self):
+        return self.reference.arity_ranges()
+
+
+def _single_sequence(pos_matcher):
+    '''
+    Returns -
+        None | PosSingle list which pos_matcher matches in sequence
+    '''
+    if isinstance(pos_matcher, PosSingle):
+        return [pos_matcher]
+    elif isinstance(pos_matcher, PosNone):
+        return []
+    elif isinstance(pos_matcher, PosGroup) and \
+         all(isinstance(mat, PosSingle) for mat in pos_matcher.mats):
+        return pos_matcher.mats
+    else:
+        return None
+
+
+class _MatcherCodeGen:
+    def __init__(self):
+        self.lines = []
+        self.namespace = {}
+        self.var_count = 0
+
+    def new_var(self, prefix):
+        self.var_count += 1
+        return "%s%d" % (prefix, self.var_count)
+
+    def const(self, obj, prefix):
+        name = self.new_var(prefix)
+        self.namespace[name] = obj
+        return name
+
+    def emit(self, line):
+        self.lines.append("    " + line)
+
+    def fail_if(self, cond):
+        self.emit("if %s:" % cond)
+        self.emit("    return None")
+
+    def generate(self, matcher):
+        '''
+        Returns -
+            (source, constant dict, code object)
+            Executing code object in a copy of constant dict defines
+            match(lisn) -> None | dict
+        '''
+        self.emit("result = {}")
+        self.gen_lisn(matcher, "lisn", "result")
+        self.emit("return result")
+        source = "def match(lisn):\n" + "\n".join(self.lines) + "\n"
+        code = compile(source, "<generated lisn matcher>", "exec")
+        return (source, self.namespace, code)
+
+    def gen_lisn(self, matcher, var, target):
+        if isinstance(matcher, StringMatcher):
+            name = matcher.name
+            if matcher._type == StringMatcher.EXACT_NAME:
+                self.fail_if('%s["type"] != "name" or %s["name"] != %r'%(var, var, name))
+            elif matcher._type == StringMatcher.ANY_NAME:
+                self.fail_if('%s["type"] != "name"'%var)
+                self.emit('%s[%r] = %s["name"]'%(target, name, var))
+            else:
+                self.emit('%s[%r] = %s'%(target, name, var))
+        elif isinstance(matcher, XExprMatcher):
+            self.gen_xexpr(matcher, var, target)
+        else:
+            res = self.new_var("res")
+            self.emit("%s = %s.match(%s)"%(res, self.const(matcher, "matcher"), var))
+            self.fail_if("not %s[0]"%res)
+            self.emit("%s.update(%s[1])"%(target, res))
+
+    def gen_string(self, matcher, expr, target):
+        if matcher._type == StringMatcher.EXACT_NAME:
+            self.fail_if("%s != %r"%(expr, matcher.name))
+        else:
+            self.emit("%s[%r] = %s"%(target, matcher.name, expr))
+
+    def gen_xexpr(self, matcher, var, target):
+        self.fail_if('%s["type"] != "xexpr"'%var)
+        if matcher.head_label_matcher is None:
+            self.fail_if('%s["has_head_label"]'%var)
+        else:
+            self.fail_if('not %s["has_head_label"]'%var)
+            self.gen_string(matcher.head_label_matcher, '%s["head_label"]'%var, target)
+
+        head = self.new_var("head")
+        self.emit('%s = %s["head_expr"]'%(head, var))
+        self.gen_lisn(matcher.head_expr_matcher, head, target)
+
+        arg_info = self.new_var("arg_info")
+        self.emit('%s = %s["arg_info"]'%(arg_info, var))
+        # positional arguments
+        pargs = self.new_var("pargs")
+        self.emit('%s = %s["pargs"]'%(pargs, arg_info))
+        if matcher.pos_matcher:
+            self.gen_pos(matcher.pos_matcher, pargs, target, False)
+        else:
+            self.fail_if(pargs)
+        # keyword arguments
+        kargs = self.new_var("kargs")
+        self.emit('%s = %s["kargs"]'%(kargs, arg_info))
+        if matcher.kw_matcher:
+            self.gen_kw(matcher.kw_matcher, kargs, target)
+        else:
+            self.fail_if(kargs)
+        # special arguments
+        for special_matcher, key in [(matcher.star_matcher, "star"),
+                                     (matcher.dstar_matcher, "dstar"),
+                                     (matcher.amp_matcher, "amp"),
+                                     (matcher.damp_matcher, "damp")]:
+            special = self.new_var(key)
+            self.emit('%s = %s.get(%r)'%(special, arg_info, key))
+            if special_matcher:
+                self.gen_special(special_matcher, special, target)
+            else:
+                self.fail_if(special)
+        # vertical suite
+        if matcher.vert_suite_matcher:
+            vert = self.new_var("vert")
+            self.emit('%s = %s["vert_suite"]["exprs"] if %s["has_vert_suite"] else ()'%(vert, var, var))
+            self.gen_pos(matcher.vert_suite_matcher, vert, target, True)
+        else:
+            self.fail_if('%s["has_vert_suite"] and %s["vert_suite"]["exprs"]'%(var, var))
+
+    def gen_interpreted_pos(self, pos_matcher, list_expr, target):
+        res = self.new_var("res")
+        self.emit("%s = %s.match_pos(%s)"%(res, self.const(pos_matcher, "pos_matcher"), list_expr))
+        self.fail_if("not %s[0]"%res)
+        self.emit("%s.update(%s[1])"%(target, res))
+
+    def gen_group_target(self, pos_matcher, target):
+        '''
+        Returns -
+            name of dict which captured values of pos_matcher are bound to
+        '''
+        if isinstance(pos_matcher, PosGroup) and \
+           (pos_matcher.group_name or not pos_matcher.inherit_group):
+            sub = self.new_var("group")
+            self.emit("%s = {}"%sub)
+            if pos_matcher.group_name:
+                self.emit("%s[%r] = %s"%(target, pos_matcher.group_name, sub))
+            return sub
+        else:
+            return target
+
+    def gen_pos(self, pos_matcher, lst, target, is_suite):
+        '''
+        lst: name of lisn list, or list of suite items if is_suite is True
+        '''
+        singles = _single_sequence(pos_matcher)
+        if singles is None:
+            if is_suite:
+                lst = '[(e["arrow_lstring"], e["param"]) if e["is_arrow"] else e["param"] for e in %s]'%lst
+            self.gen_interpreted_pos(pos_matcher, lst, target)
+            return
+
+        self.fail_if("len(%s) != %d"%(lst, len(singles)))
+        sub = self.gen_group_target(pos_matcher, target)
+        for idx, single in enumerate(singles):
+            item = self.new_var("item")
+            self.emit("%s = %s[%d]"%(item, lst, idx))
+            self.gen_single(single, item, sub, is_suite)
+
+    def gen_single(self, single, item, target, is_suite):
+        label_matcher = single.label_matcher
+        if is_suite:
+            if label_matcher:
+                self.fail_if('not %s["is_arrow"]'%item)
+                self.gen_string(label_matcher, '%s["arrow_lstring"]'%item, target)
+            else:
+                self.fail_if('%s["is_arrow"]'%item)
+            value = self.new_var("value")
+            self.emit('%s = %s["param"]'%(value, item))
+        else:
+            if label_matcher:
+                self.fail_if("not isinstance(%s, tuple)"%item)
+                label = self.new_var("label")
+                value = self.new_var("value")
+                self.emit("%s, %s = %s"%(label, value, item))
+                self.gen_string(label_matcher, label, target)
+            else:
+                self.fail_if("isinstance(%s, tuple)"%item)
+                value = item
+        self.gen_lisn(single.lisn_matcher, value, target)
+
+    def gen_special(self, pos_matcher, special, target):
+        singles = _single_sequence(pos_matcher)
+        if singles is not None and len(singles) == 1:
+            self.fail_if("%s is None"%special)
+            sub = self.gen_group_target(pos_matcher, target)
+            self.gen_single(singles[0], special, sub, False)
+        else:
+            self.gen_interpreted_pos(pos_matcher,
+                                     "[] if %s is None else [%s]"%(special, special),
+                                     target)
+
+    def gen_kw(self, kw_matcher, kargs, target):
+        if not isinstance(kw_matcher, KwDictStyleMatcher):
+            res = self.new_var("res")
+            self.emit("%s = %s.match_kw(%s)"%(res, self.const(kw_matcher, "kw_matcher"), kargs))
+            self.fail_if("not %s[0]"%res)
+            self.emit("%s.update(%s[1])"%(target, res))
+            return
+
+        kwds = self.new_var("kwds")
+        name = self.new_var("name")
+        value = self.new_var("value")
+        self.emit("%s = {}"%kwds)
+        self.emit("for %s, %s in %s:"%(name, value, kargs))
+        self.emit("    if %s in %s:"%(name, kwds)) # duplicated
+        self.emit("        return None")
+        self.emit("    %s[%s] = %s"%(kwds, name, value))
+        if kw_matcher.exact:
+            self.fail_if("len(%s) != %d"%(kwds, len(kw_matcher.matcher_dict)))
+
+        if kw_matcher.group_name:
+            sub = self.new_var("group")
+            self.emit("%s = {}"%sub)
+            self.emit("%s[%r] = %s"%(target, kw_matcher.group_name, sub))
+        else:
+            sub = target
+        for _str, matcher in kw_matcher.matcher_dict.items():
+            kwd = self.new_var("kwd")
+            self.emit("%s = %s.get(%r)"%(kwd, kwds, _str))
+            self.fail_if("%s is None"%kwd)
+            self.gen_lisn(matcher, kwd, sub)
+        if not kw_matcher.exact:
+            names = self.const(frozenset(kw_matcher.matcher_dict.keys()), "names")
+            self.emit("%s['__rest__'] = dict((k, v) for k, v in %s.items() if k not in %s)"%(sub, kwds, names))
+
+
+
+def _in_range(n, arity_range):
+    _min, _max = arity_range
+    return _min <= n and (_max is None or n <= _max)
+
+
+class _CaseTree:
+    '''
+    Decision tree over pattern cases. Cases are first narrowed down by
+    discriminator_key of lisn, that is its type, head label and head name,
+    and then by the number of positional arguments and items of vertical
+    suite. Only the remaining cases are tried with their full matchers, in
+    order of declaration.
+    '''
+    def __init__(self, test_fun_pairs):
+        self.cases = []
+        for matcher, fun in test_fun_pairs:
+            arity_ranges = matcher.arity_ranges()
+            if arity_ranges is None:
+                pos_range = vert_range = None
+            else:
+                pos_range, vert_range = arity_ranges
+            self.cases.append((matcher, fun, pos_range, vert_range))
+        self.branches = {} # discriminator key -> case list
+
+    def candidates(self, lisn):
+        key = discriminator_key(lisn)
+        try:
+            cases = self.branches[key]
+        except KeyError:
+            cases = [case for case in self.cases if case[0].accepts_key(key)]
+            self.branches[key] = cases
+        if not cases or key[0] != "xexpr":
+            return cases
+
+        num_pargs = len(lisn["arg_info"]["pargs"])
+        if lisn["has_vert_suite"]:
+            num_vert_items = len(lisn["vert_suite"]["exprs"])
+        else:
+            num_vert_items = 0
+        return [case for case in cases
+                if case[2] is None or
+                   (_in_range(num_pargs, case[2]) and
+                    _in_range(num_vert_items, case[3]))]
+
+
+#
+# Pattern cache
+#
+
+def _default_pattern_cache_dir():
+    '''
+    Returns -
+        None | $XDG_CACHE_HOME/lisn/patterns, which defaults to
+               ~/.cache/lisn/patterns
+    '''
+    cache_home = os.environ.get("XDG_CACHE_HOME") or \
+                 os.path.expanduser(os.path.join("~", ".cache"))
+    if not os.path.isabs(cache_home):
+        # no home directory to put it in
+        return None
+    return os.path.join(cache_home, "lisn", "patterns")
+
+# Directory where compiled patterns are pickled, keyed by hash of pattern
+# string. It is per user, since cached matchers are unpickled and trusted.
+# None or empty string disables the cache.
+PATTERN_CACHE_DIR = os.environ.get("LISN_PATTERN_CACHE_DIR",
+                                   _default_pattern_cache_dir())
+
+_pattern_cache_version = None
+
+
+def _source_digest(modules):
+    '''
+    Returns -
+        sha1 hex digest of source files of modules
+    '''
+    digest = hashlib.sha1()
+    for module in modules:
+        path = module.__file__
+        if path.endswith((".pyc", ".pyo")) and os.path.isfile(path[:-1]):
+            path = path[:-1]
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def _get_pattern_cache_version():
+    '''
+    Cached matchers are pickled instances of classes in this module and
+    functional, with code generated by this module, so the cache is keyed by
+    their sources.
+
+    Returns -
+        None | sha1 hex digest, None if the sources cannot be read
+    '''
+    global _pattern_cache_version
+    if _pattern_cache_version is None:
+        try:
+            _pattern_cache_version = _source_digest([sys.modules[__name__], functional])
+        except (AttributeError, IOError, OSError):
+            _pattern_cache_version = ""
+    return _pattern_cache_version or None
+
+
+def compile_pattern_string(pat_string):
+    '''
+    string -> LISNMatcher(interpreted)
+    '''
+    pat_suite = loads(pat_string)
+
+    if len(pat_suite["exprs"]) >= 2:
+        raise ValueError("Too many pattern nodes in pattern docstring")
+    if len(pat_suite["exprs"]) == 0:
+        raise ValueError("No pattern node in pattern docstring")
+
+    obj = pat_suite["exprs"][0]
+    pat_lisn = obj["param"]
+    return compile_pattern(pat_lisn)
+
+
+def _pattern_cache_path(pat_string, generate_code):
+    # generated code is marshaled, which depends on python version
+    key = "\0".join([_get_pattern_cache_version(),
+                     sys.version,
+                     "generated" if generate_code else "interpreted",
+                     pat_string])
+    return os.path.join(PATTERN_CACHE_DIR, hashlib.sha1(key).hexdigest() + ".pickle")
+
+
+def _write_pattern_cache(cache_path, matcher):
+    # written into a temporary file first not to leave a broken cache.
+    # Failing to write it is the same as a cache miss.
+    tmp_path = None
+    try:
+        cache_dir = os.path.dirname(cache_path)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, 0o700)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir)
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(matcher, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, cache_path)
+        tmp_path = None
+    except Exception:
+        pass
+    finally:
+        if tmp_path is not None:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+
+
+def load_pattern(pat_string, generate_code=False):
+    '''
+    The same as compile_pattern_string, except that the matcher is loaded
+    from PATTERN_CACHE_DIR if it was cached, and cached otherwise.
+    GeneratedMatcher is returned if generate_code is True.
+    '''
+    def _compile():
+        matcher = compile_pattern_string(pat_string)
+        if generate_code:
+            matcher = GeneratedMatcher(matcher)
+        return matcher
+
+    if not PATTERN_CACHE_DIR or _get_pattern_cache_version() is None:
+        return _compile()
+
+    cache_path = _pattern_cache_path(pat_string, generate_code)
+    try:
+        with open(cache_path, "rb") as f:
+            return pickle.load(f)
+    except Exception:
+        # missing or broken cache
+        pass
+
+    matcher = _compile()
+    _write_pattern_cache(cache_path, matcher)
+    return matcher
 
 
 class LISNPattern:
-    def __init__(self, pattern_decl_fun):
-        self.test_fun_pairs = []
+    '''
+    Patterns of cases are compiled at the first call(or by compile()), not
+    when LISNPattern is declared.
+    '''
+    def __init__(self, pattern_decl_fun, generate_code=True):
+        self.generate_code = generate_code
+        self.case_funs = []
+        self.test_fun_pairs = None
+        self.case_tree = None
         self._default_placeholder = lambda: None
         self.default_case_fun = self._default_placeholder 
 
         def add_case(fun):
             if fun.__doc__ is None:
                 raise ValueError("case's docstring should be filled with pattern string")
-            pat_string = _pull_left_string(fun.__doc__)
-            pat_suite = loads(pat_string)
-
-            if len(pat_suite["exprs"]) >= 2:
-                raise ValueError("Too many pattern nodes in pattern docstring")
-            if len(pat_suite["exprs"]) == 0:
-                raise ValueError("No pattern node in pattern docstring")
-
-            obj = pat_suite["exprs"][0]
-            pat_lisn = obj["param"]
-
-            matcher = compile_pattern(pat_lisn)
-            self.test_fun_pairs.append((matcher, fun))
+            self.case_funs.append(fun)
 
         def default_case(fun):
             self.default_case_fun = fun
 
         pattern_decl_fun(add_case, default_case)
 
+    def compile(self):
+        test_fun_pairs = []
+        for fun in self.case_funs:
+            matcher = load_pattern(_pull_left_string(fun.__doc__), self.generate_code)
+            test_fun_pairs.append((matcher, fun))
+        self.test_fun_pairs = test_fun_pairs
+        self.case_tree = _CaseTree(test_fun_pairs)
+
     def __call__(self, lisn):
-        for test_pat, fun in self.test_fun_pairs:
+        if self.case_tree is None:
+            self.compile()
+        for test_pat, fun, _, _ in self.case_tree.candidates(lisn):
             success, result = test_pat.match(lisn)
             if success:
                 return fun(**result)
@@ -0,0 +1,83 @@
+#!/usr/bin/env ipython
+import unittest
+
+from clisn import loads, LISNSyntaxException
+from incremental import IncrementalTree
+
+SOURCE = '''\
+pyimport os
+
+# helpers
+def Helper(x):
+    x + 1
+
+def Page(n):
+    $let(a = n * 2):
+        p: str(a)
+        ul:
+            li(k="v"): "one"
+
+x = 1
+'''
+
+class IncrementalTest(unittest.TestCase):
+    def assert_edit(self, source, sline, eline, new_lines):
+        '''
+        replaces lines sline~eline of source with new_lines, and checks the
+        result with loads
+        '''
+        lines = source.split("\n")
+        new_source = "\n".join(lines[:sline - 1] + new_lines + lines[eline:])
+        doc = IncrementalTree(source)
+        try:
+            expected = loads(new_source)
+        except LISNSyntaxException as e:
+            self.assertRaises(type(e), doc.edit, new_source, sline, eline, sline + len(new_lines) - 1)
+            return new_source
+        self.assertEqual(doc.edit(new_source, sline, eline, sline + len(new_lines) - 1),
+                         expected)
+        self.assertEqual(doc.blocks, IncrementalTree(new_source).blocks)
+        return new_source
+
+    def test_edit_in_block(self):
+        self.assert_edit(SOURCE, 9, 9, ["        p: str(a + 1)"])
+        self.assert_edit(SOURCE, 5, 5, ["    x + 2", "    x + 3"])
+        self.assert_edit(SOURCE, 10, 11, [])
+
+    def test_blank_lines_and_comments(self):
+        self.assert_edit(SOURCE, 2, 3, [])
+        self.assert_edit(SOURCE, 6, 6, ["", "# page", ""])
+        self.assert_edit(SOURCE, 12, 12, ["y = 2", ""])
+
+    def test_join_and_split_blocks(self):
+        # indented lines join the block before
+        self.assert_edit(SOURCE, 6, 6, ["    x + 2"])
+        self.assert_edit(SOURCE, 4, 4, ["def Helper(x): x", "z = 1"])
+        self.assert_edit(SOURCE, 1, 1, ["pyimport os", "def Other():", "    1"])
+
+    def test_open_brackets_and_strings(self):
+        self.assert_edit(SOURCE, 5, 5, ["    f(x,"])
+        self.assert_edit(SOURCE, 5, 5, ["    f(x,", "      1)"])
+        self.assert_edit(SOURCE, 5, 5, ['    """'])
+        self.assert_edit(SOURCE, 5, 5, ["    x + \\"])
+
+    def test_edits_in_a_row(self):
+        doc = IncrementalTree(SOURCE)
+        source = SOURCE
+        for sline, eline, new_lines in [(9, 9, ["        p: b"]),
+                                        (5, 5, ["    f(x,"]),
+                                        (5, 5, ["    f(x)"]),
+                                        (13, 13, ["x = 2", "y = 3"]),
+                                        (2, 2, ["", ""])]:
+            lines = source.split("\n")
+            source = "\n".join(lines[:sline - 1] + new_lines + lines[eline:])
+            try:
+                expected = loads(source)
+            except LISNSyntaxException as e:
+                self.assertRaises(type(e), doc.edit, source, sline, eline, sline + len(new_lines) - 1)
+                continue
+            self.assertEqual(doc.edit(source, sline, eline, sline + len(new_lines) - 1), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
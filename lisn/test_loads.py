@@ -0,0 +1,186 @@
+#!/usr/bin/env ipython
+import os
+import mmap
+import pickle
+import tempfile
+import threading
+import unittest
+
+from clisn import loads, loads_file, loads_buffer, LISNNode, Location, LISNSyntaxException
+
+SOURCE = '''\
+pyimport os
+
+def Page(n, *args, **kwargs):
+    $let(a = n * 2, b = -n):
+        p: str(a) + "x"
+        ul(class="c"):
+            li(k="v"): x[1:2].y
+        $if a > 1.5:
+            'one'
+        $else:
+            b
+
+x = y.z[0]
+'''
+
+
+class LazyLoadsTest(unittest.TestCase):
+    def test_equal_to_eager(self):
+        for source in [SOURCE, "", "a"]:
+            eager = loads(source)
+            lazy = loads(source, lazy=True)
+            self.assertIsInstance(lazy, LISNNode)
+            self.assertEqual(lazy, eager)
+            self.assertEqual(eager, lazy)
+            self.assertEqual(dict(lazy), eager)
+            self.assertEqual(eager, dict(lazy))
+            self.assertEqual(lazy.to_dict(), eager)
+            self.assertEqual(type(lazy.to_dict()), dict)
+            self.assertEqual(pickle.loads(pickle.dumps(lazy)), eager)
+
+    def assert_same(self, lazy, eager):
+        '''
+        checks each value of lazy against eager by accessing it, rather than
+        comparing whole trees
+        '''
+        if isinstance(eager, dict):
+            self.assertIsInstance(lazy, (LISNNode, Location))
+            if isinstance(lazy, LISNNode):
+                self.assertEqual(sorted(lazy.keys()), sorted(eager.keys()))
+                self.assertEqual(len(lazy), len(eager))
+            for key in eager:
+                self.assertIn(key, lazy)
+                self.assert_same(lazy[key], eager[key])
+                self.assertEqual(lazy.get(key), eager[key])
+            self.assertEqual(lazy.get("no such key", 42), 42)
+        elif isinstance(eager, (list, tuple)):
+            self.assertEqual(type(lazy), type(eager))
+            self.assertEqual(len(lazy), len(eager))
+            for lazy_value, eager_value in zip(lazy, eager):
+                self.assert_same(lazy_value, eager_value)
+        else:
+            self.assertEqual(type(lazy), type(eager))
+            self.assertEqual(lazy, eager)
+
+    def test_same_keys_and_values(self):
+        self.assert_same(loads(SOURCE, lazy=True), loads(SOURCE))
+
+    def test_location(self):
+        loc = Location(1, 2, 3, 4)
+        locinfo = {"sline": 1, "eline": 2, "scol": 3, "ecol": 4}
+        self.assertEqual(loc, (1, 2, 3, 4))
+        self.assertEqual(hash(loc), hash((1, 2, 3, 4)))
+        self.assertEqual(loc, locinfo)
+        self.assertEqual(locinfo, loc)
+        self.assertNotEqual(loc, dict(locinfo, ecol=5))
+        self.assertEqual(loc.to_dict(), locinfo)
+        self.assertEqual(loc["scol"], 3)
+        self.assertEqual(loc[2], 3)
+        self.assertEqual(loc.get("ecol"), 4)
+        self.assertIn("sline", loc)
+        self.assertIn(3, loc)
+        self.assertNotIn("line", loc)
+        self.assertEqual(pickle.loads(pickle.dumps(loc)), loc)
+
+
+class LoadsBufferTest(unittest.TestCase):
+    # long enough to be parsed without the GIL
+    LONG_SOURCE = SOURCE * 20
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".tpy")
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def write(self, source):
+        with open(self.path, "wb") as f:
+            f.write(source)
+
+    def test_loads_file(self):
+        for source in [SOURCE, self.LONG_SOURCE, "", "a", "x = 1"]:
+            self.write(source)
+            for lazy in (False, True):
+                self.assertEqual(loads_file(self.path, lazy=lazy), loads(source))
+        self.write("def F(:\n")
+        self.assertRaises(LISNSyntaxException, loads_file, self.path)
+        self.assertRaises(IOError, loads_file, self.path + ".missing")
+
+    def test_loads_buffer(self):
+        for source in [SOURCE, self.LONG_SOURCE, "", "a"]:
+            expected = loads(source)
+            self.write(source)
+            for lazy in (False, True):
+                self.assertEqual(loads_buffer(source, lazy=lazy), expected)
+                self.assertEqual(loads_buffer(bytearray(source), lazy=lazy), expected)
+                self.assertEqual(loads_buffer(buffer(source), lazy=lazy), expected)
+                if source:
+                    with open(self.path, "rb") as f:
+                        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                        try:
+                            self.assertEqual(loads_buffer(mapped, lazy=lazy), expected)
+                        finally:
+                            mapped.close()
+        self.assertRaises(LISNSyntaxException, loads_buffer, bytearray("def F(:\n"))
+        self.assertRaises(TypeError, loads_buffer, 1)
+
+    def test_lazy_buffer_changed(self):
+        # lazy trees do not see later changes of the buffer
+        source = bytearray(SOURCE)
+        lazy = loads_buffer(source, lazy=True)
+        source[:len("pyimport")] = "x" * len("pyimport")
+        self.assertEqual(lazy, loads(SOURCE))
+
+
+class ThreadedLoadsTest(unittest.TestCase):
+    def test_threads(self):
+        # more threads than idle parsers kept, parsing sources which are long
+        # enough to release the GIL
+        long_source = LoadsBufferTest.LONG_SOURCE
+        self.assertTrue(len(long_source) >= 2048)
+        sources = [long_source, long_source.replace("Page", "Other") + "x = 2\n"]
+        expected = [loads(source) for source in sources]
+        broken = long_source + "def F(:\n"
+        paths = []
+        for source in sources:
+            fd, path = tempfile.mkstemp(suffix=".tpy")
+            os.write(fd, source)
+            os.close(fd)
+            paths.append(path)
+        failures = []
+
+        def work(idx):
+            try:
+                for n in range(5):
+                    k = (idx + n) % len(sources)
+                    lazy = bool(n % 2)
+                    results = [loads(sources[k], lazy=lazy),
+                               loads_buffer(bytearray(sources[k]), lazy=lazy),
+                               loads_file(paths[k], lazy=lazy)]
+                    for result in results:
+                        if result != expected[k]:
+                            failures.append((idx, n, "differs"))
+                    try:
+                        loads(broken)
+                        failures.append((idx, n, "no error"))
+                    except LISNSyntaxException:
+                        pass
+            except Exception as e:
+                failures.append((idx, repr(e)))
+
+        threads = [threading.Thread(target=work, args=(idx, )) for idx in range(12)]
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            for path in paths:
+                os.remove(path)
+        self.assertEqual(failures, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
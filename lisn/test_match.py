@@ -1,8 +1,14 @@
 #!/usr/bin/env ipython
+import os
+import shutil
+import tempfile
+import types
 import unittest
 
 from clisn import loads
-from match import LISNPattern
+import match
+from match import LISNPattern, compile_pattern, _pull_left_string, load_pattern, \
+                  _write_pattern_cache, _source_digest, _default_pattern_cache_dir
 from pprint import pprint
 
 class PatternTest(unittest.TestCase):
@@ -174,6 +180,185 @@ yinyang:
                 return res
         pprint(pat_yinyang(yy_lisn))
 
+
+class GeneratedMatcherTest(unittest.TestCase):
+    PATTERNS = [
+        'FooBar',
+        'NAME$a',
+        '$a',
+        'c(NAME$x)',
+        'thunk: $node',
+        '''
+        defvar NAME$var_name:
+            $val_node
+        ''',
+        '''
+        f>
+            parg_first
+            parg_second
+            keyword -> dict:
+                label -> karg
+            *__optional__:
+                star
+            **dstar
+            &amp
+            &&damp
+        ''',
+        '''
+        def NAME$funname>
+            __kleene_star__(pargs): NAME$argname
+            keyword -> dict(kargs)
+            *__optional__(star): NAME$argname
+            **__optional__(dstar): NAME$argname
+            &__optional__(amp): NAME$argname
+            &&__optional__(damp): NAME$argname
+        --
+            __kleene_star__(body): $expr
+        ''',
+        '''
+        lets>
+            keyword -> seq:
+                __kleene_star__(definition):
+                    NAME$key -> $value
+        --
+            __kleene_plus__(body): $expr
+        ''',
+        '''
+        yinyang:
+            __kleene_star__(list):
+                __or__:
+                    __group__(yin):
+                        yin
+                    __group__(yang):
+                        yang
+        ''',
+        '''
+        NAME$tag>
+            keyword -> dict(attrs)
+        --
+            NAME$first -> $value
+            __group__(rest):
+                $second
+                __optional__(third): c(NAME$x)
+        ''',
+    ]
+
+    SOURCES = [
+        'FooBar',
+        'b',
+        'c(a)',
+        'c(1)',
+        'thunk: a + 2',
+        'defvar x: foo(1 + 2)',
+        'f(parg_first, parg_second, label=karg, **dstar, &amp, &&damp)',
+        'f(parg_first, parg_second, label=karg, *star, **dstar, &amp, &&damp)',
+        'def go(a, b, c, d=2, e=3, *f, **g, &h, &&i)',
+        '''
+lets>
+    a -> 1
+    a -> a + 1
+--
+    a
+''',
+        '''
+yinyang:
+    yin
+    yang
+    yang
+    yin
+''',
+        '''
+div(id="main"):
+    x -> 1
+    b
+    c(d)
+''',
+        '''
+div(id="main"):
+    x -> 1
+    b
+''',
+        '''
+div:
+    b
+''',
+    ]
+
+    def test_same_as_interpreted(self):
+        for pat_string in self.PATTERNS:
+            pat_lisn = loads(_pull_left_string(pat_string))["exprs"][0]["param"]
+            interpreted = compile_pattern(pat_lisn)
+            generated = compile_pattern(pat_lisn, generate_code=True)
+            for source in self.SOURCES:
+                for lazy in (False, True):
+                    lisn = loads(source, lazy=lazy)["exprs"][0]["param"]
+                    self.assertEqual(interpreted.match(lisn),
+                                     generated.match(lisn),
+                                     (pat_string, source))
+
+
+class PatternCacheTest(unittest.TestCase):
+    PATTERN = '''
+    NAME$tag>
+        keyword -> dict(attrs)
+    --
+        NAME$first -> $value
+        __kleene_star__(rest): $expr
+    '''
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.old_cache_dir = match.PATTERN_CACHE_DIR
+        match.PATTERN_CACHE_DIR = self.cache_dir
+
+    def tearDown(self):
+        match.PATTERN_CACHE_DIR = self.old_cache_dir
+        shutil.rmtree(self.cache_dir)
+
+    def test_load_pattern(self):
+        lisn = loads('''
+div(id="main"):
+    x -> 1
+    b
+''')["exprs"][0]["param"]
+        for generate_code in (False, True):
+            compiled = load_pattern(_pull_left_string(self.PATTERN), generate_code)
+            cached = load_pattern(_pull_left_string(self.PATTERN), generate_code)
+            self.assertEqual(type(cached), type(compiled))
+            self.assertEqual(cached.match(lisn), compiled.match(lisn))
+            self.assertTrue(cached.match(lisn)[0])
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+
+    def test_write_failure(self):
+        # unpicklable matcher is a cache miss, without a temporary file left
+        cache_path = os.path.join(self.cache_dir, "x.pickle")
+        _write_pattern_cache(cache_path, lambda: None)
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_keyed_by_source(self):
+        path = os.path.join(self.cache_dir, "mod.py")
+        module = types.ModuleType("mod")
+        module.__file__ = path + "c"
+        with open(path, "w") as f:
+            f.write("x = 1\n")
+        digest = _source_digest([module])
+        with open(path, "w") as f:
+            f.write("x = 2\n")
+        self.assertNotEqual(_source_digest([module]), digest)
+
+    def test_default_dir(self):
+        old = os.environ.get("XDG_CACHE_HOME")
+        os.environ["XDG_CACHE_HOME"] = self.cache_dir
+        try:
+            self.assertEqual(_default_pattern_cache_dir(),
+                             os.path.join(self.cache_dir, "lisn", "patterns"))
+        finally:
+            if old is None:
+                del os.environ["XDG_CACHE_HOME"]
+            else:
+                os.environ["XDG_CACHE_HOME"] = old
+
+
 if __name__ == "__main__":
     unittest.main()
 
@@ -0,0 +1,106 @@
+#!/usr/bin/env ipython
+import unittest
+
+from clisn import loads
+from utils import LISNVisitor, LISNVisitException, calculator
+
+
+class VisitorTest(unittest.TestCase):
+    def test_fall_through(self):
+        visitor = LISNVisitor()
+        calls = []
+
+        @visitor.add.name
+        def visit_x(visit, obj):
+            calls.append("x")
+            if obj["name"] != "x":
+                return False
+            return "x"
+
+        @visitor.add.name
+        def visit_y(visit, obj):
+            calls.append("y")
+            if obj["name"] != "y":
+                return False
+            return "y"
+
+        for lazy in (False, True):
+            del calls[:]
+            x, y, z = [loads(s, lazy=lazy)["exprs"][0]["param"] for s in ["x", "y", "z"]]
+            self.assertEqual(visitor(x), "x")
+            self.assertEqual(visitor(y), "y")
+            self.assertEqual(calls, ["x", "x", "y"])
+            self.assertRaises(LISNVisitException, visitor, z)
+
+        @visitor.add.default_name
+        def visit_default(visit, obj):
+            return "default " + obj["name"]
+
+        self.assertEqual(visitor(z), "default z")
+        self.assertEqual(visitor(x), "x")
+
+    def test_single_visitor_returning_false(self):
+        visitor = LISNVisitor()
+
+        @visitor.add.name
+        def visit_name(visit, obj):
+            return False
+
+        self.assertRaises(LISNVisitException, visitor, loads("a")["exprs"][0]["param"])
+
+        @visitor.add.default_name
+        def visit_default(visit, obj):
+            return "default"
+
+        self.assertEqual(visitor(loads("a")["exprs"][0]["param"]), "default")
+
+    def test_default_only(self):
+        visitor = LISNVisitor()
+
+        @visitor.add.default_literal
+        def visit_literal(visit, obj):
+            return obj["content"]
+
+        self.assertEqual(visitor(loads("1")["exprs"][0]["param"]), "1")
+        self.assertRaises(ValueError, visitor.add.default_literal, visit_literal)
+
+    def test_validation(self):
+        visitor = LISNVisitor()
+
+        @visitor.add.default_name
+        def visit_name(visit, obj):
+            return obj["name"]
+
+        self.assertRaises(ValueError, visitor, [])
+        self.assertRaises(ValueError, visitor, {"name": "a"})
+        self.assertRaises(ValueError, visitor, {"type": "no such type"})
+        self.assertRaises(LISNVisitException, visitor, loads("1")["exprs"][0]["param"])
+
+    def test_debug(self):
+        class NotLISN(object):
+            def __getitem__(self, key):
+                return {"type": "name", "name": "a"}[key]
+
+        for debug in (False, True):
+            visitor = LISNVisitor(debug=debug)
+
+            @visitor.add.name
+            def visit_name(visit, obj):
+                return obj["name"]
+
+            self.assertEqual(visitor(loads("a")["exprs"][0]["param"]), "a")
+            self.assertRaises(ValueError, visitor, {"type": "no such type"})
+            if debug:
+                self.assertRaises(ValueError, visitor, NotLISN())
+            else:
+                # only checked when the type is not dispatched
+                self.assertEqual(visitor(NotLISN()), "a")
+
+    def test_calculator(self):
+        self.assertEqual(calculator("1 + 2 * 3"), 7)
+        self.assertEqual(calculator("-(2 ** 3) % 5\n1.5 / 3"), 0.5)
+        self.assertEqual(calculator(""), None)
+
+
+if __name__ == "__main__":
+    unittest.main()
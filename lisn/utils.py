@@ -1,4 +1,4 @@
-from clisn import loads, loads_file
+from clisn import loads, loads_file, LISNNode
 
 ALL_TYPES = set([
     "trailer", "name", "literal",
@@ -7,12 +7,12 @@ ALL_TYPES = set([
 ])
 
 def _check_lisn_validity(lisn):
-    if not isinstance(lisn, dict):
-        raise ValueError("LISN object should be a dict object")
+    if not isinstance(lisn, (dict, LISNNode)):
+        raise ValueError("LISN object should be a dict or LISNNode object")
 
-    _type = lisn['type']
     if 'type' not in lisn:
         raise ValueError("LISN object doesn't have `type` key")
+    _type = lisn['type']
 
     if _type not in ALL_TYPES:
         raise ValueError("%s is not valid LISN type"%_type)
@@ -24,16 +24,35 @@ class _VisitorCollection:
     def __init__(self):
         self.visitors = {}
         self.default_visitors = {}
+        self.dispatch_table = None
 
     def _register_visitor(self, _type, fun):
         if _type not in self.visitors:
             self.visitors[_type] = []
         self.visitors[_type].append(fun)
+        self.dispatch_table = None
 
     def _register_default_visitor(self, _type, fun):
-        if _type in self.visitors:
+        if _type in self.default_visitors:
             raise ValueError("Default visitor should be only one")
         self.default_visitors[_type] = fun
+        self.dispatch_table = None
+
+    def compile(self):
+        '''
+        Build dispatch table from registered visitors.
+
+        Returns -
+            dict of type to (visitor tuple, default visitor or None)
+        '''
+        table = {}
+        for _type in ALL_TYPES:
+            visitors = tuple(self.visitors.get(_type, []))
+            def_visitor = self.default_visitors.get(_type)
+            if visitors or def_visitor is not None:
+                table[_type] = (visitors, def_visitor)
+        self.dispatch_table = table
+        return table
 
     def __getattr__(self, _type):
         if _type.startswith("default_"):
@@ -48,7 +67,7 @@ class _VisitorCollection:
 
         if default_case:
             def default_visitor_registerer(fun):
-                self._register_default_visitor(_type, fun)
+                self._register_default_visitor(_core_type, fun)
                 return fun
 
             return default_visitor_registerer
@@ -59,34 +78,57 @@ class _VisitorCollection:
 
             return visitor_registerer
 
+
 class LISNVisitor:
-    def __init__(self):
+    '''
+    Visitor which dispatches LISN objects to functions registered by type.
+
+    e.g)
+        visitor = LISNVisitor()
+
+        @visitor.add.binop
+        def visit_binop(visit, obj):
+            return (visit(obj["lhs"]), obj["op"], visit(obj["rhs"]))
+
+    Visitors of a type are tried in order of registration until one of them
+    returns a value other than False. If all of them return False, the
+    default visitor is called, or LISNVisitException is raised if there is
+    no default visitor.
+
+    LISN objects are validated before they are visited if debug is True.
+    Otherwise, an object whose type cannot be dispatched is validated then,
+    so that malformed objects still raise ValueError.
+    '''
+    def __init__(self, debug=False):
         self.add = _VisitorCollection()
+        self.debug = debug
 
     def __call__(self, *args, **kwds):
         return self.visit(*args, **kwds)
 
     def visit(self, lisn_obj, *ctx_args, **ctx_kwds):
-        _check_lisn_validity(lisn_obj)
-
-        _type = lisn_obj['type']
-
-        done = False
-        for visitor in self.add.visitors.get(_type, []):
+        if self.debug:
+            _check_lisn_validity(lisn_obj)
+
+        dispatch_table = self.add.dispatch_table
+        if dispatch_table is None:
+            dispatch_table = self.add.compile()
+        try:
+            visitors, def_visitor = dispatch_table[lisn_obj['type']]
+        except (KeyError, TypeError):
+            _check_lisn_validity(lisn_obj)
+            raise LISNVisitException('No match case for type \'%s\'. '
+                                     'Try to make default visitor.'%lisn_obj['type'])
+
+        for visitor in visitors:
             ret = visitor(self.visit, lisn_obj, *ctx_args, **ctx_kwds)
             if ret != False: 
-                done = True
-                break
-
-        if not done:
-            # last chance to catch 
-            def_visitor = self.add.default_visitors.get(_type)
-            if def_visitor is None:
-                raise LISNVisitException('No match case for type \'%s\'. '
-                                         'Try to make default visitor.'%_type)
-            ret = def_visitor(self.visit, lisn_obj, *ctx_args, **ctx_kwds)
-            done = True
-        return ret
+                return ret
+        # last chance to catch 
+        if def_visitor is None:
+            raise LISNVisitException('No match case for type \'%s\'. '
+                                     'Try to make default visitor.'%lisn_obj['type'])
+        return def_visitor(self.visit, lisn_obj, *ctx_args, **ctx_kwds)
 
 
 _calculator = LISNVisitor()
@@ -26,7 +26,7 @@ setup(name="LISN",
       author_email="a9413miky@gmail.com",
       packages=["lisn", "tempy"],
       ext_modules=[Extension("clisn",
-                             sources=["clisn/ast.c", "clisn/lexer.c",
+                             sources=["clisn/arena.c", "clisn/ast.c", "clisn/lexer.c",
                                       "clisn/ast-make.c", "clisn/parser.c", 
                                       "clisn/astmisc.c",
                                       "clisnmod.c"])],
@@ -2,17 +2,22 @@ import py_compile
 import time
 import marshal
 import errno
-import traceback
 
 from os.path import join as path_join, isfile, isdir, getmtime
-from translate import translate_file, translate_string, pystmts_to_string
 from struct import unpack
 
 from errors import TempyError, TempyImportError, TempyCompileError, TempyNativeCompileError
+import linemap
+# translate, lisn(with clisn) and multiprocessing are imported where they
+# are used, so that they are not loaded at all while every template is
+# served from fresh .tpyc files.
 
 TEMPY_EXT = "tpy"
 TEMPYC_EXT = "tpyc"
 
+PREFETCH_TIMEOUT = 60 # seconds a worker of Environment.prefetch may take for a module
+_PREFETCH_POLL_INTERVAL = 0.1
+
 
 class TempyModule:
     def __init__(self, name, env, _dir, _global=None):
@@ -44,23 +49,86 @@ class _Importer:
 
 
 
-def _write_code(filename, codeobject):
+def _write_code(filename, codeobject, line_table):
     with open(filename, "wb") as fc:
         fc.write('\0\0\0\0')
         py_compile.wr_long(fc, long(time.time()))
         marshal.dump(codeobject, fc)
+        marshal.dump(line_table, fc)
         fc.flush()
         fc.seek(0, 0)
         fc.write(py_compile.MAGIC)
 
+def _is_tpyc_fresh(tpy_path, tpyc_path):
+    try:
+        with open(tpyc_path, "rb") as f:
+            header = f.read(8)
+    except IOError:
+        return False
+    if len(header) < 8 or header[:4] != py_compile.MAGIC:
+        return False
+    tpyc_timestamp = unpack("<I", header[4:])[0]
+    try:
+        tpy_timestamp = long(getmtime(tpy_path))
+    except (IOError, OSError):
+        tpy_timestamp = 0
+    return tpyc_timestamp > tpy_timestamp
+
+
+def _source_mtime(tpy_path):
+    try:
+        return getmtime(tpy_path)
+    except (IOError, OSError):
+        return None
+
+
+def _prefetch_worker(tpy_path, need_code, write_py, translate_config):
+    '''
+    Compile a module in a worker process of Environment.prefetch, the same as
+    Environment would do with translate_config.
+
+    Returns -
+        (tpy_path, import names, None | (marshaled code, line table, None | python source))
+    Any error is left to be raised when the module is actually imported.
+    '''
+    try:
+        from lisn import loads_file
+        from translate import main_translate, collect_import_names, pystmts_to_string
+        suite = loads_file(tpy_path, lazy=True)
+        import_names = collect_import_names(suite)
+    except Exception:
+        return (tpy_path, [], None)
+    if not need_code:
+        return (tpy_path, import_names, None)
+    try:
+        stmts = main_translate(suite, tpy_path, translate_config)
+        code, line_table = _compile_kont(stmts, tpy_path)
+        py_source = pystmts_to_string(stmts) if write_py else None
+        return (tpy_path, import_names, (marshal.dumps(code), line_table, py_source))
+    except Exception:
+        return (tpy_path, import_names, None)
+
+
 def _naive_logger(x): print("[TempyEnvironmentLog]", x)
 
 class CompileOption:
-    def __init__(self, use_tpyc=True, write_py=False, verbose=False, logger=_naive_logger):
+    def __init__(self, use_tpyc=True, write_py=False, verbose=False, logger=_naive_logger, prefetch_processes=0,
+                 translate_config=None):
+        '''
+        prefetch_processes -
+            If it is positive, Environment.module prefetches modules with
+            that many processes. See Environment.prefetch
+        translate_config -
+            None | translate.Config which modules are compiled with. It is
+            sent to worker processes of Environment.prefetch, so it should
+            be picklable for them to be used.
+        '''
         self.use_tpyc = use_tpyc
         self.write_py = write_py
         self.verbose = verbose
         self.logger = logger
+        self.prefetch_processes = prefetch_processes
+        self.translate_config = translate_config
 
 
     def log(self, x):
@@ -113,26 +181,42 @@ class Environment:
         self.main_module = TempyModule(main_name, self, pwd)
         self.shared_dict = {}
         self.compile_option = compile_option if compile_option else CompileOption()
+        self.translation_cache = None # created when a module is compiled first
+        self.precompiled = {} # tpy path -> (code, line table, mtime of tpy), filled by prefetch
+        self.prefetched = set() # dotted names given to prefetch
 
 
     def _code_generation(self, tpy_path, tpyc_path, write_to_pyc=True):
+        from translate import translate_file, pystmts_to_string, TranslationCache
+        if self.translation_cache is None:
+            self.translation_cache = TranslationCache()
+        stmts = translate_file(tpy_path,
+                               config=self.compile_option.translate_config,
+                               translation_cache=self.translation_cache)
         if self.compile_option.write_py:
             py_path = _exchange_ext(tpyc_path, "py")
             try:
                 with open(py_path, "w") as f:
-                    f.write(pystmts_to_string(translate_file(tpy_path)))
+                    f.write(pystmts_to_string(stmts))
             except IOError as err:
                 self.compile_option.log("IOError occured while writing .py file(%s): %s"%(tpyc_path, str(err)))
-        code = compile_file(tpy_path)
+        code, line_table = _compile_kont(stmts, tpy_path)
         if write_to_pyc:
             try:
-                _write_code(tpyc_path, code)
+                _write_code(tpyc_path, code, line_table)
             except IOError as err:
                 self.compile_option.log("IOError occured while writing codeobject to .tpyc file(%s): %s"%(tpyc_path, str(err)))
         return code
 
 
     def _retrieve_code(self, tpy_path, tpyc_path):
+        if tpy_path in self.precompiled:
+            code, line_table, mtime = self.precompiled.pop(tpy_path)
+            if _source_mtime(tpy_path) == mtime:
+                linemap.register(code.co_filename, line_table)
+                return code
+            # modified after it was prefetched
+            self.compile_option.log("Prefetched code of %s is outdated"%tpy_path)
         if self.compile_option.use_tpyc:
             if isfile(tpyc_path):
                 try:
@@ -153,6 +237,12 @@ class Environment:
                     if tpyc_timestamp <= tpy_timestamp: # outdated
                         return self._code_generation(tpy_path, tpyc_path)
                     code = marshal.load(f)
+                    try:
+                        line_table = marshal.load(f)
+                    except (EOFError, ValueError, TypeError):
+                        line_table = None # written without line table
+                    if line_table is not None:
+                        linemap.register(code.co_filename, line_table)
                     return code
                 except IOError as err:
                     if err.errno == errno.ENOENT: # No such file
@@ -168,6 +258,17 @@ class Environment:
             return self._code_generation(tpy_path, tpyc_path, write_to_pyc=False)
 
 
+    def _locate(self, parent_dir, module_name):
+        '''
+        Returns -
+            (tpy path, if it is shared, directory of the module)
+        '''
+        pair = self.module_fetcher.fetch_dir_by_name(parent_dir, module_name)
+        if pair is None:
+            raise TempyImportError("No such module named '%s'"%module_name)
+        tpy_path, is_shared = pair
+        return (tpy_path, is_shared, path_join(parent_dir, module_name))
+
     def _import(self, parent_module, module_name, visited=None, invoker_module_name=None):
         if module_name in parent_module.__submodule__:
             return parent_module.__submodule__[module_name]
@@ -176,10 +277,7 @@ class Environment:
         else:
             if visited is None:
                 visited = set()
-            pair = self.module_fetcher.fetch_dir_by_name(parent_module.__dir__, module_name)
-            if pair is None:
-                raise TempyImportError("No such module named '%s'"%module_name)
-            tpy_path, is_shared = pair
+            tpy_path, is_shared, module_dir = self._locate(parent_module.__dir__, module_name)
             tpyc_path = _exchange_ext(tpy_path, TEMPYC_EXT)
 
             try:
@@ -188,7 +286,7 @@ class Environment:
                 raise
             except Exception as error:
                 err_info = str(error)
-                err_msg = "Cannot import the module named '%s': %s\n%s"%(module_name, err_info, traceback.format_exc())
+                err_msg = "Cannot import the module named '%s': %s\n%s"%(module_name, err_info, linemap.format_exc())
                 raise TempyImportError(err_msg)
             else:
                 lcl = {} # local
@@ -206,7 +304,7 @@ class Environment:
                                                               visited.union([current_module_name])
                                                               ),
                                                     None)
-                mod = TempyModule(current_module_name, self, path_join(parent_module.__dir__, module_name), exec_result)
+                mod = TempyModule(current_module_name, self, module_dir, exec_result)
                 if self.cache_module:
                     if is_shared:
                         self.shared_dict[module_name] = mod
@@ -223,31 +321,154 @@ class Environment:
         return iter_module
 
     def module(self, dotted_str):
+        if self.compile_option.prefetch_processes > 0 and \
+           dotted_str not in self.prefetched:
+            self.prefetch(dotted_str)
         return self._module(dotted_str.split("."))
 
+    def _module_paths(self, names):
+        '''
+        Returns -
+            tpy paths of modules which are executed when names is imported,
+            located the same as _module does
+        '''
+        paths = []
+        _dir = self.main_module.__dir__
+        for module_name in names:
+            try:
+                tpy_path, _, _dir = self._locate(_dir, module_name)
+            except TempyImportError:
+                break
+            paths.append(tpy_path)
+        return paths
+
+    def _store_prefetched(self, tpy_path, mtime, compiled):
+        if _source_mtime(tpy_path) != mtime:
+            return # modified while it was compiled
+        marshaled_code, line_table, py_source = compiled
+        code = marshal.loads(marshaled_code)
+        self.precompiled[tpy_path] = (code, line_table, mtime)
+        tpyc_path = _exchange_ext(tpy_path, TEMPYC_EXT)
+        if py_source is not None:
+            py_path = _exchange_ext(tpyc_path, "py")
+            try:
+                with open(py_path, "w") as f:
+                    f.write(py_source)
+            except IOError as err:
+                self.compile_option.log("IOError occured while writing .py file(%s): %s"%(py_path, str(err)))
+        if self.compile_option.use_tpyc:
+            try:
+                _write_code(tpyc_path, code, line_table)
+            except IOError as err:
+                self.compile_option.log("IOError occured while writing codeobject to .tpyc file(%s): %s"%(tpyc_path, str(err)))
 
+    def prefetch(self, dotted_str, processes=None, timeout=PREFETCH_TIMEOUT):
+        '''
+        Compile the module named dotted_str and every module it imports,
+        directly or not, on a pool of worker processes without executing any of
+        them. Imports of a module are followed as soon as it is parsed, so it
+        takes about the time of the longest chain of imports rather than the sum.
+
+        Compiled code is kept until the module is imported, and written to
+        .tpyc files if use_tpyc is set. Modules with fresh .tpyc files are only
+        scanned for imports. Modules which fail to compile, or whose worker
+        fails or takes more than timeout seconds, are compiled as usual when
+        they are imported.
+        '''
+        import multiprocessing
+        import Queue
+
+        self.prefetched.add(dotted_str)
+        use_tpyc = self.compile_option.use_tpyc
+        write_py = self.compile_option.write_py
+        translate_config = self.compile_option.translate_config
+        pool = multiprocessing.Pool(processes or self.compile_option.prefetch_processes or None)
+        finished = Queue.Queue() # results of jobs that succeeded, put by callbacks
+        jobs = {} # tpy path -> (AsyncResult, mtime of tpy, deadline)
+        visited = set()
+
+        def submit(names):
+            for tpy_path in self._module_paths(names):
+                if tpy_path in visited:
+                    continue
+                visited.add(tpy_path)
+                mtime = _source_mtime(tpy_path)
+                tpyc_path = _exchange_ext(tpy_path, TEMPYC_EXT)
+                need_code = tpy_path not in self.precompiled and \
+                            not (use_tpyc and _is_tpyc_fresh(tpy_path, tpyc_path))
+                async_result = pool.apply_async(_prefetch_worker,
+                                                (tpy_path, need_code, write_py, translate_config),
+                                                callback=finished.put)
+                jobs[tpy_path] = (async_result, mtime, time.time() + timeout)
+
+        def drop_failed_jobs():
+            now = time.time()
+            for tpy_path, (async_result, _, deadline) in jobs.items():
+                if async_result.ready():
+                    if async_result.successful():
+                        continue # its callback is about to put the result
+                    try:
+                        async_result.get(0)
+                    except Exception as err:
+                        self.compile_option.log("Failed to prefetch %s: %s"%(tpy_path, str(err)))
+                elif now > deadline:
+                    self.compile_option.log("Timed out while prefetching %s"%tpy_path)
+                else:
+                    continue
+                del jobs[tpy_path]
 
+        try:
+            submit(dotted_str.split("."))
+            while jobs:
+                try:
+                    # waiting with a timeout can be interrupted, and lets jobs
+                    # which will never put their results be found
+                    tpy_path, import_names, compiled = finished.get(timeout=_PREFETCH_POLL_INTERVAL)
+                except Queue.Empty:
+                    drop_failed_jobs()
+                    continue
+                if tpy_path not in jobs:
+                    continue # dropped after the timeout
+                _, mtime, _ = jobs.pop(tpy_path)
+                if compiled is not None:
+                    self._store_prefetched(tpy_path, mtime, compiled)
+                for names in import_names:
+                    submit(names)
+        finally:
+            # every job is either finished or abandoned, and workers of
+            # abandoned ones may never return
+            pool.terminate()
+            pool.join()
 
 def _compile_kont(stmts, filename):
-    src = pystmts_to_string(stmts)
+    '''
+    Returns -
+        (code object, line table)
+    '''
+    from translate import pystmts_to_ast, AstLineCounter
+    # python ast is compiled directly, not to build and parse source text again
+    counter = AstLineCounter()
     try:
-        code = compile(src, filename, "exec")
-        return code
+        code = compile(pystmts_to_ast(stmts, counter), filename, "exec")
     except SyntaxError as error:
         raise TempyNativeCompileError(error.args)
+    linemap.register(filename, counter.line_table)
+    return (code, counter.line_table)
 
 def compile_string(path, filename="<string>"):
     '''
     compile tempy string into compiled python bytecode(.pyc file)
     '''
+    from translate import translate_string
     stmts = translate_string(path, filename=filename)
-    return _compile_kont(stmts, filename)
+    return _compile_kont(stmts, filename)[0]
 
-def compile_file(path, filename=None):
+def compile_file(path, filename=None, translation_cache=None):
     '''
     compile tempy file into compiled python bytecode(.pyc file)
     '''
+    from translate import translate_file
     if filename is None:
         filename = path
-    stmts = translate_file(path, filename=filename)
-    return _compile_kont(stmts, filename)
+    stmts = translate_file(path, filename=filename, translation_cache=translation_cache)
+    return _compile_kont(stmts, filename)[0]
@@ -0,0 +1,114 @@
+'''
+Mapping of generated python lines back to locations in .tpy files.
+
+A line table is built when a template is compiled(see AstLineCounter) and
+stored in the .tpyc file next to the code object. Nothing is executed for
+it while a template renders; locations are only looked up when a traceback
+is formatted by this module. It is opt-in: tracebacks which python prints
+by itself still show generated lines, unless excepthook is installed as
+sys.excepthook.
+
+e.g)
+    try:
+        env.module("index").MainTemplate
+    except Exception:
+        print linemap.format_exc()
+'''
+import sys
+import linecache
+import traceback
+from bisect import bisect_right
+
+
+class LineTable:
+    def __init__(self, entries):
+        '''
+        Arguments -
+            entries: (generated line, sline, eline, scol, ecol) list sorted by
+                     generated line
+        '''
+        self.entries = entries
+        self.lines = [entry[0] for entry in entries]
+
+    def lookup(self, lineno):
+        '''
+        Returns -
+            None | (sline, eline, scol, ecol) of the statement which covers lineno
+        '''
+        idx = bisect_right(self.lines, lineno) - 1
+        if idx < 0:
+            return None
+        return self.entries[idx][1:]
+
+
+_tables = {} # filename of code object -> LineTable
+
+def register(filename, entries):
+    _tables[filename] = LineTable(entries)
+
+def unregister(filename):
+    _tables.pop(filename, None)
+
+def lookup(filename, lineno):
+    '''
+    Returns -
+        None | (sline, eline, scol, ecol)
+    '''
+    table = _tables.get(filename)
+    if table is None:
+        return None
+    return table.lookup(lineno)
+
+
+def extract_tb(tb, limit=None):
+    '''
+    The same as traceback.extract_tb except that frames of compiled templates
+    point to their lines in .tpy files.
+    '''
+    if limit is None:
+        limit = getattr(sys, "tracebacklimit", None)
+    result = []
+    n = 0
+    while tb is not None and (limit is None or n < limit):
+        code = tb.tb_frame.f_code
+        filename = code.co_filename
+        lineno = tb.tb_lineno
+        location = lookup(filename, lineno)
+        if location is not None:
+            lineno = location[0]
+        linecache.checkcache(filename)
+        line = linecache.getline(filename, lineno, tb.tb_frame.f_globals)
+        result.append((filename, lineno, code.co_name, line.strip() or None))
+        tb = tb.tb_next
+        n += 1
+    return result
+
+
+def format_exception(etype, value, tb, limit=None):
+    result = []
+    if tb is not None:
+        result.append("Traceback (most recent call last):\n")
+        result.extend(traceback.format_list(extract_tb(tb, limit)))
+    result.extend(traceback.format_exception_only(etype, value))
+    return result
+
+
+def format_exc(limit=None):
+    etype, value, tb = sys.exc_info()
+    try:
+        return "".join(format_exception(etype, value, tb, limit))
+    finally:
+        etype = value = tb = None
+
+
+def print_exception(etype, value, tb, limit=None, file=None):
+    if file is None:
+        file = sys.stderr
+    file.write("".join(format_exception(etype, value, tb, limit)))
+
+
+def excepthook(etype, value, tb):
+    '''
+    Can be installed as sys.excepthook
+    '''
+    print_exception(etype, value, tb)
@@ -0,0 +1,922 @@
+'''
+Optimization passes over PyStmt IR.
+
+Passes run in main_translate after a module is translated and before meta ids
+are converted into names, so that every variable is identified by its id
+however it is shadowed. See Config.optimization_level and Config.passes
+
+A pass is a function of (stmts, comp_env) which changes stmts in place.
+IRVisitor and IRTransformer walk the IR for passes which look at or rewrite
+particular kinds of nodes.
+
+e.g)
+    class UpperLiterals(IRTransformer):
+        def visit_PyLiteral(self, expr):
+            if isinstance(expr.literal, basestring):
+                return PyLiteral(expr.literal.upper())
+            return expr
+
+    config = Config()
+    config.register_pass(OptimizationPass("upper_literals",
+                                          lambda stmts, comp_env: UpperLiterals().visit_stmts(stmts)))
+'''
+import sys
+import time
+import __builtin__
+
+from translate import PyDefun, PyAssignment, PyAssignmentToName, PyExprStmt, \
+                      PyIfStmt, PyWhileStmt, PyForStmt, \
+                      PyReturn, PyRaise, PyBreak, PyContinue, PyMetaComment, \
+                      PyImportStmt, PyImportFromStmt, \
+                      PyLiteral, PyMetaID, PyTupleExpr, PyListExpr, PyBinop, PyLambda, PyIfElseExpr, \
+                      PyCall, PyAttrAccess, PyItemAccess, PyArraySlice, PyListComprehension, \
+                      IDHint, Var, HTML_TAGPOOL_NAME, is_python_reserved_word
+
+# statements after which the rest of a stmt list is never executed
+_JUMP_STMTS = (PyReturn, PyRaise, PyBreak, PyContinue)
+
+
+class IRVisitor:
+    '''
+    Walks PyStmt IR. visit_<class name>(node) is called for each node if
+    it is defined, generic_visit_stmt or generic_visit_expr otherwise.
+    Generic ones visit sub expressions and sub statements in order.
+    '''
+    def visit_stmts(self, stmt_list):
+        for stmt in stmt_list:
+            self.visit_stmt(stmt)
+
+    def visit_stmt(self, stmt):
+        visitor = getattr(self, "visit_" + stmt.__class__.__name__, None)
+        if visitor is None:
+            return self.generic_visit_stmt(stmt)
+        return visitor(stmt)
+
+    def visit_expr(self, expr):
+        visitor = getattr(self, "visit_" + expr.__class__.__name__, None)
+        if visitor is None:
+            return self.generic_visit_expr(expr)
+        return visitor(expr)
+
+    def generic_visit_stmt(self, stmt):
+        for expr in stmt.sub_exprs():
+            self.visit_expr(expr)
+        for stmt_list in stmt.sub_stmt_lists():
+            self.visit_stmts(stmt_list)
+
+    def generic_visit_expr(self, expr):
+        for sub_expr in expr.sub_exprs():
+            self.visit_expr(sub_expr)
+
+
+class IRTransformer(IRVisitor):
+    '''
+    IRVisitor which rewrites the IR.
+
+    A visitor of a statement returns None to remove it, a statement or
+    a statement list to replace it. Stmt lists are changed in place.
+    A visitor of an expression returns the expression to replace it.
+    '''
+    def visit_stmts(self, stmt_list):
+        result = []
+        for stmt in stmt_list:
+            new_stmt = self.visit_stmt(stmt)
+            if new_stmt is None:
+                continue
+            elif isinstance(new_stmt, list):
+                result.extend(new_stmt)
+            else:
+                result.append(new_stmt)
+        stmt_list[:] = result
+
+    def generic_visit_stmt(self, stmt):
+        stmt.map_sub_exprs(self.visit_expr)
+        for stmt_list in stmt.sub_stmt_lists():
+            self.visit_stmts(stmt_list)
+        return stmt
+
+    def generic_visit_expr(self, expr):
+        return expr.map_sub_exprs(self.visit_expr)
+
+
+def count_nodes(stmts):
+    '''
+    Returns -
+        number of statements and expressions in stmts
+    '''
+    count = 0
+    stmt_stack = list(stmts)
+    expr_stack = []
+    while stmt_stack:
+        stmt = stmt_stack.pop()
+        count += 1
+        expr_stack.extend(stmt.sub_exprs())
+        for stmt_list in stmt.sub_stmt_lists():
+            stmt_stack.extend(stmt_list)
+    while expr_stack:
+        expr = expr_stack.pop()
+        count += 1
+        expr_stack.extend(expr.sub_exprs())
+    return count
+
+
+def add_reads(stmts, counts, delta=1):
+    '''
+    Add delta to counts[id] for each occurrence of a meta id read in stmts
+    '''
+    stmt_stack = list(stmts)
+    expr_stack = []
+    while stmt_stack:
+        stmt = stmt_stack.pop()
+        expr_stack.extend(stmt.sub_exprs())
+        for stmt_list in stmt.sub_stmt_lists():
+            stmt_stack.extend(stmt_list)
+    while expr_stack:
+        expr = expr_stack.pop()
+        if isinstance(expr, PyMetaID):
+            counts[expr._id] = counts.get(expr._id, 0) + delta
+        else:
+            expr_stack.extend(expr.sub_exprs())
+
+
+def _add_expr_reads(exprs, counts, delta):
+    add_reads([PyExprStmt(expr) for expr in exprs], counts, delta)
+
+
+def _is_unread(name, counts):
+    return isinstance(name, PyMetaID) and counts.get(name._id, 0) == 0
+
+
+def _literal_truth(expr):
+    '''
+    Returns -
+        None | bool, truth value of expr if it is known at compile time
+    '''
+    if isinstance(expr, PyLiteral):
+        return bool(expr.literal)
+    return None
+
+
+def _inherit_srcloc(stmt, origin):
+    stmt.srcloc = origin.srcloc
+    return stmt
+
+
+def _simplify_if(stmt, counts):
+    '''
+    Drop clauses whose conditions are known to be false and the clauses
+    after a condition known to be true.
+    '''
+    pairs = []
+    else_stmt_list = stmt.else_stmt_list
+    changed = False
+    clauses = [stmt.if_pair] + stmt.elif_pairs
+    for idx, (cond_expr, stmt_list) in enumerate(clauses):
+        truth = _literal_truth(cond_expr)
+        if truth is None:
+            pairs.append((cond_expr, stmt_list))
+            continue
+        changed = True
+        if truth:
+            for _, dead_stmt_list in clauses[idx + 1:]:
+                add_reads(dead_stmt_list, counts, -1)
+            _add_expr_reads([expr for expr, _ in clauses[idx + 1:]], counts, -1)
+            add_reads(else_stmt_list, counts, -1)
+            else_stmt_list = stmt_list
+            break
+        else:
+            add_reads(stmt_list, counts, -1)
+
+    if not pairs:
+        return else_stmt_list
+    if not else_stmt_list and \
+       not any(stmt_list for _, stmt_list in pairs) and \
+       not any(cond_expr.may_have_side_effect() for cond_expr, _ in pairs):
+        _add_expr_reads([cond_expr for cond_expr, _ in pairs], counts, -1)
+        return []
+    if not changed:
+        return None
+    return [_inherit_srcloc(PyIfStmt(pairs[0], pairs[1:], else_stmt_list), stmt)]
+
+
+def _simplify(stmt, counts):
+    '''
+    Returns -
+        None if stmt is kept as it is, or stmt list to replace it with
+    '''
+    if isinstance(stmt, PyAssignment):
+        if stmt._type != PyAssignment.ASSIGN_NAME or \
+           not _is_unread(stmt.name, counts):
+            return None
+        if stmt.expr.may_have_side_effect():
+            return [_inherit_srcloc(PyExprStmt(stmt.expr), stmt)]
+        add_reads([stmt], counts, -1)
+        return []
+    elif isinstance(stmt, PyExprStmt):
+        if stmt.expr.may_have_side_effect():
+            return None
+        add_reads([stmt], counts, -1)
+        return []
+    elif isinstance(stmt, PyDefun):
+        if not _is_unread(stmt.fun_name, counts) or \
+           any(kexpr.may_have_side_effect() for _, kexpr in stmt.kwd_args):
+            return None
+        add_reads([stmt], counts, -1)
+        return []
+    elif isinstance(stmt, PyImportStmt):
+        if stmt.may_have_side_effect() or not _is_unread(stmt.alias, counts):
+            return None
+        return []
+    elif isinstance(stmt, PyImportFromStmt):
+        if stmt.may_have_side_effect():
+            return None
+        import_names = [item for item in stmt.import_names
+                        if not isinstance(item, tuple) or
+                           not _is_unread(item[1], counts)]
+        if len(import_names) == len(stmt.import_names):
+            return None
+        elif not import_names:
+            return []
+        stmt.import_names = import_names
+        return [stmt]
+    elif isinstance(stmt, PyIfStmt):
+        return _simplify_if(stmt, counts)
+    elif isinstance(stmt, PyWhileStmt):
+        if _literal_truth(stmt.cond_expr) is False:
+            add_reads([stmt], counts, -1)
+            return []
+        return None
+    else:
+        return None
+
+
+def _sweep_stmt_list(stmt_list, counts):
+    '''
+    Returns -
+        bool, whether stmt_list is changed
+    '''
+    changed = False
+    for idx, stmt in enumerate(stmt_list):
+        if isinstance(stmt, _JUMP_STMTS) and idx + 1 < len(stmt_list):
+            add_reads(stmt_list[idx + 1:], counts, -1)
+            del stmt_list[idx + 1:]
+            changed = True
+            break
+
+    # Backward, so that reads in later statements are removed before
+    # the assignments which they read are visited.
+    reversed_result = []
+    for stmt in reversed(stmt_list):
+        for sub_stmt_list in stmt.sub_stmt_lists():
+            if _sweep_stmt_list(sub_stmt_list, counts):
+                changed = True
+        replacement = _simplify(stmt, counts)
+        if replacement is None:
+            reversed_result.append(stmt)
+        else:
+            changed = True
+            reversed_result.extend(reversed(replacement))
+    reversed_result.reverse()
+    stmt_list[:] = reversed_result
+    return changed
+
+
+def eliminate_dead_code(stmts, comp_env):
+    '''
+    Remove assignments, definitions and pure imports of variables which are
+    never read, statements without side effect, and statements which are
+    never reached.
+
+    Reads are counted over the whole module regardless of control flow.
+    Removing a statement releases reads in it, which can make other
+    assignments dead, so stmts are swept until nothing changes.
+    '''
+    counts = {} # id -> count of reads
+    add_reads(stmts, counts)
+    while _sweep_stmt_list(stmts, counts):
+        pass
+
+
+def add_assignments(stmts, counts):
+    '''
+    Add 1 to counts[id] for each statement which assigns to a meta id
+    as a variable or a target of for statement
+    '''
+    stmt_stack = list(stmts)
+    while stmt_stack:
+        stmt = stmt_stack.pop()
+        targets = []
+        if isinstance(stmt, PyAssignment) and \
+           stmt._type == PyAssignment.ASSIGN_NAME:
+            targets.append(stmt.name)
+        elif isinstance(stmt, PyForStmt):
+            if isinstance(stmt.elem_name, PyTupleExpr):
+                targets.extend(stmt.elem_name.exprs)
+            else:
+                targets.append(stmt.elem_name)
+        for target in targets:
+            if isinstance(target, PyMetaID):
+                counts[target._id] = counts.get(target._id, 0) + 1
+        for stmt_list in stmt.sub_stmt_lists():
+            stmt_stack.extend(stmt_list)
+
+
+def _has_own_effect(expr):
+    '''
+    Whether evaluating expr may have a side effect apart from those of
+    its subexpressions
+    '''
+    if isinstance(expr, (PyCall, PyItemAccess, PyArraySlice)):
+        return True
+    elif isinstance(expr, PyAttrAccess):
+        return not expr.pure
+    elif isinstance(expr, (PyMetaID, PyLiteral, PyTupleExpr, PyBinop, PyLambda, PyIfElseExpr)):
+        return False
+    else:
+        return expr.may_have_side_effect()
+
+
+def _scan_leading_reads(expr, acc):
+    '''
+    Append ids read in expr to acc in order of evaluation, as long as they
+    are evaluated unconditionally and before any side effect.
+
+    Returns -
+        bool, whether expr is scanned to the end
+    '''
+    if isinstance(expr, PyMetaID):
+        acc.append(expr._id)
+        return True
+    elif isinstance(expr, PyLambda):
+        # the body is not evaluated here
+        return all(_scan_leading_reads(kexpr, acc) for _, kexpr in expr.kwd_args)
+    elif isinstance(expr, (PyIfElseExpr, PyListComprehension)) or \
+         (isinstance(expr, PyBinop) and expr.op in ("and", "or")):
+        # the rest is evaluated conditionally
+        _scan_leading_reads(expr.sub_exprs()[0], acc)
+        return False
+    for sub_expr in expr.sub_exprs():
+        if not _scan_leading_reads(sub_expr, acc):
+            return False
+    return not _has_own_effect(expr)
+
+
+def _head_exprs(stmt):
+    '''
+    Returns -
+        expressions which stmt evaluates exactly once before its body,
+        in order of evaluation
+    '''
+    if isinstance(stmt, PyAssignment):
+        # the right hand side comes first
+        sub_exprs = stmt.sub_exprs()
+        return [sub_exprs[-1]] + sub_exprs[:-1]
+    elif isinstance(stmt, (PyExprStmt, PyReturn, PyRaise, PyForStmt, PyDefun)):
+        return stmt.sub_exprs()
+    elif isinstance(stmt, PyIfStmt):
+        return [stmt.if_pair[0]]
+    else:
+        return []
+
+
+def _substitute_head(stmt, mapping):
+    if isinstance(stmt, PyAssignment):
+        stmt.expr = stmt.expr.substitute(mapping)
+        if stmt.scope_expr is not None:
+            stmt.scope_expr = stmt.scope_expr.substitute(mapping)
+        if stmt.item_expr is not None:
+            stmt.item_expr = stmt.item_expr.substitute(mapping)
+    elif isinstance(stmt, PyExprStmt):
+        stmt.expr = stmt.expr.substitute(mapping)
+    elif isinstance(stmt, PyReturn):
+        if stmt.ret_expr is not None:
+            stmt.ret_expr = stmt.ret_expr.substitute(mapping)
+    elif isinstance(stmt, PyRaise):
+        if stmt.to_be_throwed is not None:
+            stmt.to_be_throwed = stmt.to_be_throwed.substitute(mapping)
+    elif isinstance(stmt, PyForStmt):
+        stmt._in = stmt._in.substitute(mapping)
+    elif isinstance(stmt, PyDefun):
+        stmt.kwd_args = [(keyword, kexpr.substitute(mapping))
+                         for keyword, kexpr in stmt.kwd_args]
+    elif isinstance(stmt, PyIfStmt):
+        stmt.if_pair = (stmt.if_pair[0].substitute(mapping), stmt.if_pair[1])
+    else:
+        raise ValueError("%s has no expression to substitute"%stmt.__class__.__name__)
+
+
+class CopyPropagator:
+    '''
+    Inline immediates which are assigned and read once back into the
+    expression that reads them.
+
+    The translator lifts subexpressions into immediates in order of
+    evaluation, so that a statement reads the immediates assigned by
+    the statements right before it, in the same order. Those assignments are
+    inlined as long as doing so evaluates nothing out of order.
+
+    A value which may have side effects is inlined only if the statements
+    are located at the same line of tpy source, because python reports one
+    line for a statement.
+    '''
+    def __init__(self, hint_dict, stmts):
+        self.hint_dict = hint_dict
+        self.read_counts = {}
+        self.assign_counts = {}
+        add_reads(stmts, self.read_counts)
+        add_assignments(stmts, self.assign_counts)
+
+    def is_temporary(self, name):
+        if not isinstance(name, PyMetaID):
+            return False
+        _id = name._id
+        hint = self.hint_dict.get(_id)
+        return isinstance(hint, IDHint) and \
+               hint.name_source == "immediate" and \
+               self.read_counts.get(_id, 0) == 1 and \
+               self.assign_counts.get(_id, 0) == 1
+
+    def can_move(self, stmt, dest_stmt, expr):
+        if not expr.may_have_side_effect() or stmt.srcloc is None:
+            return True
+        dest_srcloc = dest_stmt.srcloc
+        return dest_srcloc is not None and \
+               dest_srcloc["sline"] == stmt.srcloc["sline"]
+
+    def fold_if(self, stmt):
+        '''
+        Returns -
+            None | assignment of conditional expression which is equivalent
+            to stmt, if stmt assigns a value to the same immediate in every branch
+        '''
+        if not stmt.else_stmt_list:
+            return None
+        clauses = [stmt.if_pair] + stmt.elif_pairs + [(None, stmt.else_stmt_list)]
+        target_id = None
+        values = []
+        for cond_expr, stmt_list in clauses:
+            if len(stmt_list) != 1:
+                return None
+            branch_stmt = stmt_list[0]
+            if not isinstance(branch_stmt, PyAssignment) or \
+               branch_stmt._type != PyAssignment.ASSIGN_NAME or \
+               not isinstance(branch_stmt.name, PyMetaID) or \
+               not self.can_move(branch_stmt, stmt, branch_stmt.expr):
+                return None
+            if target_id is None:
+                target_id = branch_stmt.name._id
+            elif target_id != branch_stmt.name._id:
+                return None
+            values.append(branch_stmt.expr)
+        hint = self.hint_dict.get(target_id)
+        if not isinstance(hint, IDHint) or hint.name_source != "immediate" or \
+           self.assign_counts.get(target_id, 0) != len(clauses):
+            return None
+
+        expr = values[-1]
+        for (cond_expr, _), value in reversed(zip(clauses[:-1], values[:-1])):
+            expr = PyIfElseExpr(cond_expr, value, expr)
+        self.assign_counts[target_id] = 1
+        return _inherit_srcloc(PyAssignmentToName(PyMetaID(target_id), expr), stmt)
+
+    def inline_into(self, stmt_list, idx):
+        '''
+        Inline assignments right before stmt_list[idx] into it
+
+        Returns -
+            index of stmt_list[idx] after the assignments are removed
+        '''
+        stmt = stmt_list[idx]
+        reads = []
+        for expr in _head_exprs(stmt):
+            if not _scan_leading_reads(expr, reads):
+                break
+
+        mapping = {}
+        removed = []
+        pos = len(reads)
+        prev_idx = idx - 1
+        while prev_idx >= 0 and pos > 0:
+            prev_stmt = stmt_list[prev_idx]
+            if isinstance(prev_stmt, PyMetaComment):
+                prev_idx -= 1
+                continue
+            if not isinstance(prev_stmt, PyAssignment) or \
+               prev_stmt._type != PyAssignment.ASSIGN_NAME or \
+               not self.is_temporary(prev_stmt.name) or \
+               not self.can_move(prev_stmt, stmt, prev_stmt.expr):
+                break
+            # immediates must be read in the order they are assigned
+            _id = prev_stmt.name._id
+            read_pos = pos - 1
+            while read_pos >= 0 and reads[read_pos] != _id:
+                read_pos -= 1
+            if read_pos < 0:
+                break
+            pos = read_pos
+            mapping[_id] = prev_stmt.expr
+            removed.append(prev_idx)
+            prev_idx -= 1
+
+        if not mapping:
+            return idx
+        _substitute_head(stmt, mapping)
+        for _id in mapping:
+            self.read_counts[_id] = 0
+            self.assign_counts[_id] = 0
+        for prev_idx in removed:
+            del stmt_list[prev_idx]
+        return idx - len(removed)
+
+    def propagate(self, stmt_list):
+        idx = 0
+        while idx < len(stmt_list):
+            stmt = stmt_list[idx]
+            for sub_stmt_list in stmt.sub_stmt_lists():
+                self.propagate(sub_stmt_list)
+            if isinstance(stmt, PyIfStmt):
+                folded = self.fold_if(stmt)
+                if folded is not None:
+                    stmt_list[idx] = folded
+            idx = self.inline_into(stmt_list, idx) + 1
+
+
+def propagate_copies(stmts, comp_env):
+    CopyPropagator(comp_env.get_hint_dict(), stmts).propagate(stmts)
+
+
+class LoopLowering(CopyPropagator):
+    '''
+    Lower loops which collect elements into a list into list comprehensions.
+
+        R = []
+        for T in IT:
+            t1 = E1
+            ...
+            (R.extend)([t1, ..., tn])  # or (R.append)(e)
+
+    becomes
+
+        R = [x for T in IT for x in (E1, ..., En)]
+
+    Immediates assigned in the body are inlined into the elements in the
+    same way as CopyPropagator does, except that each element keeps the
+    location of the statement it came from on a line of its own.
+    '''
+    def __init__(self, comp_env, stmts):
+        CopyPropagator.__init__(self, comp_env.get_hint_dict(), stmts)
+        self.comp_env = comp_env
+
+    def collected_elements(self, collector_stmt):
+        '''
+        Returns -
+            None | (id of list, element exprs) if collector_stmt is
+            (R.extend)([...]) or (R.append)(e)
+        '''
+        if not isinstance(collector_stmt, PyExprStmt):
+            return None
+        call = collector_stmt.expr
+        if not isinstance(call, PyCall) or \
+           call.kw_exprs or call.star_expr or call.dstar_expr or \
+           len(call.arg_exprs) != 1 or \
+           not isinstance(call.callee_expr, PyAttrAccess) or \
+           not isinstance(call.callee_expr.scope_expr, PyMetaID):
+            return None
+        list_id = call.callee_expr.scope_expr._id
+        if call.callee_expr.attr_name == "append":
+            return (list_id, call.arg_exprs)
+        elif call.callee_expr.attr_name == "extend" and \
+             isinstance(call.arg_exprs[0], PyListExpr) and \
+             call.arg_exprs[0].exprs:
+            return (list_id, call.arg_exprs[0].exprs)
+        else:
+            return None
+
+    def lower(self, stmt_list, idx):
+        '''
+        Returns -
+            index of the comprehension if stmt_list[idx] is lowered, or None
+        '''
+        for_stmt = stmt_list[idx]
+        if not for_stmt.stmt_list:
+            return None
+        collected = self.collected_elements(for_stmt.stmt_list[-1])
+        if collected is None:
+            return None
+        list_id, elt_exprs = collected
+        collector_stmt = for_stmt.stmt_list[-1]
+        hint = self.hint_dict.get(list_id)
+        if not isinstance(hint, IDHint) or hint.name_source != "immediate" or \
+           self.read_counts.get(list_id, 0) != 2 or \
+           self.assign_counts.get(list_id, 0) != 1:
+            return None
+
+        init_idx = idx - 1
+        while init_idx >= 0:
+            init_stmt = stmt_list[init_idx]
+            if isinstance(init_stmt, PyAssignment) and \
+               init_stmt._type == PyAssignment.ASSIGN_NAME and \
+               isinstance(init_stmt.name, PyMetaID) and \
+               init_stmt.name._id == list_id:
+                break
+            init_idx -= 1
+        if init_idx < 0 or \
+           not isinstance(init_stmt.expr, PyLiteral) or \
+           init_stmt.expr.literal != []:
+            return None
+
+        # every other statement of the body assigns an immediate read by elements
+        reads = []
+        for expr in elt_exprs:
+            if not _scan_leading_reads(expr, reads):
+                break
+        assignments = {}
+        pos = len(reads)
+        for stmt in reversed(for_stmt.stmt_list[:-1]):
+            if not isinstance(stmt, PyAssignment) or \
+               stmt._type != PyAssignment.ASSIGN_NAME or \
+               not self.is_temporary(stmt.name):
+                return None
+            _id = stmt.name._id
+            read_pos = pos - 1
+            while read_pos >= 0 and reads[read_pos] != _id:
+                read_pos -= 1
+            if read_pos < 0:
+                return None
+            pos = read_pos
+            assignments[_id] = stmt
+
+        new_elt_exprs = []
+        elt_srclocs = []
+        for expr in elt_exprs:
+            if isinstance(expr, PyMetaID) and expr._id in assignments:
+                stmt = assignments[expr._id]
+                new_elt_exprs.append(stmt.expr)
+                elt_srclocs.append(stmt.srcloc)
+                continue
+            mapping = {}
+            for _id in set(add_reads_of(expr)) & set(assignments):
+                stmt = assignments[_id]
+                if not self.can_move(stmt, collector_stmt, stmt.expr):
+                    return None
+                mapping[_id] = stmt.expr
+            new_elt_exprs.append(expr.substitute(mapping) if mapping else expr)
+            elt_srclocs.append(collector_stmt.srcloc)
+
+        item_name = None
+        if PyListComprehension.needs_item_name(new_elt_exprs, elt_srclocs):
+            item_name = PyMetaID(self.comp_env.issue_local_immediate())
+        comprehension = PyListComprehension(for_stmt.elem_name,
+                                            for_stmt._in,
+                                            new_elt_exprs,
+                                            item_name,
+                                            elt_srclocs)
+        for _id in assignments:
+            self.read_counts[_id] = 0
+            self.assign_counts[_id] = 0
+        self.read_counts[list_id] -= 1
+        stmt_list[idx] = _inherit_srcloc(PyAssignmentToName(PyMetaID(list_id), comprehension),
+                                         for_stmt)
+        del stmt_list[init_idx]
+        return idx - 1
+
+    def lower_loops(self, stmt_list):
+        idx = 0
+        while idx < len(stmt_list):
+            stmt = stmt_list[idx]
+            for sub_stmt_list in stmt.sub_stmt_lists():
+                self.lower_loops(sub_stmt_list)
+            if isinstance(stmt, PyForStmt):
+                lowered_idx = self.lower(stmt_list, idx)
+                if lowered_idx is not None:
+                    idx = lowered_idx
+            idx += 1
+
+
+def add_reads_of(expr):
+    '''
+    Returns -
+        ids read in expr
+    '''
+    counts = {}
+    _add_expr_reads([expr], counts, 1)
+    return counts.keys()
+
+
+def lower_loops(stmts, comp_env):
+    LoopLowering(comp_env, stmts).lower_loops(stmts)
+
+
+class _FunctionBodySubstituter(IRTransformer):
+    '''
+    Substitute every expression except ones in bodies of nested functions,
+    which are evaluated in scopes of their own
+    '''
+    def __init__(self, mapping):
+        self.mapping = mapping
+
+    def visit_expr(self, expr):
+        return expr.substitute(self.mapping)
+
+    def visit_PyDefun(self, stmt):
+        stmt.map_sub_exprs(self.visit_expr)
+        return stmt
+
+
+class GlobalHoister:
+    '''
+    Bind builtins and html tag constructors which a function uses
+    repeatedly to locals at the beginning of the function.
+
+        def F(xs):
+            return [(__html__.td)({}, str(x)) for x in xs]
+
+    becomes
+
+        def F(xs):
+            __str = str
+            __td = __html__.td
+            return [__td({}, __str(x)) for x in xs]
+
+    so that they are looked up with LOAD_FAST instead of LOAD_GLOBAL or
+    LOAD_DEREF followed by an attribute lookup. A use in a loop counts
+    as many uses.
+    '''
+    def __init__(self, comp_env):
+        self.comp_env = comp_env
+        self.tagpool_id, _ = comp_env.lookup_global_name(HTML_TAGPOOL_NAME)
+        self.builtin_ids = {}
+        for _id, hint in comp_env.get_hint_dict().items():
+            if isinstance(hint, basestring) and \
+               hasattr(__builtin__, hint) and \
+               not is_python_reserved_word(hint):
+                self.builtin_ids[_id] = hint
+
+    def hoisting_key(self, expr):
+        '''
+        Returns -
+            None | id of a builtin | (id of tag pool, tag name)
+        '''
+        if isinstance(expr, PyMetaID) and expr._id in self.builtin_ids:
+            return expr._id
+        elif isinstance(expr, PyAttrAccess) and \
+             isinstance(expr.scope_expr, PyMetaID) and \
+             expr.scope_expr._id == self.tagpool_id:
+            return (self.tagpool_id, expr.attr_name)
+        else:
+            return None
+
+    def count_expr(self, expr, counts, weight):
+        key = self.hoisting_key(expr)
+        if key is not None:
+            counts[key] = counts.get(key, 0) + weight
+        elif isinstance(expr, PyListComprehension):
+            self.count_expr(expr.iter_expr, counts, weight)
+            for elt_expr in expr.elt_exprs:
+                self.count_expr(elt_expr, counts, weight * 2)
+        elif isinstance(expr, PyLambda):
+            for _, kexpr in expr.kwd_args:
+                self.count_expr(kexpr, counts, weight)
+            self.count_expr(expr.expr, counts, weight * 2)
+        else:
+            for sub_expr in expr.sub_exprs():
+                self.count_expr(sub_expr, counts, weight)
+
+    def count_stmts(self, stmt_list, counts, weight):
+        for stmt in stmt_list:
+            head_weight = body_weight = weight
+            if isinstance(stmt, PyWhileStmt):
+                # the condition is evaluated for each iteration
+                head_weight = body_weight = weight * 2
+            elif isinstance(stmt, PyForStmt):
+                body_weight = weight * 2
+            for expr in stmt.sub_exprs():
+                self.count_expr(expr, counts, head_weight)
+            if not isinstance(stmt, PyDefun):
+                for sub_stmt_list in stmt.sub_stmt_lists():
+                    self.count_stmts(sub_stmt_list, counts, body_weight)
+
+    def hoist(self, defun):
+        counts = {}
+        self.count_stmts(defun.stmt_list, counts, 1)
+        keys = sorted((key for key, count in counts.items() if count >= 2),
+                      key=self.key_name)
+        if not keys:
+            return
+        mapping = {}
+        prologue = []
+        for key in keys:
+            if isinstance(key, tuple):
+                expr = PyAttrAccess(PyMetaID(self.tagpool_id), key[1], pure=True)
+            else:
+                expr = PyMetaID(key)
+            local_id = self.comp_env.issue_id(Var(IDHint("__" + self.key_name(key),
+                                                         "local",
+                                                         "local")))
+            mapping[key] = PyMetaID(local_id)
+            prologue.append(PyAssignmentToName(PyMetaID(local_id), expr))
+        _FunctionBodySubstituter(mapping).visit_stmts(defun.stmt_list)
+        defun.stmt_list[:0] = prologue
+
+    def key_name(self, key):
+        if isinstance(key, tuple):
+            return key[1]
+        return self.builtin_ids[key]
+
+    def hoist_all(self, stmt_list):
+        for stmt in stmt_list:
+            for sub_stmt_list in stmt.sub_stmt_lists():
+                self.hoist_all(sub_stmt_list)
+            if isinstance(stmt, PyDefun):
+                self.hoist(stmt)
+
+
+def hoist_globals(stmts, comp_env):
+    GlobalHoister(comp_env).hoist_all(stmts)
+
+
+class OptimizationPass:
+    def __init__(self, name, run, level=1, version=1):
+        '''
+        Arguments -
+            run: function of (stmts, comp_env) which changes stmts in place
+            level: the pass runs if Config.optimization_level >= level
+            version: should be changed whenever run changes what it does, since
+                     TranslationCache tells passes apart by identity()
+        '''
+        self.name = name
+        self.run = run
+        self.level = level
+        self.version = version
+
+    def identity(self):
+        return (self.name, self.version, self.level)
+
+    def __repr__(self):
+        return "<OptimizationPass %s version=%r level=%d>"%(self.name,
+                                                            self.version,
+                                                            self.level)
+
+
+class PassReport:
+    def __init__(self, name, seconds, nodes_before, nodes_after):
+        self.name = name
+        self.seconds = seconds
+        self.nodes_before = nodes_before
+        self.nodes_after = nodes_after
+
+    def __str__(self):
+        return "%-20s %8.3fms %6d -> %6d nodes (%+d)"%(self.name,
+                                                      self.seconds * 1000,
+                                                      self.nodes_before,
+                                                      self.nodes_after,
+                                                      self.nodes_after - self.nodes_before)
+
+
+DEFAULT_PASSES = [
+    OptimizationPass("dead_code", eliminate_dead_code),
+    OptimizationPass("copy_propagation", propagate_copies),
+    OptimizationPass("loop_lowering", lower_loops),
+    OptimizationPass("global_hoisting", hoist_globals),
+]
+
+
+class PassManager:
+    '''
+    Runs passes in order, measuring the time each takes and the number of
+    nodes before and after it.
+    '''
+    def __init__(self, passes, optimization_level):
+        self.passes = [opt_pass for opt_pass in passes
+                       if optimization_level >= opt_pass.level]
+
+    def run(self, stmts, comp_env):
+        '''
+        Returns -
+            PassReport list
+        '''
+        reports = []
+        nodes = count_nodes(stmts)
+        for opt_pass in self.passes:
+            start = time.time()
+            opt_pass.run(stmts, comp_env)
+            seconds = time.time() - start
+            nodes_after = count_nodes(stmts)
+            reports.append(PassReport(opt_pass.name, seconds, nodes, nodes_after))
+            nodes = nodes_after
+        return reports
+
+
+def optimize_stmts(stmts, config, comp_env):
+    '''
+    Optimize stmts, PyStmt list whose meta ids are not converted yet, in place
+
+    Returns -
+        PassReport list
+    '''
+    passes = config.passes if config.passes is not None else DEFAULT_PASSES
+    reports = PassManager(passes, config.optimization_level).run(stmts, comp_env)
+    if config.pass_report_file is not None:
+        for report in reports:
+            print >>config.pass_report_file, report
+    return reports
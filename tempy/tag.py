@@ -1,3 +1,5 @@
+import hashlib
+from functools import partial
 from collections import Iterable
 
 HTML_TAGS = ['html',
@@ -237,7 +239,8 @@ class Tag:
         push("<"); push(tag_name)
 
         if self.attr_dict:
-            for (k, v) in self.attr_dict.items():
+            # sorted so that identical content always yields identical output
+            for (k, v) in sorted(self.attr_dict.items()):
                 if isinstance(v, bool):
                     value_str = "true" if v else "false"
                 else:
@@ -247,14 +250,7 @@ class Tag:
         if sub_tags_len > 0:
             push(">")
             for tag_node in self.sub_tags:
-                if tag_node is None:
-                    pass
-                elif isinstance(tag_node, basestring):
-                    push(_escape_string(tag_node))
-                elif isinstance(tag_node, Tag):
-                    tag_node._emit_html(push)
-                else:
-                    push(tag_node.emit_html())
+                _emit_node(tag_node, push)
             push("</"); push(tag_name); push(">")
         elif self.void_tag:
             push(" />")
@@ -266,14 +262,106 @@ class Tag:
         self._emit_html(acc_str_list.append)
         return "".join(acc_str_list)
 
+
+def _emit_node(node, push):
+    if node is None:
+        pass
+    elif isinstance(node, basestring):
+        push(_escape_string(node))
+    elif isinstance(node, Tag):
+        node._emit_html(push)
+    else:
+        push(node.emit_html())
+
+
+DEFAULT_EMIT_CHUNK_SIZE = 8192
+
+class EmitResult:
+    '''
+    HTML emitted as a list of byte chunks, together with the digest of
+    the whole content. Iterating it yields the chunks.
+    '''
+    def __init__(self, chunks, digest, length):
+        self.chunks = chunks
+        self.digest = digest # hex digest
+        self.length = length
+
+    def __repr__(self):
+        return "<EmitResult %s (%d bytes)>"%(self.digest, self.length)
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def __str__(self):
+        return "".join(self.chunks)
+
+    @property
+    def etag(self):
+        return "\"" + self.digest + "\""
+
+
+class _DigestEmitter:
+    '''
+    Accumulates pushed strings into chunks of about chunk_size bytes and
+    updates the digest chunk by chunk, so that the digest is ready as
+    soon as emission is over.
+    '''
+    def __init__(self, hash_name, chunk_size):
+        self.hasher = hashlib.new(hash_name)
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self.length = 0
+        self.pending = []
+        self.pending_len = 0
+
+    def push(self, s):
+        if isinstance(s, unicode):
+            s = s.encode("utf-8")
+        self.pending.append(s)
+        self.pending_len += len(s)
+        if self.pending_len >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending_len > 0:
+            chunk = "".join(self.pending)
+            self.hasher.update(chunk)
+            self.chunks.append(chunk)
+            self.length += len(chunk)
+        self.pending = []
+        self.pending_len = 0
+
+    def result(self):
+        self.flush()
+        return EmitResult(self.chunks, self.hasher.hexdigest(), self.length)
+
+
+def emit_with_digest(obj, hash_name="sha1", chunk_size=DEFAULT_EMIT_CHUNK_SIZE):
+    '''
+    Emit obj(a tag, a string or an iterable of them) as utf-8 encoded chunks,
+    computing the digest of the content incrementally.
+
+    Returns -
+        EmitResult
+    '''
+    emitter = _DigestEmitter(hash_name, chunk_size)
+    push = emitter.push
+    for node in flatten_tags(obj):
+        _emit_node(node, push)
+    return emitter.result()
+
 class _TagPoolSig:
     def __getattr__(self, tag_name):
+        # constructors are memoized as attributes, so that __getattr__ is
+        # called once for each tag name
         if tag_name == "rawstring":
-            return RawString
+            constructor = RawString
         elif tag_name.lower() in _TAG_SET:
-            return lambda *args, **kwds: Tag(tag_name, *args, **kwds)
+            constructor = partial(Tag, tag_name)
         else:
             raise ValueError("{0} is not appropriate tag".format(tag_name))
+        self.__dict__[tag_name] = constructor
+        return constructor
 
 TagPool = _TagPoolSig()
 def is_tag_name(name, case_sensetive=False):
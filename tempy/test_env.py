@@ -0,0 +1,133 @@
+#!/usr/bin/env ipython
+import os
+import marshal
+import shutil
+import tempfile
+import unittest
+
+from env import Environment, ModuleFetcher, CompileOption, _compile_kont
+from errors import TempyError
+from translate import Config, translate_file
+from optimize import OptimizationPass
+
+SOURCES = {
+    "main/index.tpy": '''\
+import pages.common
+import shared
+import_from pages.common:
+    Footer
+
+def Page(n):
+  div:
+    p: str(n)
+    shared.Title(n)
+    Footer("me")
+''',
+    "main/pages/__init__.tpy": "",
+    "main/pages/common.tpy": '''\
+def Footer(who):
+  div(class="footer"):
+    p: "made by " + who
+''',
+    "main/broken.tpy": '''\
+import pages.common
+
+def Broken():
+  $if:
+''',
+    "extra/shared.tpy": '''\
+def Title(n):
+  h1: "title " + str(n)
+''',
+}
+
+
+class PrefetchTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for path, source in SOURCES.items():
+            self.write(path, source)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def path(self, path):
+        return os.path.join(self.root, path)
+
+    def write(self, path, source):
+        path = self.path(path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write(source)
+
+    def environment(self, **kwargs):
+        fetcher = ModuleFetcher(self.path("main"), [self.path("extra")])
+        return Environment(self.path("main"),
+                           module_fetcher=fetcher,
+                           compile_option=CompileOption(**kwargs))
+
+    def render(self, env):
+        return str(env.module("index").Page(3))
+
+    def test_same_as_without_prefetch(self):
+        expected = self.render(self.environment(use_tpyc=False))
+
+        env = self.environment(use_tpyc=False)
+        env.prefetch("index", processes=2)
+        self.assertEqual(sorted(env.precompiled),
+                         sorted(self.path(path) for path in ["main/index.tpy",
+                                                              "main/pages/__init__.tpy",
+                                                              "main/pages/common.tpy",
+                                                              "extra/shared.tpy"]))
+        self.assertEqual(self.render(env), expected)
+        self.assertEqual(env.precompiled, {})
+
+        # written to .tpyc files, which are only scanned next time
+        env = self.environment(prefetch_processes=2)
+        self.assertEqual(self.render(env), expected)
+        self.assertTrue(os.path.isfile(self.path("extra/shared.tpyc")))
+        env = self.environment(prefetch_processes=2)
+        self.assertEqual(self.render(env), expected)
+        self.assertEqual(env.precompiled, {})
+
+    def test_translate_config(self):
+        tpy_path = self.path("main/index.tpy")
+        for config in [Config(emit_line_info=False), Config(optimization_level=0)]:
+            env = self.environment(use_tpyc=False, translate_config=config)
+            env.prefetch("index", processes=2)
+            code, line_table, _ = env.precompiled[tpy_path]
+            expected_code, expected_line_table = _compile_kont(translate_file(tpy_path, config), tpy_path)
+            self.assertEqual(marshal.dumps(code), marshal.dumps(expected_code))
+            self.assertEqual(line_table, expected_line_table)
+
+    def test_modified_after_prefetch(self):
+        env = self.environment(use_tpyc=False)
+        env.prefetch("index", processes=2)
+        self.write("extra/shared.tpy", '''\
+def Title(n):
+  h2: "changed " + str(n)
+''')
+        tpy_path = self.path("extra/shared.tpy")
+        mtime = os.path.getmtime(tpy_path) + 10
+        os.utime(tpy_path, (mtime, mtime))
+        self.assertIn("<h2>changed 3</h2>", self.render(env))
+
+    def test_failures_fall_back(self):
+        env = self.environment(use_tpyc=False)
+        env.prefetch("broken", processes=2)
+        self.assertNotIn(self.path("main/broken.tpy"), env.precompiled)
+        self.assertRaises(TempyError, env.module, "broken")
+
+        # passes which cannot be sent to workers
+        config = Config()
+        config.register_pass(OptimizationPass("noop", lambda stmts, comp_env: None))
+        expected = self.render(self.environment(use_tpyc=False, translate_config=config))
+        env = self.environment(use_tpyc=False, translate_config=config)
+        env.prefetch("index", processes=2)
+        self.assertEqual(env.precompiled, {})
+        self.assertEqual(self.render(env), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
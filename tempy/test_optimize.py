@@ -0,0 +1,552 @@
+#!/usr/bin/env ipython
+import sys
+import unittest
+from StringIO import StringIO
+
+from translate import translate_string, pystmts_to_string, pystmts_to_ast, Config, PyDefun, \
+                      PyAssignmentToName, PyReturn, PyCall, PyMetaID, PyLiteral, IDHint, \
+                      TranslationCache, AstLineCounter
+from optimize import DEFAULT_PASSES, CopyPropagator, OptimizationPass, PassManager, PassReport, \
+                     IRTransformer, count_nodes
+from tag import emit_with_digest
+import linemap
+
+# no pass, each pass alone, and every pass
+PASS_CHOICES = [[]] + [[opt_pass] for opt_pass in DEFAULT_PASSES] + [DEFAULT_PASSES]
+
+
+def translate(source, passes):
+    return translate_string(source, config=Config(passes=passes))
+
+def execute(stmts):
+    namespace = {}
+    exec compile(pystmts_to_ast(stmts), "<test>", "exec") in namespace
+    return namespace["__tempy_main__"](None, None, None)
+
+def defun_source(stmts, name):
+    for stmt in stmts[0].stmt_list:
+        if isinstance(stmt, PyDefun) and stmt.fun_name == name:
+            return pystmts_to_string([stmt])
+    raise KeyError(name)
+
+def render(value):
+    # templates use tags of tempy.tag, which is another module than tag here
+    if isinstance(value, (list, tuple)) or hasattr(value, "emit_html"):
+        return str(emit_with_digest(value))
+    return repr(value)
+
+
+class OptimizationTestCase(unittest.TestCase):
+    def call(self, fn, args):
+        try:
+            return render(fn(*args))
+        except Exception as e:
+            return (type(e), e.args)
+
+    def assert_same_rendering(self, source, calls):
+        '''
+        checks that functions of source return the same for each choice of
+        passes
+
+        calls: (function name, arguments) list
+        '''
+        expected = None
+        for passes in PASS_CHOICES:
+            module = execute(translate(source, passes))
+            results = [self.call(module[name], args) for name, args in calls]
+            if expected is None:
+                expected = results
+            else:
+                self.assertEqual(results, expected, [opt_pass.name for opt_pass in passes])
+        return expected
+
+
+DEAD_CODE_SOURCE = '''\
+pyimport os
+
+def Helper(x):
+  x + 1
+
+def Page(n):
+  $let(unused = n * 2, side = str(n), b = 3):
+    $if(False):
+      p: "dropped"
+    div: str(b)
+
+def Other(n):
+  $if(False):
+    str(n)
+  $if(n, True):
+    1
+    2
+  div: str(n)
+
+def Fail(n):
+  $seq:
+    raise(ValueError(n))
+    str(n)
+
+def Always():
+  $if(True):
+    "yes"
+    "no"
+'''
+
+class DeadCodeTest(OptimizationTestCase):
+    def test_rendering(self):
+        results = self.assert_same_rendering(DEAD_CODE_SOURCE,
+                                             [("Helper", (1, )),
+                                              ("Page", (3, )),
+                                              ("Other", (0, )),
+                                              ("Other", (1, )),
+                                              ("Fail", (2, )),
+                                              ("Always", ())])
+        self.assertEqual(results[:2], ["2", "<div>3</div>"])
+        self.assertEqual(results[4:], [(ValueError, (2, )), "'yes'"])
+
+    def test_shape(self):
+        stmts = translate(DEAD_CODE_SOURCE, [])
+        self.assertIn("unused", defun_source(stmts, "Page"))
+        self.assertIn("if", defun_source(stmts, "Other"))
+        self.assertIn("return str(n)", defun_source(stmts, "Fail"))
+
+        stmts = translate(DEAD_CODE_SOURCE, [DEFAULT_PASSES[0]])
+        page = defun_source(stmts, "Page")
+        # unread assignments are removed, keeping side effects
+        self.assertNotIn("unused", page)
+        self.assertNotIn("side", page)
+        self.assertIn("    str(n)\n", page)
+        # so are branches which are never taken, and those without effects
+        self.assertNotIn("if", page)
+        self.assertNotIn("dropped", page)
+        self.assertNotIn("if", defun_source(stmts, "Other"))
+        always = defun_source(stmts, "Always")
+        self.assertNotIn("if", always)
+        self.assertNotIn("'no'", always)
+        # and statements after raise
+        self.assertEqual(defun_source(stmts, "Fail"),
+                         "def Fail(n):\n    raise ValueError(n)\n")
+        # module level names are read by the dict returned
+        self.assertIn("import os", pystmts_to_string(stmts))
+
+    def test_assignments_released_by_removal(self):
+        # removing the read of b makes the assignment of b dead as well
+        stmts = translate('''\
+def F(n):
+  $let(b = n + 1):
+    $let(c = b * 2):
+      n
+''', [DEFAULT_PASSES[0]])
+        self.assertEqual(defun_source(stmts, "F"), "def F(n):\n    return n\n")
+
+
+
+COPY_PROPAGATION_SOURCE = '''\
+def Card(title, items, selected=None):
+  div(class="card"):
+    h2: title.upper()
+    $if(selected):
+      p: "selected " + str(selected)
+      p: "none"
+    ul:
+      $each(item, in=items):
+        li: str(item)
+    span: str(len(items)) + " items"
+
+def Label(n):
+  $if(n > 1, n == 1):
+    str(n) + " items"
+    "one item"
+    "empty"
+
+def Pick(f, g, n):
+  f>
+    g(n)
+    $if(n):
+      g(n + 1)
+      g(n - 1)
+    str(n)
+'''
+
+def _calls(*args):
+    return "calls%r"%(args, )
+
+def _counter():
+    log = []
+    def g(n):
+        log.append(n)
+        return n * 10
+    return (log, g)
+
+
+class CopyPropagationTest(OptimizationTestCase):
+    def test_rendering(self):
+        results = self.assert_same_rendering(COPY_PROPAGATION_SOURCE,
+                                             [("Card", ("t", [1, 2], 2)),
+                                              ("Card", ("t", [], None)),
+                                              ("Label", (0, )),
+                                              ("Label", (1, )),
+                                              ("Label", (5, )),
+                                              ("Pick", (_calls, lambda n: n * 10, 0)),
+                                              ("Pick", (_calls, lambda n: n * 10, 3))])
+        self.assertEqual(results[0],
+                         '<div class="card"><h2>T</h2><p>selected 2</p>'
+                         '<ul><li>1</li><li>2</li></ul><span>2 items</span></div>')
+        self.assertEqual(results[5], repr("calls(0, -10, '0')"))
+
+    def test_order_of_calls(self):
+        logs = []
+        for passes in PASS_CHOICES:
+            module = execute(translate(COPY_PROPAGATION_SOURCE, passes))
+            log, g = _counter()
+            module["Pick"](_calls, g, 3)
+            logs.append(log)
+        self.assertEqual(logs, [logs[0]] * len(PASS_CHOICES))
+
+    def test_shape(self):
+        stmts = translate(COPY_PROPAGATION_SOURCE, [DEFAULT_PASSES[1]])
+        # assignments of $if are folded into a conditional expression
+        self.assertEqual(defun_source(stmts, "Label"),
+                         "def Label(n):\n"
+                         "    _ = str(n) + ' items' if n > 1 else ('one item' if n == 1 else 'empty')\n"
+                         "    return _\n")
+        # temporaries are inlined into statements of the same line only
+        card = defun_source(stmts, "Card")
+        self.assertIn("(__html__.h2)({}, (title.upper)())", card)
+        self.assertIn("(__html__.li)({}, str(item))", card)
+        self.assertIn("return (__html__.div)({'class': 'card'}, _, ", card)
+
+    def propagate(self, stmts, hints):
+        CopyPropagator(hints, stmts).propagate(stmts)
+        return pystmts_to_string(stmts)
+
+    def test_no_read_moved_across_write(self):
+        x, t1, t2, f, g = [PyMetaID(_id) for _id in range(5)]
+        hints = {0: IDHint("x", "local", "local"),
+                 1: IDHint("", "immediate", "local"),
+                 2: IDHint("", "immediate", "local"),
+                 3: "f",
+                 4: "g"}
+
+        # x is written between the read and the statement
+        stmts = [PyAssignmentToName(t1, x),
+                 PyAssignmentToName(x, PyLiteral(5)),
+                 PyReturn(PyCall(f, [t1], None))]
+        self.assertEqual(self.propagate(stmts, hints),
+                         "__meta_id1__ = __meta_id0__\n"
+                         "__meta_id0__ = 5\n"
+                         "return __meta_id3__(__meta_id1__)\n")
+
+        # g() may write x, and is evaluated before t1 is read
+        stmts = [PyAssignmentToName(t1, x),
+                 PyAssignmentToName(t2, PyCall(g, [], None)),
+                 PyReturn(PyCall(f, [t2, t1], None))]
+        self.assertEqual(self.propagate(stmts, hints),
+                         "__meta_id1__ = __meta_id0__\n"
+                         "return __meta_id3__(__meta_id4__(), __meta_id1__)\n")
+
+        # read in the same order as assigned
+        stmts = [PyAssignmentToName(t1, x),
+                 PyAssignmentToName(t2, PyCall(g, [], None)),
+                 PyReturn(PyCall(f, [t1, t2], None))]
+        self.assertEqual(self.propagate(stmts, hints),
+                         "return __meta_id3__(__meta_id0__, __meta_id4__())\n")
+
+
+
+LOOP_LOWERING_SOURCE = '''\
+def Effects(items, log):
+  ul:
+    $each(item, in=items):
+      li: log.append(item) || str(item)
+
+def Nested(rows):
+  table:
+    $each(row, in=rows):
+      tr:
+        $each(cell, in=row):
+          td: str(cell)
+
+def Conditional(items):
+  ul:
+    $each(item, in=items):
+      $if(item % 2):
+        li(class="odd"): str(item)
+        li: str(item)
+
+def Multi(items):
+  div:
+    $each(item, index=i, in=items):
+      h3: str(i)
+      p: str(item)
+
+def Fails(items):
+  ul:
+    $each(item, in=items):
+      li: str(10 / item)
+'''
+
+class _StoppingLog(list):
+    def append(self, item):
+        if item == "stop":
+            raise StopIteration(len(self))
+        list.append(self, item)
+
+
+class LoopLoweringTest(OptimizationTestCase):
+    def test_rendering(self):
+        results = self.assert_same_rendering(LOOP_LOWERING_SOURCE,
+                                             [("Effects", ([1, 2], [])),
+                                              ("Nested", ([[1, 2], [], [3]], )),
+                                              ("Conditional", ([1, 2, 3], )),
+                                              ("Multi", (["a", "b"], )),
+                                              ("Multi", ([], )),
+                                              ("Fails", ([5, 2], )),
+                                              ("Fails", ([5, 0, 2], ))])
+        self.assertEqual(results[1],
+                         "<table><tr><td>1</td><td>2</td></tr><tr></tr><tr><td>3</td></tr></table>")
+        self.assertEqual(results[2], '<ul><li class="odd">1</li><li>2</li><li class="odd">3</li></ul>')
+        self.assertEqual(results[3], "<div><h3>0</h3><p>a</p><h3>1</h3><p>b</p></div>")
+        self.assertEqual(results[6][0], ZeroDivisionError)
+
+    def test_side_effects(self):
+        logs = []
+        for passes in PASS_CHOICES:
+            module = execute(translate(LOOP_LOWERING_SOURCE, passes))
+            log = _StoppingLog()
+            module["Effects"](["a", "b"], log)
+            # leaves the loop in the middle
+            stopping_log = _StoppingLog()
+            self.assertRaises(StopIteration, module["Effects"], ["a", "stop", "b"], stopping_log)
+            logs.append((log, stopping_log))
+        self.assertEqual(logs, [(["a", "b"], ["a"])] * len(PASS_CHOICES))
+
+    def test_shape(self):
+        stmts = translate(LOOP_LOWERING_SOURCE, DEFAULT_PASSES[1:3])
+        for name in ["Effects", "Multi", "Fails"]:
+            source = defun_source(stmts, name)
+            self.assertNotRegexpMatches(source, "(?m)^    for ")
+            self.assertNotIn(".extend", source)
+        # a single element is followed by the loop, without an inner loop
+        self.assertIn(" = [\n"
+                      "        (__html__.li)({}, str(10 / item))\n"
+                      "        for item in items]",
+                      defun_source(stmts, "Fails"))
+        # each element on a line of its own
+        self.assertIn(" for (i, item) in enumerate(items) for __imd1 in (\n"
+                      "        (__html__.h3)({}, str(i)),\n"
+                      "        (__html__.p)({}, str(item)))]",
+                      defun_source(stmts, "Multi"))
+
+        # only the inner loop, whose elements are not read by other statements
+        nested = defun_source(stmts, "Nested")
+        self.assertIn("    for row in rows:\n", nested)
+        self.assertIn("\n            for cell in row]", nested)
+
+        # bodies which are not a sequence of temporaries are left as they are
+        conditional = defun_source(stmts, "Conditional")
+        self.assertIn("    for item in items:\n", conditional)
+        self.assertIn("(_.extend)", conditional)
+
+    def test_line_table(self):
+        # errors in elements point to their lines in the template
+        li_line = LOOP_LOWERING_SOURCE.splitlines().index("      li: str(10 / item)") + 1
+        for passes in PASS_CHOICES:
+            stmts = translate(LOOP_LOWERING_SOURCE, passes)
+            counter = AstLineCounter()
+            code = compile(pystmts_to_ast(stmts, counter), "<line table test>", "exec")
+            linemap.register("<line table test>", counter.line_table)
+            try:
+                namespace = {}
+                exec code in namespace
+                fails = namespace["__tempy_main__"](None, None, None)["Fails"]
+                try:
+                    fails([5, 0])
+                except ZeroDivisionError:
+                    frames = linemap.extract_tb(sys.exc_info()[2])
+                self.assertEqual(frames[-1][:3], ("<line table test>", li_line, "Fails"),
+                                 [opt_pass.name for opt_pass in passes])
+            finally:
+                linemap.unregister("<line table test>")
+
+
+
+GLOBAL_HOISTING_SOURCE = '''\
+def Early(xs):
+  str(xs[0]) + str(xs[1])
+
+str = repr
+
+def Late(xs):
+  str(xs[0]) + str(xs[1])
+
+def Local(xs):
+  $let(a = len(xs) + len(xs)):
+    def inner(len):
+      len(xs) + len(xs)
+    inner(sum) + a
+
+def Cells(xs):
+  tr:
+    td: unicode(xs[0])
+    td: unicode(xs[1])
+'''
+
+class GlobalHoistingTest(OptimizationTestCase):
+    def test_rebound_names(self):
+        results = self.assert_same_rendering(GLOBAL_HOISTING_SOURCE,
+                                             [("Early", (["a", 1], )),
+                                              ("Late", (["a", 1], )),
+                                              ("Local", ([1, 2], )),
+                                              ("Cells", (["a", 1], ))])
+        # str is rebound for the whole module, as python does
+        self.assertEqual(results[:3], [repr("'a'1"), repr("'a'1"), "10"])
+        self.assertEqual(results[3], "<tr><td>a</td><td>1</td></tr>")
+
+    def test_shape(self):
+        stmts = translate(GLOBAL_HOISTING_SOURCE, [DEFAULT_PASSES[3]])
+        # str of the module is not the builtin
+        self.assertNotIn("__str", pystmts_to_string(stmts))
+        # the parameter of inner is not replaced
+        self.assertEqual(defun_source(stmts, "Local"),
+                         "def Local(xs):\n"
+                         "    __len = len\n"
+                         "    _ = __len(xs) + __len(xs)\n"
+                         "    a = _\n"
+                         "    def inner(len):\n"
+                         "        return len(xs) + len(xs)\n"
+                         "    return inner(sum) + a\n")
+        cells = defun_source(stmts, "Cells")
+        self.assertIn("    __td = __html__.td\n    __unicode = unicode\n", cells)
+        # used once
+        self.assertIn("(__html__.tr)", cells)
+
+
+
+class _MapLiterals(IRTransformer):
+    def __init__(self, fn):
+        self.fn = fn
+
+    def visit_PyLiteral(self, expr):
+        if isinstance(expr.literal, basestring):
+            return PyLiteral(self.fn(expr.literal))
+        return expr
+
+def literal_pass(fn, name="literals", version=1, level=1):
+    return OptimizationPass(name,
+                            lambda stmts, comp_env: _MapLiterals(fn).visit_stmts(stmts),
+                            level,
+                            version)
+
+def _drop_last_pass(name, called):
+    def run(stmts, comp_env):
+        called.append(name)
+        del stmts[0].stmt_list[-2:-1]
+    return OptimizationPass(name, run)
+
+
+class PassManagerTest(OptimizationTestCase):
+    SOURCE = '''\
+def F():
+  "a"
+
+def G():
+  "b"
+'''
+
+    def test_order_and_reports(self):
+        called = []
+        passes = [_drop_last_pass("first", called),
+                  _drop_last_pass("second", called),
+                  OptimizationPass("never", lambda stmts, comp_env: called.append("never"), level=2)]
+        stmts = translate_string(self.SOURCE, config=Config(passes=[], optimization_level=0))
+        nodes = count_nodes(stmts)
+        reports = PassManager(passes, 1).run(stmts, None)
+        # in order, skipping passes of higher levels
+        self.assertEqual(called, ["first", "second"])
+        self.assertEqual([report.name for report in reports], ["first", "second"])
+        self.assertEqual(reports[0].nodes_before, nodes)
+        self.assertEqual(reports[0].nodes_after, reports[1].nodes_before)
+        self.assertEqual(reports[1].nodes_after, count_nodes(stmts))
+        self.assertTrue(reports[1].nodes_after < reports[1].nodes_before)
+        self.assertNotIn("def F", pystmts_to_string(stmts))
+        self.assertNotIn("def G", pystmts_to_string(stmts))
+
+        report = PassReport("first", 0.0015, 20, 17)
+        self.assertEqual(str(report), "first                   1.500ms     20 ->     17 nodes (-3)")
+
+    def test_config(self):
+        upper = literal_pass(lambda s: s.upper(), "upper")
+        config = Config()
+        config.register_pass(upper, after="dead_code")
+        self.assertEqual([opt_pass.name for opt_pass in config.passes],
+                         ["dead_code", "upper", "copy_propagation", "loop_lowering", "global_hoisting"])
+        self.assertRaises(ValueError, config.register_pass, literal_pass(str.lower), "no_such_pass")
+        self.assertRaises(ValueError, config.register_pass, literal_pass(str.lower, "upper"))
+        self.assertRaises(ValueError, Config, passes=[upper, upper])
+
+        report_file = StringIO()
+        config.pass_report_file = report_file
+        module = execute(translate_string(self.SOURCE, config=config))
+        self.assertEqual(module["F"](), "A")
+        self.assertEqual([line.split()[0] for line in report_file.getvalue().splitlines()],
+                         [opt_pass.name for opt_pass in config.passes])
+
+    def translate_cached(self, cache, opt_pass):
+        config = Config(passes=[opt_pass])
+        return execute(translate_string(self.SOURCE, config=config, translation_cache=cache))["F"]()
+
+    def test_cache_key(self):
+        cache = TranslationCache()
+        self.assertEqual(self.translate_cached(cache, literal_pass(lambda s: s + "1")), "a1")
+        # passes are told apart by their names and versions, not by functions
+        self.assertEqual(self.translate_cached(cache, literal_pass(lambda s: s + "2")), "a1")
+        self.assertEqual(self.translate_cached(cache, literal_pass(lambda s: s + "3", version=2)), "a3")
+        self.assertEqual(self.translate_cached(cache, literal_pass(lambda s: s + "4", "other")), "a4")
+        self.assertEqual(self.translate_cached(cache, literal_pass(lambda s: s + "5", level=2)), "a")
+
+
+COMPARISON_SOURCE = '''\
+def InRange(x):
+  0 < x < 10
+
+def Mixed(x):
+  0 < x <= 10 == 10
+
+def Arith(x):
+  x + 1 < 10 < x * 3
+
+def Nested(x):
+  0 < (x < 10)
+
+def Sub(x):
+  x - (1 - x)
+'''
+
+class ComparisonTest(OptimizationTestCase):
+    CALLS = [(name, (x, )) for name in ["InRange", "Mixed", "Arith", "Nested", "Sub"]
+                           for x in [-5, 5, 20]]
+
+    def test_chained(self):
+        results = self.assert_same_rendering(COMPARISON_SOURCE, self.CALLS)
+        # python chains comparisons, as they are written in templates
+        self.assertEqual(results, ["False", "True", "False",
+                                   "False", "True", "False",
+                                   "False", "True", "False",
+                                   "True", "True", "False",
+                                   "-11", "9", "39"])
+
+    def test_written(self):
+        stmts = translate(COMPARISON_SOURCE, [])
+        self.assertIn("return 0 < x < 10", defun_source(stmts, "InRange"))
+        self.assertIn("return 0 < x <= 10 == 10", defun_source(stmts, "Mixed"))
+        self.assertIn("return 0 < (x < 10)", defun_source(stmts, "Nested"))
+        namespace = {}
+        exec pystmts_to_string(stmts) in namespace
+        module = namespace["__tempy_main__"](None, None, None)
+        self.assertEqual([self.call(module[name], args) for name, args in self.CALLS],
+                         self.assert_same_rendering(COMPARISON_SOURCE, self.CALLS))
+
+
+if __name__ == "__main__":
+    unittest.main()
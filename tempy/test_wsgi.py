@@ -0,0 +1,101 @@
+#!/usr/bin/env ipython
+import unittest
+
+from tag import Tag, emit_with_digest
+from wsgi import respond, etag_matches, TempyApplication
+
+
+def page(text, **attrs):
+    return Tag("div", attrs, Tag("p", None, text), Tag("br", None))
+
+
+def call(app, **environ):
+    environ.setdefault("REQUEST_METHOD", "GET")
+    started = []
+    def start_response(status, headers):
+        started.append((status, dict(headers)))
+    body = "".join(app(environ, start_response))
+    status, headers = started[0]
+    return status, headers, body
+
+
+class DigestTest(unittest.TestCase):
+    def test_same_as_emit_html(self):
+        tag = page("<hello>", id="x", klass="y")
+        for chunk_size in [1, 7, 8192]:
+            result = emit_with_digest(tag, chunk_size=chunk_size)
+            self.assertEqual(str(result), tag.emit_html())
+            self.assertEqual(result.length, len(tag.emit_html()))
+
+    def test_etag_stable(self):
+        # attributes are emitted in sorted order, whatever order the dict has
+        self.assertEqual(page("a", id="x", title="t", lang="en").emit_html(),
+                         '<div id="x" lang="en" title="t"><p>a</p><br /></div>')
+        etags = set(emit_with_digest(page("a", id="x", title="t"), chunk_size=chunk_size).etag
+                    for chunk_size in [1, 3, 8192])
+        self.assertEqual(len(etags), 1)
+
+    def test_etag_content_sensitive(self):
+        self.assertNotEqual(emit_with_digest(page("a")).etag,
+                            emit_with_digest(page("b")).etag)
+        self.assertNotEqual(emit_with_digest(page("a", id="x")).etag,
+                            emit_with_digest(page("a", id="y")).etag)
+
+    def test_etag_matches(self):
+        self.assertTrue(etag_matches('"abc"', '"abc"'))
+        self.assertTrue(etag_matches('W/"abc"', '"abc"'))
+        self.assertTrue(etag_matches('"x", W/"abc"', '"abc"'))
+        self.assertTrue(etag_matches('*', '"abc"'))
+        self.assertFalse(etag_matches('"abcd"', '"abc"'))
+
+
+class RespondTest(unittest.TestCase):
+    def setUp(self):
+        self.app = TempyApplication(lambda environ: page("hello"))
+        self.etag = emit_with_digest(page("hello")).etag
+
+    def test_get(self):
+        status, headers, body = call(self.app)
+        self.assertEqual(status, "200 OK")
+        self.assertEqual(headers["ETag"], self.etag)
+        self.assertEqual(headers["Content-Length"], str(len(body)))
+        self.assertEqual(body, page("hello").emit_html())
+
+    def test_not_modified(self):
+        for if_none_match in [self.etag, "W/" + self.etag, '"other", ' + self.etag]:
+            for method in ["GET", "HEAD"]:
+                status, headers, body = call(self.app,
+                                             REQUEST_METHOD=method,
+                                             HTTP_IF_NONE_MATCH=if_none_match)
+                self.assertEqual(status, "304 Not Modified")
+                self.assertEqual(headers["ETag"], self.etag)
+                self.assertEqual(body, "")
+
+    def test_modified(self):
+        status, headers, body = call(self.app, HTTP_IF_NONE_MATCH='"other"')
+        self.assertEqual(status, "200 OK")
+        self.assertEqual(body, page("hello").emit_html())
+
+        # only GET and HEAD are answered with 304
+        status, headers, body = call(self.app,
+                                     REQUEST_METHOD="POST",
+                                     HTTP_IF_NONE_MATCH=self.etag)
+        self.assertEqual(status, "200 OK")
+
+    def test_head(self):
+        status, headers, body = call(self.app, REQUEST_METHOD="HEAD")
+        self.assertEqual(status, "200 OK")
+        self.assertEqual(headers["ETag"], self.etag)
+        self.assertEqual(headers["Content-Length"], str(len(page("hello").emit_html())))
+        self.assertEqual(body, "")
+
+    def test_non_200_status(self):
+        def app(environ, start_response):
+            return respond(environ, start_response, page("missing"), status="404 Not Found")
+        status, headers, body = call(app, HTTP_IF_NONE_MATCH=emit_with_digest(page("missing")).etag)
+        self.assertEqual(status, "404 Not Found")
+        self.assertEqual(body, page("missing").emit_html())
+
+
+if __name__ == "__main__":
+    unittest.main()
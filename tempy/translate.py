@@ -1,10 +1,13 @@
 from tag import is_tag_name, HTML_TAGS
-from lisn import loads, loads_file, LISNSyntaxException
+from lisn import loads, loads_file, LISNNode, LISNSyntaxException
 from lisn.utils import LISNVisitor
 from lisn.match import LISNPattern
 from functools import wraps
 from copy import copy
 from pprint import pprint
+import hashlib
+import ast
+import threading
 from errors import TempyCompileError, TempySyntaxError, CompileError
 
 '''
@@ -106,6 +109,32 @@ def force_dotted_name(node):
     result = _iter(node)
     return result
 
+def collect_import_names(node):
+    '''
+    Find every 'import' and 'import_from' in node without translating it.
+
+    Returns -
+        list of (string tuple), dotted names of imported modules
+        without duplicates
+    '''
+    result = []
+    seen = set()
+    stack = [node]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, (dict, LISNNode)):
+            if obj.get("type") == "xexpr" and \
+               obj["has_head_label"] and \
+               obj["head_label"] in ("import", "import_from"):
+                names = force_dotted_name(obj["head_expr"])
+                if names is not None and tuple(names) not in seen:
+                    seen.add(tuple(names))
+                    result.append(tuple(names))
+            stack.extend([v for k, v in obj.items() if k != "locinfo"])
+        elif isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+    return result
+
 def force_one_parg(xexpr):
     if xexpr["type"] != "xexpr":
         return None
@@ -145,33 +174,210 @@ use convert-env (dict)
 Python AST Classes & Meta ID Conversion tools
 '''
 
+class AstLineCounter:
+    '''
+    Tracks line numbers while PyStmts are lowered to python ast nodes, so that
+    nodes get the line numbers that they would have in the source text.
+
+    It also builds the line table, which is a list of
+    (generated line, tpy sline, tpy eline, tpy scol, tpy ecol) sorted by
+    generated line. See linemap.py
+    '''
+    def __init__(self, lineno=1):
+        self.lineno = lineno
+        self.line_delta = 0 # applied to lines of tpy locations
+        self.line_table = []
+
+    def take(self, line_cnt=1):
+        lineno = self.lineno
+        self.lineno += line_cnt
+        return lineno
+
+    def locate(self, stmt):
+        self.mark(stmt.srcloc)
+
+    def mark(self, locinfo):
+        '''
+        Map the next line to locinfo unless it is None
+        '''
+        if locinfo is not None:
+            self.line_table.append((self.lineno,
+                                    locinfo["sline"] + self.line_delta,
+                                    locinfo["eline"] + self.line_delta,
+                                    locinfo["scol"],
+                                    locinfo["ecol"]))
+
+
+class PyCodeWriter:
+    '''
+    Output buffer of the IR printer. Indentation is kept as state of
+    the writer, so that each piece of code is written only once however deep
+    it is nested.
+    '''
+    def __init__(self, indent=4, acc_indent=0):
+        self.indent = indent
+        self.acc_indent = acc_indent
+        self.chunks = []
+
+    def push(self, s):
+        self.chunks.append(s)
+
+    def begin_line(self):
+        self.chunks.append(" "*self.acc_indent)
+
+    def end_line(self):
+        self.chunks.append("\n")
+
+    def write_block(self, stmt_list):
+        self.acc_indent += self.indent
+        for stmt in stmt_list:
+            stmt.write(self)
+        if all(isinstance(stmt, PyMetaComment) for stmt in stmt_list):
+            PyPass().write(self)
+        self.acc_indent -= self.indent
+
+    def getvalue(self):
+        return "".join(self.chunks)
+
+
+class _CreatedStmts(threading.local):
+    # statements created while a node is being translated, which
+    # LocatingVisitor has not located yet. None if no translation is running
+    stmts = None
+
+_created_stmts = _CreatedStmts()
+
+
 class PyStmt:
+    srcloc = None # locinfo of tpy node which the statement came from
+
+    def __init__(self):
+        created = _created_stmts.stmts
+        if created is not None:
+            created.append(self)
+
+    def write(self, writer):
+        raise NotImplementedError
+
     def to_string(self, indent, acc_indent):
+        writer = PyCodeWriter(indent, acc_indent)
+        self.write(writer)
+        return writer.getvalue()
+
+    def to_ast(self, counter):
+        '''
+        Returns -
+            python ast stmt list
+        '''
         raise NotImplementedError
 
     def convert_meta_id(self, driver, local_dict):
         raise NotImplementedError
 
+    def sub_exprs(self):
+        '''
+        Returns -
+            PyExpr list evaluated by the statement itself, not including
+            those in sub_stmt_lists()
+        '''
+        return []
+
+    def map_sub_exprs(self, fn):
+        '''
+        Replace each expression of sub_exprs() with fn(expression) in place
+        '''
+        pass
+
+    def sub_stmt_lists(self):
+        '''
+        Returns -
+            stmt lists nested in the statement
+        '''
+        return []
+
 
 class PyMetaComment(PyStmt):
     def __init__(self, cmt_str):
+        PyStmt.__init__(self)
         self.cmt_str = cmt_str
 
-    def to_string(self, indent, acc_indent):
-        if '\n' in self.cmt_str:
-            res = "\n".join([" "*acc_indent + "# " + line
-                             for line in self.cmt_str.splitlines()])
-            res += "\n"
-            return res
-        else:
-            return " "*acc_indent + "# " + self.cmt_str + "\n"
+    def write(self, writer):
+        for line in self.cmt_str.splitlines() or [""]:
+            writer.begin_line()
+            writer.push("# ")
+            writer.push(line)
+            writer.end_line()
+
+    def to_ast(self, counter):
+        counter.take(max(len(self.cmt_str.splitlines()), 1))
+        return []
 
     def convert_meta_id(self, driver, local_dict):
         pass
 
-def stmt_list_to_string(stmt_list, indent, acc_indent):
-    return "".join([stmt.to_string(indent, acc_indent+indent)
-                    for stmt in stmt_list])
+def _name_to_string(name):
+    if isinstance(name, PyExpr):
+        return name.to_string()
+    return name
+
+def write_arguments(writer, pos_args, kwd_args, star, dstar):
+    first = True
+    for pos_arg in pos_args:
+        if not first:
+            writer.push(", ")
+        first = False
+        writer.push(_name_to_string(pos_arg))
+    for keyword, arg_expr in kwd_args:
+        if not first:
+            writer.push(", ")
+        first = False
+        writer.push(_name_to_string(keyword))
+        writer.push("=")
+        arg_expr.write(writer)
+    for prefix, name in (("*", star), ("**", dstar)):
+        if name is not None:
+            if not first:
+                writer.push(", ")
+            first = False
+            writer.push(prefix)
+            writer.push(_name_to_string(name))
+
+def stmt_list_to_ast(stmt_list, counter, lineno):
+    '''
+    Lower a body of compound statement. Python does not allow a empty body,
+    so 'pass' is put in that case, as PyCodeWriter.write_block does.
+    '''
+    result = []
+    for stmt in stmt_list:
+        counter.locate(stmt)
+        result.extend(stmt.to_ast(counter))
+    if not result:
+        result.append(ast.Pass(lineno=counter.take(), col_offset=0))
+    return result
+
+def _ast_identifier(name):
+    if isinstance(name, PyExpr):
+        name = name.to_string()
+    return str(name)
+
+def _ast_arguments(pos_args, kwd_args, star, dstar, counter):
+    return ast.arguments(args=[ast.Name(_ast_identifier(pos_arg), ast.Param())
+                               for pos_arg in pos_args] +
+                              [ast.Name(_ast_identifier(keyword), ast.Param())
+                               for keyword, _ in kwd_args],
+                         vararg=_ast_identifier(star) if star is not None else None,
+                         kwarg=_ast_identifier(dstar) if dstar is not None else None,
+                         defaults=[kexpr.to_ast(counter) for _, kexpr in kwd_args])
+
+def _ast_store(node):
+    '''
+    Change load context of node into store context in order to use it as a target
+    '''
+    if isinstance(node, (ast.Tuple, ast.List)):
+        for elt in node.elts:
+            _ast_store(elt)
+    node.ctx = ast.Store()
+    return node
 
 
 
@@ -182,6 +388,7 @@ class PyDefun(PyStmt):
             kwd_args: (string | PyMetaID, PyExpr) list
 
         '''
+        PyStmt.__init__(self)
         self.fun_name = fun_name # string or PyMetaID
         self.pos_args = pos_args or []
         self.kwd_args = kwd_args or []
@@ -191,7 +398,7 @@ class PyDefun(PyStmt):
         self.stmt_list = stmt_list
 
     def convert_meta_id(self, driver, local_dict):
-        local_dict = {}
+        local_dict = driver.new_scope()
         if isinstance(self.fun_name, PyMetaID):
             self.fun_name = self.fun_name.convert_meta_id(driver, local_dict).name
         self.pos_args = [(pos_arg.convert_meta_id(driver, local_dict).name
@@ -211,93 +418,164 @@ class PyDefun(PyStmt):
                 self.dstar = self.dstar.convert_meta_id(driver, local_dict).name
         meta_convert_stmt_list(self.stmt_list, driver, local_dict)
 
-    def to_string(self, indent, acc_indent):
-        arglst = []
-
-        arglst += [(pos_arg.to_string() if isinstance(pos_arg, PyMetaID) else pos_arg)
-                    for pos_arg in self.pos_args]
-        for keyword, arg_expr in self.kwd_args:
-            if isinstance(keyword, PyMetaID):
-                keyword = keyword.to_string()
-            arglst.append(keyword + "=" + arg_expr.to_string())
-        
-        if self.star is not None:
-            star = self.star
-            if isinstance(star, PyMetaID):
-                star = star.to_string()
-            arglst.append("*" + star)
-        if self.dstar is not None:
-            dstar = self.dstar
-            if isinstance(dstar, PyMetaID):
-                dstar = dstar.to_string()
-            arglst.append("**" + dstar)
-
-        if isinstance(self.fun_name, PyMetaID):
-            fun_name = self.fun_name.to_string()
-        else:
-            fun_name = self.fun_name
-        
-        return " "*acc_indent + "def {0}({1}):\n{2}" \
-               .format(fun_name,
-                       ", ".join(arglst),
-                       stmt_list_to_string(self.stmt_list, indent, acc_indent))
+    def write(self, writer):
+        writer.begin_line()
+        writer.push("def ")
+        writer.push(_name_to_string(self.fun_name))
+        writer.push("(")
+        write_arguments(writer, self.pos_args, self.kwd_args, self.star, self.dstar)
+        writer.push("):")
+        writer.end_line()
+        writer.write_block(self.stmt_list)
+
+    def to_ast(self, counter):
+        lineno = counter.take()
+        return [ast.FunctionDef(name=_ast_identifier(self.fun_name),
+                                args=_ast_arguments(self.pos_args,
+                                                    self.kwd_args,
+                                                    self.star,
+                                                    self.dstar,
+                                                    counter),
+                                body=stmt_list_to_ast(self.stmt_list, counter, lineno),
+                                decorator_list=[],
+                                lineno=lineno,
+                                col_offset=0)]
+
+    def sub_exprs(self):
+        # defaults are evaluated where the function is defined
+        return [kexpr for _, kexpr in self.kwd_args]
+
+    def map_sub_exprs(self, fn):
+        self.kwd_args = [(keyword, fn(kexpr)) for keyword, kexpr in self.kwd_args]
+
+    def sub_stmt_lists(self):
+        return [self.stmt_list]
 
 
 class PyReturn(PyStmt):
     def __init__(self, ret_expr=None):
+        PyStmt.__init__(self)
         self.ret_expr = ret_expr
 
-    def to_string(self, indent, acc_indent):
+    def write(self, writer):
+        writer.begin_line()
+        writer.push("return ")
         if self.ret_expr is not None:
-            ret_expr_str = self.ret_expr.to_string()
-        else:
-            ret_expr_str = ""
+            self.ret_expr.write(writer)
+        writer.end_line()
 
-        return " "*acc_indent + "return %s\n"%ret_expr_str
+    def to_ast(self, counter):
+        lineno = counter.take()
+        ret_value = self.ret_expr.to_ast(counter) if self.ret_expr is not None else None
+        return [ast.Return(ret_value, lineno=lineno, col_offset=0)]
 
     def convert_meta_id(self, driver, local_dict):
         if self.ret_expr is not None:
             self.ret_expr = self.ret_expr.convert_meta_id(driver, local_dict)
 
+    def sub_exprs(self):
+        return [self.ret_expr] if self.ret_expr is not None else []
+
+    def map_sub_exprs(self, fn):
+        if self.ret_expr is not None:
+            self.ret_expr = fn(self.ret_expr)
+
 
 class PyBreak(PyStmt):
-    def to_string(self, indent, acc_indent):
-        return " "*acc_indent + "break\n"
+    def write(self, writer):
+        writer.begin_line()
+        writer.push("break")
+        writer.end_line()
+
+    def to_ast(self, counter):
+        return [ast.Break(lineno=counter.take(), col_offset=0)]
 
     def convert_meta_id(self, driver, local_dict):
         pass
 
 class PyContinue(PyStmt):
-    def to_string(self, indent, acc_indent):
-        return " "*acc_indent + "continue\n"
+    def write(self, writer):
+        writer.begin_line()
+        writer.push("continue")
+        writer.end_line()
+
+    def to_ast(self, counter):
+        return [ast.Continue(lineno=counter.take(), col_offset=0)]
 
     def convert_meta_id(self, driver, local_dict):
         pass
 
 class PyPass(PyStmt):
-    def to_string(self, indent, acc_indent):
-        return " "*acc_indent + "pass\n"
+    def write(self, writer):
+        writer.begin_line()
+        writer.push("pass")
+        writer.end_line()
+
+    def to_ast(self, counter):
+        return [ast.Pass(lineno=counter.take(), col_offset=0)]
 
     def convert_meta_id(self, driver, local_dict):
         pass
 
 class PyRaise(PyStmt):
     def __init__(self, to_be_throwed=None):
+        PyStmt.__init__(self)
         self.to_be_throwed = to_be_throwed 
 
-    def to_string(self, indent, acc_indent):
-        result = " "*acc_indent + "raise"
+    def write(self, writer):
+        writer.begin_line()
+        writer.push("raise")
         if self.to_be_throwed is not None:
-            result += " "
-            result += self.to_be_throwed.to_string()
-        result += "\n"
-        return result
+            writer.push(" ")
+            self.to_be_throwed.write(writer)
+        writer.end_line()
 
+    def to_ast(self, counter):
+        lineno = counter.take()
+        to_be_throwed = self.to_be_throwed.to_ast(counter) \
+                        if self.to_be_throwed is not None else None
+        return [ast.Raise(to_be_throwed, None, None, lineno=lineno, col_offset=0)]
 
     def convert_meta_id(self, driver, local_dict):
         if self.to_be_throwed is not None:
             self.to_be_throwed = self.to_be_throwed.convert_meta_id(driver, local_dict)
 
+    def sub_exprs(self):
+        return [self.to_be_throwed] if self.to_be_throwed is not None else []
+
+    def map_sub_exprs(self, fn):
+        if self.to_be_throwed is not None:
+            self.to_be_throwed = fn(self.to_be_throwed)
+
+
+class PyFrozenStmt(PyStmt):
+    '''
+    Statement whose meta ids are already converted, such as a definition
+    restored from TranslationCache. It is emitted as it is, except that
+    line_delta is added to lines of its tpy locations.
+    ref_ids are ids of outer names which the statement refers to.
+    '''
+    def __init__(self, stmt, line_delta=0, ref_ids=None):
+        PyStmt.__init__(self)
+        self.stmt = stmt
+        self.line_delta = line_delta
+        self.ref_ids = ref_ids or []
+
+    def write(self, writer):
+        self.stmt.write(writer)
+
+    def to_ast(self, counter):
+        counter.line_delta += self.line_delta
+        result = self.stmt.to_ast(counter)
+        counter.line_delta -= self.line_delta
+        return result
+
+    def convert_meta_id(self, driver, local_dict):
+        pass
+
+    def sub_exprs(self):
+        return [PyMetaID(_id) for _id in self.ref_ids]
+
 
 def meta_convert_stmt_list(stmt_list, driver, local_dict):
     for stmt in stmt_list:
@@ -306,20 +584,38 @@ def meta_convert_stmt_list(stmt_list, driver, local_dict):
 
 class PyForStmt(PyStmt):
     def __init__(self, elem_name, _in, stmt_list):
+        PyStmt.__init__(self)
 # elem_name can be either string or PyTupleExpr
         assert isinstance(elem_name, (str, PyMetaID, PyTupleExpr))
         self.elem_name = elem_name
         self._in = _in
         self.stmt_list = stmt_list
 
-    def to_string(self, indent, acc_indent):
+    def write(self, writer):
+        writer.begin_line()
+        writer.push("for ")
         if isinstance(self.elem_name, PyExpr):
-            elem_name = self.elem_name.to_string()
-        return " "*acc_indent + \
-               "for {0} in {1}:\n{2}"\
-                 .format(elem_name, 
-                         self._in.to_string(),
-                         stmt_list_to_string(self.stmt_list, indent, acc_indent))
+            self.elem_name.write(writer)
+        else:
+            writer.push(self.elem_name)
+        writer.push(" in ")
+        self._in.write(writer)
+        writer.push(":")
+        writer.end_line()
+        writer.write_block(self.stmt_list)
+
+    def to_ast(self, counter):
+        if isinstance(self.elem_name, PyExpr):
+            target = self.elem_name.to_ast(counter)
+        else:
+            target = ast.Name(self.elem_name, ast.Load())
+        lineno = counter.take()
+        return [ast.For(_ast_store(target),
+                        self._in.to_ast(counter),
+                        stmt_list_to_ast(self.stmt_list, counter, lineno),
+                        [],
+                        lineno=lineno,
+                        col_offset=0)]
 
     def convert_meta_id(self, driver, local_dict):
         if isinstance(self.elem_name, PyExpr):
@@ -327,24 +623,52 @@ class PyForStmt(PyStmt):
         self._in = self._in.convert_meta_id(driver, local_dict)
         meta_convert_stmt_list(self.stmt_list, driver, local_dict)
 
+    def sub_exprs(self):
+        return [self._in]
+
+    def map_sub_exprs(self, fn):
+        self._in = fn(self._in)
+
+    def sub_stmt_lists(self):
+        return [self.stmt_list]
+
 
 class PyWhileStmt(PyStmt):
     def __init__(self, cond_expr, stmt_list):
+        PyStmt.__init__(self)
         self.cond_expr = cond_expr
         self.stmt_list = stmt_list
 
 
-    def to_string(self, indent, acc_indent):
-        return " "*acc_indent + \
-               "while %s:\n%s"%(self.cond_expr.to_string(),
-                                stmt_list_to_string(self.stmt_list,
-                                                    indent,
-                                                    acc_indent))
+    def write(self, writer):
+        writer.begin_line()
+        writer.push("while ")
+        self.cond_expr.write(writer)
+        writer.push(":")
+        writer.end_line()
+        writer.write_block(self.stmt_list)
+
+    def to_ast(self, counter):
+        lineno = counter.take()
+        return [ast.While(self.cond_expr.to_ast(counter),
+                          stmt_list_to_ast(self.stmt_list, counter, lineno),
+                          [],
+                          lineno=lineno,
+                          col_offset=0)]
 
     def convert_meta_id(self, driver, local_dict):
         self.cond_expr = self.cond_expr.convert_meta_id(driver, local_dict)
         meta_convert_stmt_list(self.stmt_list, driver, local_dict)
 
+    def sub_exprs(self):
+        return [self.cond_expr]
+
+    def map_sub_exprs(self, fn):
+        self.cond_expr = fn(self.cond_expr)
+
+    def sub_stmt_lists(self):
+        return [self.stmt_list]
+
 
 class PyIfStmt(PyStmt):
     def __init__(self, if_pair, elif_pairs=None, else_stmt_list=None):
@@ -354,6 +678,7 @@ class PyIfStmt(PyStmt):
             elif_pairs: (expr, stmt list) list
             else_stmt_list: stmt list
         '''
+        PyStmt.__init__(self)
 
         self.if_pair = if_pair
         self.elif_pairs = elif_pairs or []
@@ -373,74 +698,132 @@ class PyIfStmt(PyStmt):
         self.elif_pairs = new_elif_pairs
         meta_convert_stmt_list(self.else_stmt_list, driver, local_dict)
 
-    def to_string(self, indent, acc_indent):
-        if_expr, if_stmt_list = self.if_pair
-
-        acc_str = " "*acc_indent + \
-                  "if %s:\n%s"%(if_expr.to_string(),
-                                stmt_list_to_string(if_stmt_list,
-                                                    indent,
-                                                    acc_indent))
-        if self.elif_pairs:
-            def elif_chunk(elif_expr, elif_expr_stmt_list):
-                res = " "*acc_indent + \
-                      "elif %s:\n%s"%(elif_expr.to_string(),
-                                      stmt_list_to_string(elif_expr_stmt_list,
-                                                          indent,
-                                                          acc_indent))
-                return res
-            acc_str += "".join([elif_chunk(l, r) for l, r in self.elif_pairs])
-        
+    def write(self, writer):
+        keyword = "if "
+        for cond_expr, stmt_list in [self.if_pair] + self.elif_pairs:
+            writer.begin_line()
+            writer.push(keyword)
+            cond_expr.write(writer)
+            writer.push(":")
+            writer.end_line()
+            writer.write_block(stmt_list)
+            keyword = "elif "
+
+        if self.else_stmt_list:
+            writer.begin_line()
+            writer.push("else:")
+            writer.end_line()
+            writer.write_block(self.else_stmt_list)
+
+    def to_ast(self, counter):
+        # elif clauses are nested if statements in orelse of the previous one
+        root = None
+        last = None
+        for cond_expr, stmt_list in [self.if_pair] + self.elif_pairs:
+            lineno = counter.take()
+            node = ast.If(cond_expr.to_ast(counter),
+                          stmt_list_to_ast(stmt_list, counter, lineno),
+                          [],
+                          lineno=lineno,
+                          col_offset=0)
+            if root is None:
+                root = node
+            else:
+                last.orelse = [node]
+            last = node
         if self.else_stmt_list:
-            acc_str += " "*acc_indent + \
-                    "else:\n%s"%stmt_list_to_string(self.else_stmt_list,
-                                                       indent,
-                                                       acc_indent)
-        return acc_str
+            lineno = counter.take()
+            last.orelse = stmt_list_to_ast(self.else_stmt_list, counter, lineno)
+        return [root]
+
+    def sub_exprs(self):
+        return [cond_expr for cond_expr, _ in [self.if_pair] + self.elif_pairs]
+
+    def map_sub_exprs(self, fn):
+        self.if_pair = (fn(self.if_pair[0]), self.if_pair[1])
+        self.elif_pairs = [(fn(cond_expr), stmt_list)
+                           for cond_expr, stmt_list in self.elif_pairs]
+
+    def sub_stmt_lists(self):
+        return [stmt_list for _, stmt_list in [self.if_pair] + self.elif_pairs] + \
+               [self.else_stmt_list]
 
 
 class PyImportStmt(PyStmt):
-    def __init__(self, name_or_name_list, alias):
+    def __init__(self, name_or_name_list, alias, pure=False):
+        '''
+        pure: True if importing the module is known to have no side effect
+        '''
+        PyStmt.__init__(self)
         self.name_or_name_list = name_or_name_list
         self.alias = alias # string or PyMetaID
+        self.pure = pure
 
-    def to_string(self, indent, acc_indent):
-        if isinstance(self.alias, PyMetaID):
-            alias_str = self.alias.to_string().name
-        elif isinstance(self.alias, basestring):
-            alias_str = self.alias
-        else:
-            alias_str = ""
-        if alias_str:
-            alias_str = " as " + alias_str
-        return " "*acc_indent + "import " + dotify(self.name_or_name_list) + alias_str + "\n"
+    def may_have_side_effect(self):
+        return not self.pure
+
+    def write(self, writer):
+        writer.begin_line()
+        writer.push("import ")
+        writer.push(dotify(self.name_or_name_list))
+        if self.alias:
+            writer.push(" as ")
+            writer.push(_name_to_string(self.alias))
+        writer.end_line()
+
+    def to_ast(self, counter):
+        asname = _ast_identifier(self.alias) if self.alias else None
+        return [ast.Import([ast.alias(dotify(self.name_or_name_list), asname)],
+                           lineno=counter.take(),
+                           col_offset=0)]
 
     def convert_meta_id(self, driver, local_dict):
         if isinstance(self.alias, PyMetaID):
             self.alias = self.alias.convert_meta_id(driver, local_dict).name
 
 class PyImportFromStmt(PyStmt):
-    def __init__(self, name_or_name_list, import_names):
+    def __init__(self, name_or_name_list, import_names, pure=False):
+        '''
+        pure: True if importing the module is known to have no side effect
+        '''
+        PyStmt.__init__(self)
         self.name_or_name_list = name_or_name_list
         self.import_names = import_names
+        self.pure = pure
 
-    def to_string(self, indent, acc_indent):
-        result = " "*acc_indent + \
-                 "from " + dotify(self.name_or_name_list) + \
-                 " import "
+    def may_have_side_effect(self):
+        return not self.pure
+
+    def write(self, writer):
+        writer.begin_line()
+        writer.push("from ")
+        writer.push(dotify(self.name_or_name_list))
+        writer.push(" import ")
+        first = True
+        for name_or_pair in self.import_names:
+            if not first:
+                writer.push(", ")
+            first = False
+            if isinstance(name_or_pair, tuple):
+                src, dest = name_or_pair
+                writer.push("%s as %s"%(src, _name_to_string(dest)))
+            else:
+                writer.push(name_or_pair)
+        writer.end_line()
 
-        addhoc = ""
+    def to_ast(self, counter):
+        aliases = []
         for name_or_pair in self.import_names:
-            if addhoc:
-                addhoc += ", "
             if isinstance(name_or_pair, tuple):
                 src, dest = name_or_pair
-                if isinstance(dest, PyMetaID):
-                    dest = dest.to_string().name
-                addhoc += "%s as %s"%(src, dest)
+                aliases.append(ast.alias(src, _ast_identifier(dest)))
             else:
-                addhoc += name_or_pair
-        return result + addhoc + "\n"
+                aliases.append(ast.alias(name_or_pair, None))
+        return [ast.ImportFrom(dotify(self.name_or_name_list),
+                               aliases,
+                               0,
+                               lineno=counter.take(),
+                               col_offset=0)]
 
     def convert_meta_id(self, driver, local_dict):
         new_ins = []
@@ -471,6 +854,7 @@ class PyAssignment(PyStmt):
     ASSIGN_ITEM = 2
 
     def __init__(self, _type, name, scope_expr, attr_name, item_expr, expr):
+        PyStmt.__init__(self)
         self._type = _type
         self.name = name # it can be either string or PyMetaID
         self.scope_expr = scope_expr
@@ -479,29 +863,45 @@ class PyAssignment(PyStmt):
         self.expr = expr
     
 
-    def to_string(self, indent, acc_indent):
+    def write(self, writer):
+        writer.begin_line()
         if self._type == PyAssignment.ASSIGN_NAME:
-            name_str = self.name.to_string() \
-                        if isinstance(self.name, PyExpr) else self.name
-            result = " "*acc_indent
-            result += "%s = %s\n"%(name_str, self.expr.to_string())
-            return result
+            writer.push(_name_to_string(self.name))
         elif self._type == PyAssignment.ASSIGN_ATTR:
-            virtual_parent = PyAttrAccess(self.scope_expr, self.name)
-            result = " "*acc_indent
-            result += "%s.%s = %s\n"%(expr_to_string(self.scope_expr, virtual_parent),
-                                      self.attr_name,
-                                      self.expr.to_string())
-            return result 
+            virtual_parent = PyAttrAccess(self.scope_expr, self.attr_name)
+            write_expr(writer, self.scope_expr, virtual_parent)
+            writer.push(".")
+            writer.push(self.attr_name)
         elif self._type == PyAssignment.ASSIGN_ITEM:
             virtual_parent = PyItemAccess(self.scope_expr, self.item_expr)
-            result = " "*acc_indent
-            result += "%s[%s] = %s\n"%(expr_to_string(self.scope_expr, virtual_parent),
-                                     self.item_expr.to_string(),
-                                     self.expr.to_string())
-            return result
+            write_expr(writer, self.scope_expr, virtual_parent)
+            writer.push("[")
+            self.item_expr.write(writer)
+            writer.push("]")
+        else:
+            raise Exception("NOT REACHABLE")
+        writer.push(" = ")
+        self.expr.write(writer)
+        writer.end_line()
+
+    def to_ast(self, counter):
+        lineno = counter.take()
+        if self._type == PyAssignment.ASSIGN_NAME:
+            target = ast.Name(_ast_identifier(self.name), ast.Store())
+        elif self._type == PyAssignment.ASSIGN_ATTR:
+            target = ast.Attribute(self.scope_expr.to_ast(counter),
+                                   self.attr_name,
+                                   ast.Store())
+        elif self._type == PyAssignment.ASSIGN_ITEM:
+            target = ast.Subscript(self.scope_expr.to_ast(counter),
+                                   ast.Index(self.item_expr.to_ast(counter)),
+                                   ast.Store())
         else:
             raise Exception("NOT REACHABLE")
+        return [ast.Assign([target],
+                           self.expr.to_ast(counter),
+                           lineno=lineno,
+                           col_offset=0)]
 
     def convert_meta_id(self, driver, local_dict):
         if self._type == PyAssignment.ASSIGN_NAME:
@@ -521,18 +921,48 @@ class PyAssignment(PyStmt):
 
         self.expr = self.expr.convert_meta_id(driver, local_dict)
 
+    def sub_exprs(self):
+        if self._type == PyAssignment.ASSIGN_NAME:
+            return [self.expr]
+        elif self._type == PyAssignment.ASSIGN_ATTR:
+            return [self.scope_expr, self.expr]
+        elif self._type == PyAssignment.ASSIGN_ITEM:
+            return [self.scope_expr, self.item_expr, self.expr]
+        else:
+            raise Exception("NOT REACHABLE")
+
+    def map_sub_exprs(self, fn):
+        if self.scope_expr is not None:
+            self.scope_expr = fn(self.scope_expr)
+        if self.item_expr is not None:
+            self.item_expr = fn(self.item_expr)
+        self.expr = fn(self.expr)
+
 
 class PyExprStmt(PyStmt):
     def __init__(self, expr):
+        PyStmt.__init__(self)
         assert isinstance(expr, PyExpr)
         self.expr = expr
 
-    def to_string(self, indent, acc_indent):
-        return " "*acc_indent + self.expr.to_string() + "\n"
+    def write(self, writer):
+        writer.begin_line()
+        self.expr.write(writer)
+        writer.end_line()
+
+    def to_ast(self, counter):
+        lineno = counter.take()
+        return [ast.Expr(self.expr.to_ast(counter), lineno=lineno, col_offset=0)]
 
     def convert_meta_id(self, driver, local_dict):
         self.expr = self.expr.convert_meta_id(driver, local_dict)
 
+    def sub_exprs(self):
+        return [self.expr]
+
+    def map_sub_exprs(self, fn):
+        self.expr = fn(self.expr)
+
 
 class PyExpr:
     def get_expr_pred(self):
@@ -558,12 +988,52 @@ class PyExpr:
         # conservative condition
         return True
 
+    def write(self, writer):
+        raise NotImplementedError
+
     def to_string(self):
+        writer = PyCodeWriter()
+        self.write(writer)
+        return writer.getvalue()
+
+    def to_ast(self, counter):
+        '''
+        Subexpressions are lowered in the order they are written, so that
+        an expression written across lines takes lines from counter as
+        PyCodeWriter does.
+
+        Returns -
+            python ast expr
+        '''
         raise NotImplementedError
 
     def convert_meta_id(self, driver, local_dict):
         raise NotImplementedError
 
+    def sub_exprs(self):
+        '''
+        Returns -
+            PyExpr list of direct subexpressions, in order of evaluation
+        '''
+        return []
+
+    def map_sub_exprs(self, fn):
+        '''
+        Returns -
+            expression of the same form whose sub expressions are replaced
+            with fn(sub expression)
+        '''
+        raise NotImplementedError
+
+    def substitute(self, mapping):
+        '''
+        Returns -
+            expression in which meta ids in mapping(id -> PyExpr) are replaced.
+            An attribute of a meta id is replaced if mapping has
+            (id, attribute name) as a key.
+        '''
+        return self.map_sub_exprs(lambda expr: expr.substitute(mapping))
+
 class PyDataReprExpr(PyExpr):
     def get_expr_pred(self):
         return 1
@@ -576,18 +1046,26 @@ class PyTupleExpr(PyDataReprExpr):
     def may_have_side_effect(self):
         return any((expr.may_have_side_effect() for expr in self.exprs))
 
-    def to_string(self):
+    def write(self, writer):
+        writer.push("(")
+        write_joined(writer, self.exprs)
         if len(self.exprs) == 1:
-            return "(" + self.exprs[0].to_string() + ", )"
-        else:
-            return "(" + \
-                   ", ".join([expr.to_string() for expr in self.exprs]) + \
-                   ")"
+            writer.push(", ")
+        writer.push(")")
+
+    def to_ast(self, counter):
+        return ast.Tuple([expr.to_ast(counter) for expr in self.exprs], ast.Load())
 
     def convert_meta_id(self, driver, local_dict):
         return PyTupleExpr([elem.convert_meta_id(driver, local_dict)
                             for elem in self.exprs])
 
+    def sub_exprs(self):
+        return self.exprs
+
+    def map_sub_exprs(self, fn):
+        return PyTupleExpr([fn(elem) for elem in self.exprs])
+
 class PyListExpr(PyDataReprExpr):
     def __init__(self, exprs):
         self.exprs = exprs
@@ -595,15 +1073,24 @@ class PyListExpr(PyDataReprExpr):
     def may_have_side_effect(self):
         return any((expr.may_have_side_effect() for expr in self.exprs))
 
-    def to_string(self):
-        return "[" + \
-               ", ".join([expr.to_string() for expr in self.exprs]) + \
-               "]"
+    def write(self, writer):
+        writer.push("[")
+        write_joined(writer, self.exprs)
+        writer.push("]")
+
+    def to_ast(self, counter):
+        return ast.List([expr.to_ast(counter) for expr in self.exprs], ast.Load())
 
     def convert_meta_id(self, driver, local_dict):
         return PyListExpr([elem.convert_meta_id(driver, local_dict)
                            for elem in self.exprs])
 
+    def sub_exprs(self):
+        return self.exprs
+
+    def map_sub_exprs(self, fn):
+        return PyListExpr([fn(elem) for elem in self.exprs])
+
 
 class PyDictExpr(PyDataReprExpr):
     def __init__(self, expr_dict):
@@ -613,11 +1100,25 @@ class PyDictExpr(PyDataReprExpr):
         return any((k.may_have_side_effect() or v.may_have_side_effect()
                     for k, v in self.expr_dict.items()))
 
-    def to_string(self):
-        return "{" + \
-               ", ".join(("%s: %s"%(k.to_string(), v.to_string())
-                         for k, v in self.expr_dict.items())) + \
-               "}"
+    def write(self, writer):
+        writer.push("{")
+        first = True
+        for k, v in self.expr_dict.items():
+            if not first:
+                writer.push(", ")
+            first = False
+            k.write(writer)
+            writer.push(": ")
+            v.write(writer)
+        writer.push("}")
+
+    def to_ast(self, counter):
+        keys = []
+        values = []
+        for k, v in self.expr_dict.items():
+            keys.append(k.to_ast(counter))
+            values.append(v.to_ast(counter))
+        return ast.Dict(keys, values)
 
     def convert_meta_id(self, driver, local_dict):
         return PyDictExpr(
@@ -625,6 +1126,14 @@ class PyDictExpr(PyDataReprExpr):
                        v.convert_meta_id(driver, local_dict))
                       for k, v in self.expr_dict.items()]))
 
+    def sub_exprs(self):
+        # python 2 evaluates the value of an item before its key
+        return [expr for k, v in self.expr_dict.items() for expr in (v, k)]
+
+    def map_sub_exprs(self, fn):
+        return PyDictExpr(dict([(fn(k), fn(v))
+                                for k, v in self.expr_dict.items()]))
+
 
 class PyOperatorExpr(PyExpr):
     # @implement PyExpr
@@ -641,14 +1150,21 @@ class PyOperatorExpr(PyExpr):
             # coerce
             return PyExpr.should_put_par(self, under)
 
-def put_par(s): return "(" + s + ")"
-def expr_to_string(expr, parent=None):
-    if parent is None:
-        return expr.to_string()
-    elif parent.should_put_par(expr):
-        return put_par(expr.to_string())
+def write_expr(writer, expr, parent=None):
+    if parent is not None and parent.should_put_par(expr):
+        writer.push("(")
+        expr.write(writer)
+        writer.push(")")
     else:
-        return expr.to_string()
+        expr.write(writer)
+
+def write_joined(writer, exprs):
+    first = True
+    for expr in exprs:
+        if not first:
+            writer.push(", ")
+        first = False
+        expr.write(writer)
 
 
 BINOP_PRED = {
@@ -672,6 +1188,32 @@ UNOP_PRED = {
     "not": 10
 }
 
+_AST_BINOP = {
+    "**": ast.Pow,
+    "*": ast.Mult, "/": ast.Div, "%": ast.Mod, "//": ast.FloorDiv,
+    "+": ast.Add, "-": ast.Sub,
+    ">>": ast.RShift, "<<": ast.LShift,
+    "&": ast.BitAnd,
+    "^": ast.BitXor,
+    "|": ast.BitOr,
+}
+
+_AST_CMPOP = {
+    "<=": ast.LtE, "<": ast.Lt, ">": ast.Gt, ">=": ast.GtE,
+    "<>": ast.NotEq, "==": ast.Eq, "!=": ast.NotEq,
+    "is": ast.Is, "is not": ast.IsNot, "in": ast.In, "not in": ast.NotIn
+}
+
+_AST_BOOLOP = {
+    "and": ast.And,
+    "or": ast.Or
+}
+
+_AST_UNOP = {
+    "+": ast.UAdd, "-": ast.USub, "~": ast.Invert,
+    "not": ast.Not
+}
+
 
 class PyBinop(PyOperatorExpr):
     '''
@@ -700,26 +1242,55 @@ class PyBinop(PyOperatorExpr):
                self.rhs.may_have_side_effect()
 
     def should_put_par(self, under):
-        if self.op in BINOP_PRED and \
-           isinstance(self.rhs, PyBinop) and \
-           self.rhs.op == self.op:
-            return False
-        elif isinstance(self.lhs, PyBinop) and self.lhs.op == self.op:
-            return False
+        # operators of the same precedence need no parenthesis on the side
+        # they associate to. Comparisons on the left are chained by python,
+        # the same as to_ast does
+        if isinstance(under, PyBinop) and \
+           under.operator_pred() == self.operator_pred():
+            if under is self.lhs:
+                return self.op in BINOP_RIGHT_ASSOC
+            elif under is self.rhs:
+                return self.op not in BINOP_RIGHT_ASSOC
+        # coerce
+        return PyOperatorExpr.should_put_par(self, under)
+
+    def write(self, writer):
+        write_expr(writer, self.lhs, self)
+        writer.push(" " + self.op + " ")
+        write_expr(writer, self.rhs, self)
+
+    def to_ast(self, counter):
+        if self.op in _AST_CMPOP:
+            # a < b < c comes as (a < b) < c, which is written without
+            # parenthesis(see should_put_par) and chained by python
+            chain = [self]
+            while isinstance(chain[-1].lhs, PyBinop) and chain[-1].lhs.op in _AST_CMPOP:
+                chain.append(chain[-1].lhs)
+            chain.reverse()
+            left = chain[0].lhs.to_ast(counter)
+            return ast.Compare(left,
+                               [_AST_CMPOP[binop.op]() for binop in chain],
+                               [binop.rhs.to_ast(counter) for binop in chain])
+        lhs = self.lhs.to_ast(counter)
+        rhs = self.rhs.to_ast(counter)
+        if self.op in _AST_BOOLOP:
+            return ast.BoolOp(_AST_BOOLOP[self.op](), [lhs, rhs])
         else:
-            # coerce
-            return PyOperatorExpr.should_put_par(self, under)
-
-    def to_string(self):
-        return expr_to_string(self.lhs, self) + \
-               " " + self.op + " " + \
-               expr_to_string(self.rhs, self)
+            return ast.BinOp(lhs, _AST_BINOP[self.op](), rhs)
 
     def convert_meta_id(self, driver, local_dict):
         return PyBinop(self.op,
                        self.lhs.convert_meta_id(driver, local_dict),
                        self.rhs.convert_meta_id(driver, local_dict))
 
+    def sub_exprs(self):
+        return [self.lhs, self.rhs]
+
+    def map_sub_exprs(self, fn):
+        return PyBinop(self.op,
+                       fn(self.lhs),
+                       fn(self.rhs))
+
 
 class PyUnop(PyOperatorExpr):
     '''
@@ -739,20 +1310,31 @@ class PyUnop(PyOperatorExpr):
 
     def should_put_par(self, under):
         if isinstance(under, PyUnop) and \
-           self.operator_pred() == self.operator_pred():
+           under.operator_pred() == self.operator_pred():
             return False
         else:
             # coerce
             return PyOperatorExpr.should_put_par(self, under)
 
-    def to_string(self):
-        space = " " if self.op == "not" else ""
-        return self.op + space + expr_to_string(self.param, self)
+    def write(self, writer):
+        writer.push(self.op)
+        if self.op == "not":
+            writer.push(" ")
+        write_expr(writer, self.param, self)
+
+    def to_ast(self, counter):
+        return ast.UnaryOp(_AST_UNOP[self.op](), self.param.to_ast(counter))
 
 
     def convert_meta_id(self, driver, local_dict):
         return PyUnop(self.op, self.param.convert_meta_id(driver, local_dict))
 
+    def sub_exprs(self):
+        return [self.param]
+
+    def map_sub_exprs(self, fn):
+        return PyUnop(self.op, fn(self.param))
+
 
 class PyItemAccess(PyExpr):
     # @implement PyExpr
@@ -766,34 +1348,71 @@ class PyItemAccess(PyExpr):
     def may_have_side_effect(self):
         return True
 
-    def to_string(self):
-        return "%s[%s]"%(expr_to_string(self.scope_expr, self),
-                         self.item_expr.to_string())
+    def write(self, writer):
+        write_expr(writer, self.scope_expr, self)
+        writer.push("[")
+        self.item_expr.write(writer)
+        writer.push("]")
+
+    def to_ast(self, counter):
+        return ast.Subscript(self.scope_expr.to_ast(counter),
+                             ast.Index(self.item_expr.to_ast(counter)),
+                             ast.Load())
 
     def convert_meta_id(self, driver, local_dict):
         return PyItemAccess(self.scope_expr.convert_meta_id(driver, local_dict),
                             self.item_expr.convert_meta_id(driver, local_dict))
 
+    def sub_exprs(self):
+        return [self.scope_expr, self.item_expr]
+
+    def map_sub_exprs(self, fn):
+        return PyItemAccess(fn(self.scope_expr),
+                            fn(self.item_expr))
+
 class PyAttrAccess(PyExpr):
     # @implement PyExpr
     def get_expr_pred(self):
         return 2
 
-    def __init__(self, scope_expr, attr_name):
+    def __init__(self, scope_expr, attr_name, pure=False):
+        '''
+        pure: True if getting the attribute is known to have no side effect
+        '''
         assert isinstance(scope_expr, PyExpr)
         self.scope_expr = scope_expr
         self.attr_name = attr_name
+        self.pure = pure
 
     def may_have_side_effect(self):
-        return True
+        return not self.pure or self.scope_expr.may_have_side_effect()
 
-    def to_string(self):
-        return "%s.%s"%(expr_to_string(self.scope_expr, self),
-                        self.attr_name)
+    def write(self, writer):
+        write_expr(writer, self.scope_expr, self)
+        writer.push(".")
+        writer.push(self.attr_name)
+
+    def to_ast(self, counter):
+        return ast.Attribute(self.scope_expr.to_ast(counter), self.attr_name, ast.Load())
 
     def convert_meta_id(self, driver, local_dict):
         return PyAttrAccess(self.scope_expr.convert_meta_id(driver, local_dict),
-                            self.attr_name)
+                            self.attr_name,
+                            self.pure)
+
+    def sub_exprs(self):
+        return [self.scope_expr]
+
+    def substitute(self, mapping):
+        if isinstance(self.scope_expr, PyMetaID) and \
+           (self.scope_expr._id, self.attr_name) in mapping:
+            return mapping[(self.scope_expr._id, self.attr_name)]
+        return PyExpr.substitute(self, mapping)
+
+    def map_sub_exprs(self, fn):
+        return PyAttrAccess(fn(self.scope_expr),
+                            self.attr_name,
+                            self.pure)
 
 class PyArraySlice(PyExpr):
     # @implement PyExpr
@@ -808,12 +1427,22 @@ class PyArraySlice(PyExpr):
     def may_have_side_effect(self):
         return True
 
-    def to_string(self):
-        lslice_str = self.left_slice.to_string() if self.left_slice else ""
-        rslice_str = self.right_slice.to_string() if self.right_slice else ""
-        return "%s[%s:%s]"%(expr_to_string(self.scope_expr, self),
-                            lslice_str,
-                            rslice_str)
+    def write(self, writer):
+        write_expr(writer, self.scope_expr, self)
+        writer.push("[")
+        if self.left_slice:
+            self.left_slice.write(writer)
+        writer.push(":")
+        if self.right_slice:
+            self.right_slice.write(writer)
+        writer.push("]")
+
+    def to_ast(self, counter):
+        lslice = self.left_slice.to_ast(counter) if self.left_slice else None
+        rslice = self.right_slice.to_ast(counter) if self.right_slice else None
+        return ast.Subscript(self.scope_expr.to_ast(counter),
+                             ast.Slice(lslice, rslice, None),
+                             ast.Load())
 
     def convert_meta_id(self, driver, local_dict):
         new_lslice = self.left_slice.convert_meta_id(driver, local_dict) \
@@ -824,6 +1453,15 @@ class PyArraySlice(PyExpr):
                             new_lslice,
                             new_rslice)
 
+    def sub_exprs(self):
+        return [expr for expr in (self.scope_expr, self.left_slice, self.right_slice)
+                if expr]
+
+    def map_sub_exprs(self, fn):
+        return PyArraySlice(fn(self.scope_expr),
+                            fn(self.left_slice) if self.left_slice else None,
+                            fn(self.right_slice) if self.right_slice else None)
+
 class PyCall(PyExpr):
     # @implement PyExpr
     def get_expr_pred(self):
@@ -847,17 +1485,38 @@ class PyCall(PyExpr):
         return True
 
 
-    def to_string(self):
-        arglst = [x.to_string() for x in self.arg_exprs] + \
-                 [keyword + "=" + x.to_string() for keyword, x in self.kw_exprs]
-        
-        if self.star_expr is not None:
-            arglst.append("*" + self.star_expr.to_string())
-        if self.dstar_expr is not None:
-            arglst.append("**" + self.dstar_expr.to_string())
-
-        return "%s(%s)"%(expr_to_string(self.callee_expr, self),
-                         ", ".join(arglst))
+    def write(self, writer):
+        write_expr(writer, self.callee_expr, self)
+        writer.push("(")
+        first = True
+        for x in self.arg_exprs:
+            if not first:
+                writer.push(", ")
+            first = False
+            x.write(writer)
+        for keyword, x in self.kw_exprs:
+            if not first:
+                writer.push(", ")
+            first = False
+            writer.push(keyword)
+            writer.push("=")
+            x.write(writer)
+        for prefix, x in (("*", self.star_expr), ("**", self.dstar_expr)):
+            if x is not None:
+                if not first:
+                    writer.push(", ")
+                first = False
+                writer.push(prefix)
+                x.write(writer)
+        writer.push(")")
+
+    def to_ast(self, counter):
+        return ast.Call(self.callee_expr.to_ast(counter),
+                        [x.to_ast(counter) for x in self.arg_exprs],
+                        [ast.keyword(_ast_identifier(keyword), x.to_ast(counter))
+                         for keyword, x in self.kw_exprs],
+                        self.star_expr.to_ast(counter) if self.star_expr is not None else None,
+                        self.dstar_expr.to_ast(counter) if self.dstar_expr is not None else None)
 
     def convert_meta_id(self, driver, local_dict):
         callee_expr = self.callee_expr.convert_meta_id(driver, local_dict)
@@ -877,6 +1536,19 @@ class PyCall(PyExpr):
                       star_expr,
                       dstar_expr)
 
+    def sub_exprs(self):
+        return [self.callee_expr] + \
+               self.arg_exprs + \
+               [x for _, x in self.kw_exprs] + \
+               [x for x in (self.star_expr, self.dstar_expr) if x is not None]
+
+    def map_sub_exprs(self, fn):
+        return PyCall(fn(self.callee_expr),
+                      [fn(x) for x in self.arg_exprs],
+                      [(keyword, fn(x)) for keyword, x in self.kw_exprs],
+                      fn(self.star_expr) if self.star_expr else None,
+                      fn(self.dstar_expr) if self.dstar_expr else None)
+
 
 
 class PyLiteral(PyExpr):
@@ -890,15 +1562,29 @@ class PyLiteral(PyExpr):
     def may_have_side_effect(self):
         return False
 
-    def to_string(self):
+    def write(self, writer):
         # Because we use python to compile sth and its target file is python itself, literal is just python object
         # and just to repr it is sufficient to represent all literals(list, dict, string and so on) in target python source 
         # Funny!
-        return repr(self.literal)
+        writer.push(repr(self.literal))
+
+    def to_ast(self, counter):
+        literal = self.literal
+        if literal is None or isinstance(literal, bool):
+            return ast.Name(repr(literal), ast.Load())
+        elif isinstance(literal, basestring):
+            return ast.Str(literal)
+        elif isinstance(literal, (int, long, float)) and literal >= 0:
+            return ast.Num(literal)
+        else:
+            return ast.parse(repr(literal), mode="eval").body
 
     def convert_meta_id(self, driver, local_dict):
         return self
 
+    def map_sub_exprs(self, fn):
+        return self
+
 
 class PyMetaID(PyExpr):
     # @implement PyExpr
@@ -911,12 +1597,21 @@ class PyMetaID(PyExpr):
     def may_have_side_effect(self):
         return False
 
-    def to_string(self):
-        return "__meta_id{0}__".format(self._id)
+    def write(self, writer):
+        writer.push("__meta_id{0}__".format(self._id))
+
+    def to_ast(self, counter):
+        return ast.Name(self.to_string(), ast.Load())
 
     def convert_meta_id(self, driver, local_dict):
         return PyName(driver(self._id, local_dict))
 
+    def map_sub_exprs(self, fn):
+        return self
+
+    def substitute(self, mapping):
+        return mapping.get(self._id, self)
+
 
 class PyName(PyExpr):
     # @implement PyExpr
@@ -929,12 +1624,199 @@ class PyName(PyExpr):
     def may_have_side_effect(self):
         return False
         
-    def to_string(self):
-        return self.name
+    def write(self, writer):
+        writer.push(self.name)
+
+    def to_ast(self, counter):
+        return ast.Name(_ast_identifier(self.name), ast.Load())
 
     def convert_meta_id(self, driver, local_dict):
         return self
 
+    def map_sub_exprs(self, fn):
+        return self
+
+
+class PyIfElseExpr(PyExpr):
+    def get_expr_pred(self):
+        return 4
+
+    def __init__(self, cond_expr, then_expr, else_expr):
+        self.cond_expr = cond_expr
+        self.then_expr = then_expr
+        self.else_expr = else_expr
+
+    def may_have_side_effect(self):
+        return self.cond_expr.may_have_side_effect() or \
+               self.then_expr.may_have_side_effect() or \
+               self.else_expr.may_have_side_effect()
+
+    def write(self, writer):
+        write_expr(writer, self.then_expr, self)
+        writer.push(" if ")
+        write_expr(writer, self.cond_expr, self)
+        writer.push(" else ")
+        write_expr(writer, self.else_expr, self)
+
+    def to_ast(self, counter):
+        then_expr = self.then_expr.to_ast(counter)
+        cond_expr = self.cond_expr.to_ast(counter)
+        return ast.IfExp(cond_expr, then_expr, self.else_expr.to_ast(counter))
+
+    def convert_meta_id(self, driver, local_dict):
+        return PyIfElseExpr(self.cond_expr.convert_meta_id(driver, local_dict),
+                            self.then_expr.convert_meta_id(driver, local_dict),
+                            self.else_expr.convert_meta_id(driver, local_dict))
+
+    def sub_exprs(self):
+        return [self.cond_expr, self.then_expr, self.else_expr]
+
+    def map_sub_exprs(self, fn):
+        return PyIfElseExpr(fn(self.cond_expr),
+                            fn(self.then_expr),
+                            fn(self.else_expr))
+
+
+class PyListComprehension(PyExpr):
+    '''
+    [elt for target in iter_expr] if there is one element, or
+    [item for target in iter_expr for item in (elt1, elt2, ...)]
+
+    If locations of elements are given, each element is put on a line of
+    its own, so that the line table maps it to its tpy location. A single
+    element is followed by `for target in iter_expr` on the next line.
+    iter_expr is evaluated before the element, and line numbers of a code
+    object never decrease, so the code of both is on the line of iter_expr,
+    which the line table maps to the element as well.
+    '''
+    def get_expr_pred(self):
+        return 1
+
+    def __init__(self, target, iter_expr, elt_exprs, item_name=None, elt_srclocs=None):
+        '''
+        Arguments -
+            target: PyMetaID | PyTupleExpr
+            item_name: None | PyMetaID | string, required unless needs_item_name
+                       returns False
+            elt_srclocs: None | (None | locinfo) list
+        '''
+        self.target = target
+        self.iter_expr = iter_expr
+        self.elt_exprs = elt_exprs
+        self.item_name = item_name
+        self.elt_srclocs = elt_srclocs or [None] * len(elt_exprs)
+        assert item_name is not None or not self.needs_item_name(elt_exprs, self.elt_srclocs)
+
+    @staticmethod
+    def needs_item_name(elt_exprs, elt_srclocs):
+        return len(elt_exprs) > 1
+
+    def may_have_side_effect(self):
+        return True
+
+    def is_multi_line(self):
+        return any(srcloc is not None for srcloc in self.elt_srclocs)
+
+    def write(self, writer):
+        multi_line = self.is_multi_line()
+        single = self.item_name is None
+
+        def write_elt_line(expr, last):
+            if multi_line:
+                writer.end_line()
+                writer.begin_line()
+            expr.write(writer)
+            if not last:
+                writer.push(",")
+                if not multi_line:
+                    writer.push(" ")
+
+        writer.push("[")
+        writer.acc_indent += writer.indent
+        if single:
+            write_elt_line(self.elt_exprs[0], True)
+            if multi_line:
+                writer.end_line()
+                writer.begin_line()
+            else:
+                writer.push(" ")
+        else:
+            writer.push(_name_to_string(self.item_name))
+            writer.push(" ")
+        writer.push("for ")
+        self.target.write(writer)
+        writer.push(" in ")
+        self.iter_expr.write(writer)
+        if not single:
+            writer.push(" for ")
+            writer.push(_name_to_string(self.item_name))
+            writer.push(" in (")
+            for idx, expr in enumerate(self.elt_exprs):
+                write_elt_line(expr, idx == len(self.elt_exprs) - 1)
+            if len(self.elt_exprs) == 1:
+                writer.push(",")
+            writer.push(")")
+        writer.acc_indent -= writer.indent
+        writer.push("]")
+
+    def to_ast(self, counter):
+        multi_line = self.is_multi_line()
+
+        def elt_to_ast(expr, srcloc):
+            if not multi_line:
+                return expr.to_ast(counter)
+            counter.mark(srcloc)
+            lineno = counter.take()
+            node = expr.to_ast(counter)
+            node.lineno = lineno
+            node.col_offset = 0
+            return node
+
+        target = _ast_store(self.target.to_ast(counter))
+        if self.item_name is None:
+            elt = elt_to_ast(self.elt_exprs[0], self.elt_srclocs[0])
+            if multi_line:
+                lineno = counter.take()
+                target.lineno = lineno
+                target.col_offset = 0
+            iter_expr = self.iter_expr.to_ast(counter)
+            if multi_line:
+                iter_expr.lineno = lineno
+                iter_expr.col_offset = 0
+            generators = [ast.comprehension(target, iter_expr, [])]
+        else:
+            iter_expr = self.iter_expr.to_ast(counter)
+            elts = [elt_to_ast(expr, srcloc)
+                    for expr, srcloc in zip(self.elt_exprs, self.elt_srclocs)]
+            item_id = _ast_identifier(self.item_name)
+            elt = ast.Name(item_id, ast.Load())
+            generators = [ast.comprehension(target, iter_expr, []),
+                          ast.comprehension(ast.Name(item_id, ast.Store()),
+                                            ast.Tuple(elts, ast.Load()),
+                                            [])]
+        return ast.ListComp(elt, generators)
+
+    def convert_meta_id(self, driver, local_dict):
+        item_name = self.item_name
+        if isinstance(item_name, PyMetaID):
+            item_name = item_name.convert_meta_id(driver, local_dict).name
+        return PyListComprehension(self.target.convert_meta_id(driver, local_dict),
+                                   self.iter_expr.convert_meta_id(driver, local_dict),
+                                   [expr.convert_meta_id(driver, local_dict)
+                                    for expr in self.elt_exprs],
+                                   item_name,
+                                   self.elt_srclocs)
+
+    def sub_exprs(self):
+        return [self.iter_expr] + self.elt_exprs
+
+    def map_sub_exprs(self, fn):
+        return PyListComprehension(self.target,
+                                   fn(self.iter_expr),
+                                   [fn(expr) for expr in self.elt_exprs],
+                                   self.item_name,
+                                   self.elt_srclocs)
+
 
 class PyLambda(PyExpr):
     def get_expr_pred(self):
@@ -990,28 +1872,31 @@ class PyLambda(PyExpr):
                         dstar,
                         self.docstring)
 
-    def to_string(self):
-        arglst = [(pos_arg.to_string() if isinstance(pos_arg, PyMetaID) else pos_arg)
-                  for pos_arg in self.pos_args]
-        for keyword, arg_expr in self.kwd_args:
-            if isinstance(keyword, PyMetaID):
-                keyword = keyword.to_string()
-            arglst.append(keyword + "=" + arg_expr.to_string())
-        
-        if self.star is not None:
-            star = self.star
-            if isinstance(star, PyMetaID):
-                star = star.to_string()
-            arglst.append("*" + star)
-        if self.dstar is not None:
-            dstar = self.dstar
-            if isinstance(dstar, PyMetaID):
-                dstar = dstar.to_string()
-            arglst.append("**" + dstar)
-
-        return "lambda {0}: {1}" \
-               .format(", ".join(arglst),
-                       self.expr.to_string())
+    def write(self, writer):
+        writer.push("lambda ")
+        write_arguments(writer, self.pos_args, self.kwd_args, self.star, self.dstar)
+        writer.push(": ")
+        self.expr.write(writer)
+
+    def to_ast(self, counter):
+        return ast.Lambda(_ast_arguments(self.pos_args,
+                                         self.kwd_args,
+                                         self.star,
+                                         self.dstar,
+                                         counter),
+                          self.expr.to_ast(counter))
+
+    def sub_exprs(self):
+        return [kexpr for _, kexpr in self.kwd_args] + [self.expr]
+
+    def map_sub_exprs(self, fn):
+        return PyLambda(self.pos_args,
+                        [(keyword, fn(kexpr))
+                         for keyword, kexpr in self.kwd_args],
+                        fn(self.expr),
+                        self.star,
+                        self.dstar,
+                        self.docstring)
 
 '''
 Translation
@@ -1073,10 +1958,15 @@ Compiling Environments
 Config Value
 ---
 # config is global premise
-  * emit_line_info(li)
+  * emit_line_info(li): stamp tpy locations on statements to build the line table
   * source code comment verbosity(v): Always True in this revision
   * expression_lifting_style (el): 'stack' | 'ssa' | 'stack_only_name' | 'stack_call_2' Always 'stack' in this revision
   * remove name in the end of 'let' (letdel)
+  * optimization_level: 0 to emit code as it is translated, 1 to run passes of optimize.py
+    Temporaries are inlined across lines of tpy source only if emit_line_info is off,
+    so that tracebacks keep pointing at the lines where errors occur.
+  * passes: None for optimize.DEFAULT_PASSES | OptimizationPass list, see register_pass
+  * pass_report_file: None | file to which time and node count of each pass are written
 
 Premise Values (don't expect side-effect)
 --
@@ -1197,25 +2087,61 @@ class EnvFrame:
     def __init__(self, frame_type):
         assert frame_type in ["def", "toplevel", "let", "lambda"]
         self.frame_type = frame_type # "def" | "toplevel" | "let" | "lambda"
+        self.namemap = {} # name -> id, names bound in this frame
 
 
 class Config:
-    def __init__(self, emit_line_info=True, expression_lifting_style="stack", letdel=False, max_error_cnt=20, indent=4):
+    def __init__(self, emit_line_info=True, expression_lifting_style="stack", letdel=False, max_error_cnt=20, indent=4, optimization_level=1,
+                 passes=None, pass_report_file=None):
         self.emit_line_info = emit_line_info
         self.expression_lifting_style = expression_lifting_style
         self.letdel = letdel
         self.max_error_cnt = max_error_cnt
         self.indent = indent
+        self.optimization_level = optimization_level
+        self.passes = None
+        self.pass_report_file = pass_report_file
+        if passes is not None:
+            self.passes = []
+            for opt_pass in passes:
+                self.register_pass(opt_pass)
+
+    def register_pass(self, opt_pass, after=None):
+        '''
+        Run opt_pass(optimize.OptimizationPass) after the pass named after,
+        or after all passes if after is None. Names of passes should be unique,
+        as translations are cached by them.
+        '''
+        if self.passes is None:
+            from optimize import DEFAULT_PASSES
+            self.passes = list(DEFAULT_PASSES)
+        if any(registered.name == opt_pass.name for registered in self.passes):
+            raise ValueError("Pass named %s is already registered"%opt_pass.name)
+        if after is None:
+            self.passes.append(opt_pass)
+            return
+        for idx, registered in enumerate(self.passes):
+            if registered.name == after:
+                self.passes.insert(idx + 1, opt_pass)
+                return
+        raise ValueError("No pass named %s"%after)
 
 class CompEnv:
     def __init__(self):
         '''
         
         Fields -
-            local_env: None | LinkedDict
+            local_env: EnvFrame, the innermost frame
+            frames: EnvFrame list, from the outermost frame to the innermost one
+            bindings: dict of name to id list, ids bound to the name
+                      in frames from the outermost to the innermost
+        Every lookup of a local name is a dict access on bindings,
+        regardless of how deep frames are nested.
         '''
         self.global_env = {} # name -> id
-        self.local_env = LinkedDict(EnvFrame("toplevel")) # LinkedDict
+        self.local_env = EnvFrame("toplevel")
+        self.frames = [self.local_env]
+        self.bindings = {}
         self.id_info_dict = {}
         self.available_id = 0
 
@@ -1236,7 +2162,12 @@ class CompEnv:
 
     def add_local(self, name, id_info):
         _id = self.issue_id(id_info)
-        self.local_env.set_shallow(name, _id)
+        namemap = self.local_env.namemap
+        if name in namemap:
+            self.bindings[name][-1] = _id
+        else:
+            self.bindings.setdefault(name, []).append(_id)
+        namemap[name] = _id
         return _id
 
     def add_global(self, name, id_info):
@@ -1245,13 +2176,13 @@ class CompEnv:
         return _id
     
     def has_name(self, name):
-        return self.local_env.has(name) or name in self.global_env
+        return name in self.bindings or name in self.global_env
 
     def has_local_name(self, name, recursive=False):
         if recursive:
-            return self.local_env.has(name)
+            return name in self.bindings
         else:
-            return self.local_env.has_shallow(name)
+            return name in self.local_env.namemap
 
     def lookup_name(self, name):
         '''
@@ -1262,8 +2193,8 @@ class CompEnv:
         Exceptions -
             KeyError
         '''
-        if self.local_env.has(name):
-            _id = self.local_env.get(name)
+        if name in self.bindings:
+            _id = self.bindings[name][-1]
         else:
             _id = self.global_env[name]
         
@@ -1275,15 +2206,24 @@ class CompEnv:
 
 
     def local_names(self, recursive=False):
-        return self.local_env.keys(recursive=recursive)
+        if recursive:
+            return set(self.bindings.keys())
+        else:
+            return set(self.local_env.namemap.keys())
 
     def setup_local_frame(self, frame_type):
-        self.local_env = LinkedDict(EnvFrame(frame_type), prev=self.local_env)
+        self.local_env = EnvFrame(frame_type)
+        self.frames.append(self.local_env)
 
     def contract_local_frame(self):
-        assert self.local_env is not None
-        ret = self.local_env
-        self.local_env = self.local_env.prev
+        assert len(self.frames) > 1
+        frame = self.frames.pop()
+        for name in frame.namemap:
+            stack = self.bindings[name]
+            stack.pop()
+            if not stack:
+                del self.bindings[name]
+        self.local_env = self.frames[-1]
 
     def get_hint_dict(self):
         '''
@@ -1318,93 +2258,6 @@ def ensure_function_name(comp_env, name):
     return ensure_local_name(comp_env, name, IDHint(name, "function", "local"))
 
 
-    
-class LinkedDict:
-    def __init__(self, env_data, initials={}, prev=None):
-        self.env_data = env_data
-        self.prev = prev
-        self.namemap = {}
-
-        for k, v in initials.items():
-            self.set_shallow(k, v)
-
-    def keys(self, recursive=False):
-        name_set = set(self.namemap.keys())
-        if self.prev and recursive:
-            return name_set.union(self.prev.keys(recursive=True))
-        else:
-            return name_set
-    
-    def get_env_data(self):
-        return self.env_data
-    
-    def set_shallow(self, name, _id):
-        self.namemap[name] = _id
-
-    def set(self, name, _id, shallow=True):
-        if shallow:
-            self.set_shallow(name, _id)
-        else:
-            if name in self.namemap:
-                self.namemap[name] = _id
-            elif self.prev:
-                return self.prev.set(name, _id)
-            else:
-                raise KeyError(_id)
-
-    def has(self, name):
-        if name not in self.namemap:
-            if self.prev:
-                return self.prev.has(name)
-            else:
-                return False
-        else:
-            return True
-
-    def has_shallow(self, name):
-        return name in self.namemap
-
-    
-    def who_has(self, name):
-        if name not in self.namemap:
-            if self.prev:
-                return self.prev.who_has(name)
-            else:
-                return None
-        else:
-            return self.env_data
-
-    def all_dict_with_name(self, name):
-        '''
-        Get matching names in several linked dict and return ids of those as list.
-        First encounted name is located in front of the list.
-
-        e.g)
-        If a linked dict is constructed as shown below
-
-        {a: ..} with data "A" -prev-> {b: ..} -prev-> {a: ..} with env_data "B" 
-        ^ front subdict                  ^ rear subdict
-        The result of this function is ["A", "B"]
-        '''
-        prev_result = self.prev.backtrace_name(name) if self.prev else []
-        if name in self.namemap:
-            return [self] + prev_result
-        else:
-            return prev_result
-
-    def all_env_data_with_name(self, name):
-        return [subdict.get_env_data() 
-                for subdict in self.all_dict_with_name(name)]
-    
-    def get(self, name):
-        if name in self.namemap:
-            return self.namemap[name]
-        elif self.prev:
-            return self.prev.get(name)
-        else:
-            raise KeyError(name)
-
-
 class Premise:
     def __init__(self, use_return_value=False):
         self.use_return_value = use_return_value
@@ -1421,6 +2274,19 @@ class Conclusion:
         self.result_expr = result_expr
         self.error = error
         self.comment = comment
+        self.srcloc = None # locinfo of the innermost node which has result_expr
+
+    def result_stmt(self, imd_id=None):
+        '''
+        Make a statement which evaluates result_expr, assigning it to imd_id if given.
+        The statement is located at the node of result_expr.
+        '''
+        if imd_id is None:
+            stmt = PyExprStmt(self.result_expr)
+        else:
+            stmt = PyAssignmentToName(PyMetaID(imd_id), self.result_expr)
+        stmt.srcloc = self.srcloc
+        return stmt
 
     def error_occurred(self):
         return self.error 
@@ -1433,7 +2299,7 @@ class Conclusion:
     
     def make_stmt_list(self):
         if self.has_result() and self.result_expr.may_have_side_effect():
-            return self.preseq_stmts + [PyExprStmt(self.result_expr)]
+            return self.preseq_stmts + [self.result_stmt()]
 
 
 
@@ -1485,7 +2351,7 @@ def noreturn_conclusion(conclusions):
     for concl in conclusions:
         stmts += concl.preseq_stmts
         if concl.has_result() and concl.result_expr.may_have_side_effect():
-            stmts.append(PyExprStmt(concl.result_expr)) # Result might have side-effect so that we should put result expr as well
+            stmts.append(concl.result_stmt()) # Result might have side-effect so that we should put result expr as well
 
     return stmt_conclusion(stmts)
 
@@ -1535,7 +2401,7 @@ def make_integrator(allow_None):
                 else:
                     preseq_stmts.extend(a.preseq_stmts)
                     result_id = comp_env.issue_local_immediate()
-                    preseq_stmts.extend(stmtify_expr(result_expr, True, result_id))
+                    preseq_stmts.append(a.result_stmt(result_id))
                     return PyMetaID(result_id)
             elif a is None:
                 if allow_None:
@@ -1604,8 +2470,7 @@ def integrate_list(comp_env, conclusions):
             if expr.may_have_side_effect():
                 imd_id = comp_env.issue_local_immediate()
                 used_imd_ids.append(imd_id)
-                preseq_stmts.append(PyAssignmentToName(PyMetaID(imd_id),
-                                                       expr))
+                preseq_stmts.append(concl.result_stmt(imd_id))
                 result.append(PyMetaID(imd_id))
             else:
                 result.append(expr)
@@ -1620,12 +2485,19 @@ class RuntimeStore:
 
 
 class Context:
-    def __init__(self, comp_env, config, rt_store, filename):
+    def __init__(self, comp_env, config, rt_store, filename, translation_cache=None):
         self.comp_env = comp_env
         self.config = config
         self.rt_store = rt_store
         self.errors = []
         self.filename = filename
+        self.translation_cache = translation_cache
+        self.main_frame = comp_env.local_env
+        self.cache_keys = set() # keys of cached defs which this translation uses
+        self.cache_candidates = [] # (key, PyDefun, sline) list, stored after renaming
+
+    def in_main_frame(self):
+        return self.comp_env.local_env is self.main_frame
 
     def add_error(self, error_obj):
         self.errors.append(error_obj)
@@ -1645,7 +2517,29 @@ def set_comp_error(context, error_obj):
 # Translators
 #
 
-node_translator = LISNVisitor()
+class LocatingVisitor(LISNVisitor):
+    '''
+    Translator which stamps location info of each node on the statements
+    created while translating it, unless inner nodes did it already.
+    '''
+    def visit(self, lisn_obj, premise, context):
+        created = _created_stmts.stmts
+        if created is None or "locinfo" not in lisn_obj:
+            return LISNVisitor.visit(self, lisn_obj, premise, context)
+        # inner nodes remove statements they located, so that only those the
+        # node itself created are left after the mark
+        mark = len(created)
+        concl = LISNVisitor.visit(self, lisn_obj, premise, context)
+        locinfo = lisn_obj["locinfo"]
+        for stmt in created[mark:]:
+            if stmt.srcloc is None:
+                stmt.srcloc = locinfo
+        del created[mark:]
+        if concl.has_result() and concl.srcloc is None:
+            concl.srcloc = locinfo
+        return concl
+
+node_translator = LocatingVisitor()
 def stmtify_expr(expr, use_return_value, imd_id=None):
     '''
     CompEnv x bool x id -> stmt list
@@ -1657,29 +2551,6 @@ def stmtify_expr(expr, use_return_value, imd_id=None):
         return [PyExprStmt(expr)]
 
 
-def basic_emitter(fun):
-    @wraps(fun)
-    def wrapper(translator, lisn, premise, context):
-        conclusion = fun(translator, lisn, premise, context)
-        assert isinstance(conclusion, Conclusion)
-
-        if context.config.emit_line_info:
-            locinfo = lisn["locinfo"]
-            line_directive = \
-                PyCall(PyMetaID(context.line_info_id),
-                       [PyLiteral(locinfo["sline"]),
-                        PyLiteral(locinfo["eline"]),
-                        PyLiteral(locinfo["scol"]),
-                        PyLiteral(locinfo["ecol"] - 1)],
-                       [])
-            conclusion.preseq_stmts.insert(0, line_directive)
-
-            return conclusion
-        else:
-            return conclusion
-    return wrapper 
-
-
 @node_translator.add.trailer
 def nt_trailer(translator, lisn, premise, context):
     trailer_type = lisn["trailer_type"] 
@@ -2309,18 +3180,31 @@ def ltranslate_in_app_order(translator, node_list, context):
          list of expr )
 
     '''
+    return integrate_in_app_order(context,
+                                  [translator(node, Premise(True), context)
+                                   for node in node_list])
+
+def integrate_in_app_order(context, conclusions):
+    '''
+    Lift results of conclusions which may have side effects into immediates,
+    so that they are evaluated in order with pre-sequential stmts of the others.
+
+    Returns -
+        (success,
+         Pre-sequential stmts,
+         list of expr )
+    '''
     preseq_stmts = []
     result_exprs = []
     success = True
-    for node in node_list:
-        concl = translator(node, Premise(True), context)
+    for concl in conclusions:
         if concl.error_occurred():
             success = False
             continue
         preseq_stmts.extend(concl.preseq_stmts)
         if concl.has_result() and concl.result_expr.may_have_side_effect():
             imd_id = context.comp_env.issue_local_immediate()
-            preseq_stmts.append(PyAssignmentToName(PyMetaID(imd_id), concl.result_expr))
+            preseq_stmts.append(concl.result_stmt(imd_id))
             result_exprs.append(PyMetaID(imd_id))
         else:
             result_exprs.append(concl.result_expr)
@@ -2417,6 +3301,42 @@ def translate_def(translator, lisn, premise, context):
     # parg_strs: string list
     # kwd_pairs: (string, node) list
     def_name, parg_strs, kwd_pairs, star_str, dstar_str = formal_info
+
+    def bind_function_name():
+        prebound_id = premise.prebound_id if hasattr(premise, "prebound_id") else None
+        if prebound_id is None:
+            return ensure_function_name(context.comp_env, def_name) # function name
+        else:
+            assert context.comp_env.has_local_name(def_name, recursive=False)
+            _id, info = context.comp_env.lookup_name(def_name)
+            assert _id == prebound_id
+            assert info.is_var()
+            return prebound_id # name is already bound to 
+
+    def make_conclusion(stmts):
+        if premise.use_return_value:
+            return stmt_result_conclusion(stmts, PyLiteral(None))
+        else:
+            return stmt_conclusion(stmts)
+
+    # Only definitions in the main frame are cached
+    cache = context.translation_cache
+    cache_key = None
+    if cache is not None and context.in_main_frame():
+        cache_key, ref_names = cache.make_key(lisn, context)
+        ref_ids = []
+        for name in sorted(ref_names) + _IMPLICIT_GLOBAL_NAMES:
+            if context.comp_env.has_name(name):
+                _id, info = context.comp_env.lookup_name(name)
+                if info.is_var():
+                    ref_ids.append(_id)
+        frozen_stmt = cache.get(cache_key, lisn["locinfo"]["sline"], ref_ids)
+        if frozen_stmt is not None:
+            bind_function_name()
+            context.cache_keys.add(cache_key)
+            return make_conclusion([frozen_stmt])
+    error_cnt = len(context.errors)
+
     keywords = [k for k, _ in kwd_pairs]
     kw_concls = [translator(knode, Premise(True), context) 
                  for _, knode in kwd_pairs]
@@ -2424,15 +3344,7 @@ def translate_def(translator, lisn, premise, context):
     if not kw_success:
         return error_conclusion()
 
-    prebound_id = premise.prebound_id if hasattr(premise, "prebound_id") else None
-    if prebound_id is None:
-        function_id = ensure_function_name(context.comp_env, def_name) # function name
-    else:
-        assert context.comp_env.has_local_name(def_name, recursive=False)
-        _id, info = context.comp_env.lookup_name(def_name)
-        assert _id == prebound_id
-        assert info.is_var()
-        function_id = prebound_id # name is already bound to 
+    function_id = bind_function_name()
 
     # formal arguments duplication check
     name_set = set([])
@@ -2481,10 +3393,14 @@ def translate_def(translator, lisn, premise, context):
     ## DEL ENV
     context.comp_env.contract_local_frame() 
 
-    if premise.use_return_value:
-        return stmt_result_conclusion(preseq_stmts + [defun], PyLiteral(None))
-    else:
-        return stmt_conclusion(preseq_stmts + [defun])
+    # Defaults of keyword arguments which need statements of their own
+    # are evaluated in the enclosing scope, so those defs are not cached.
+    if cache_key is not None and \
+       not preseq_stmts and \
+       len(context.errors) == error_cnt:
+        context.cache_keys.add(cache_key)
+        context.cache_candidates.append((cache_key, defun, lisn["locinfo"]["sline"]))
+    return make_conclusion(preseq_stmts + [defun])
 
 def translate_let(translator, lisn, premise, context):
     if lisn["has_vert_suite"]:
@@ -2651,12 +3567,13 @@ def _translate_iter_head(translator, lisn, premise, context,
 
 
 
+def _is_expr_only(concl):
+    return not concl.error_occurred() and \
+           not concl.preseq_stmts and \
+           concl.has_result()
+
 def translate_for(translator, lisn, premise, context):
     use_return_value = premise.use_return_value
-    if use_return_value:
-        result_id = context.comp_env.issue_local_immediate()
-    else:
-        result_id = None
 
     def kont(head_preseq_stmts, elem_obj, iterable_expr, body):
         body_concl = xtranslate_seq(translator,
@@ -2664,12 +3581,25 @@ def translate_for(translator, lisn, premise, context):
                                     premise.copy(),
                                     context)
         stmts = head_preseq_stmts
+        if use_return_value and _is_expr_only(body_concl):
+            # the body has no statement, so results are collected by
+            # a list comprehension without calling append for each element
+            comprehension = PyListComprehension(elem_obj,
+                                                iterable_expr,
+                                                [body_concl.result_expr],
+                                                None,
+                                                [body_concl.srcloc])
+            return stmt_result_conclusion(stmts, comprehension)
+
         body_stmts = body_concl.preseq_stmts
         body_result_expr = body_concl.result_expr
         if use_return_value:
-            body_stmts.append(PyExprStmt(PyCall(PyAttrAccess(PyMetaID(result_id), "append"),
-                                                [body_result_expr],
-                                                None)))
+            result_id = context.comp_env.issue_local_immediate()
+            append_stmt = PyExprStmt(PyCall(PyAttrAccess(PyMetaID(result_id), "append"),
+                                            [body_result_expr],
+                                            None))
+            append_stmt.srcloc = body_concl.srcloc
+            body_stmts.append(append_stmt)
         stmts.append(PyForStmt(elem_obj, iterable_expr, body_stmts))
                                 
         if use_return_value:
@@ -2690,20 +3620,31 @@ def translate_for(translator, lisn, premise, context):
 
 def translate_each(translator, lisn, premise, context):
     use_return_value = premise.use_return_value
-    if use_return_value:
-        result_id = context.comp_env.issue_local_immediate()
-    else:
-        result_id = None
 
     def kont(head_preseq_stmts, elem_obj, iterable_expr, body):
-        success, body_stmts, result_exprs = ltranslate_in_app_order(translator,
-                                                                    body,
-                                                                    context)
+        concls = [translator(node, Premise(True), context) for node in body]
+        stmts = head_preseq_stmts
+        if use_return_value and concls and all(map(_is_expr_only, concls)):
+            # the body has no statement, so results are collected by
+            # a list comprehension without calling extend for each row
+            elt_srclocs = [concl.srcloc for concl in concls]
+            result_exprs = [concl.result_expr for concl in concls]
+            item_id = None
+            if PyListComprehension.needs_item_name(result_exprs, elt_srclocs):
+                item_id = PyMetaID(context.comp_env.issue_local_immediate())
+            comprehension = PyListComprehension(elem_obj,
+                                                iterable_expr,
+                                                result_exprs,
+                                                item_id,
+                                                elt_srclocs)
+            return stmt_result_conclusion(stmts, comprehension)
+
+        success, body_stmts, result_exprs = integrate_in_app_order(context, concls)
         if not success:
             return error_conclusion()
 
-        stmts = head_preseq_stmts
         if use_return_value:
+            result_id = context.comp_env.issue_local_immediate()
             body_stmts.append(PyExprStmt(PyCall(PyAttrAccess(PyMetaID(result_id), "extend"),
                                                 [PyListExpr(result_exprs)],
                                                 None)))
@@ -2789,7 +3730,8 @@ def translate_html_node(translator, lisn, premise, context):
     caller_pargs.extend(body_exprs)
 
     mk = PyCall(PyAttrAccess(PyMetaID(tagpool_id),
-                             tag_name),
+                             tag_name,
+                             pure=True),
                 caller_pargs,
                 None)
     return stmt_result_conclusion(stmts, mk)
@@ -3233,7 +4175,205 @@ _PYTHON_RESERVED_WORDS = set([
 def is_python_reserved_word(name):
     return name in _PYTHON_RESERVED_WORDS 
 
-def main_translate(suite, filename, config=None, extimport=None):
+def _feed_lisn(node, acc, names, base_line):
+    '''
+    Append string form of node into acc. Lines of location info are
+    relative to base_line, so that moving a node does not change its form.
+    Names referenced in node are gathered into names.
+    '''
+    if isinstance(node, (dict, LISNNode)):
+        if node.get("type") == "name":
+            names.add(node["name"])
+        acc.append("{")
+        for key in sorted(node.keys()):
+            acc.append(key)
+            acc.append(":")
+            if key == "locinfo":
+                locinfo = node[key]
+                acc.append(repr((locinfo["sline"] - base_line,
+                                 locinfo["eline"] - base_line,
+                                 locinfo["scol"],
+                                 locinfo["ecol"])))
+            else:
+                _feed_lisn(node[key], acc, names, base_line)
+        acc.append("}")
+    elif isinstance(node, (list, tuple)):
+        acc.append("[")
+        for elem in node:
+            _feed_lisn(elem, acc, names, base_line)
+        acc.append("]")
+    else:
+        acc.append(repr(node))
+        acc.append(",")
+
+
+def _describe_id_info(info):
+    if info.is_var():
+        hint = info.hint
+        return ("var", hint.original_name, hint.name_source, hint.usage)
+    elif info.is_global_scope_var():
+        return ("global", info.name)
+    elif info.is_runtime_extern():
+        return ("extern", info.name)
+    elif info.is_expander():
+        return ("expander", info.name, info.expander.__name__)
+    elif info.is_converter():
+        return ("converter", info.name, info.converter.__name__)
+    else:
+        NOT_REACHABLE()
+
+
+def _describe_config(config):
+    '''
+    Returns -
+        (field, value) list of config which affects translation. Passes are
+        described with their identities, not with functions they run
+    '''
+    result = []
+    for k, v in sorted(vars(config).items()):
+        if k == "pass_report_file":
+            continue
+        elif k == "passes" and v is not None:
+            v = [opt_pass.identity() for opt_pass in v]
+        result.append((k, v))
+    return result
+
+
+# global names which translators look up without the name written in source
+_IMPLICIT_GLOBAL_NAMES = [HTML_TAGPOOL_NAME, "tuple", "dict", "enumerate"]
+
+class TranslationCache:
+    '''
+    Cache of translated top-level definitions.
+
+    A definition is keyed by a hash of its LISN subtree(with lines relative to
+    the definition), bindings of every name it refers to and the translation
+    config, so that only changed definitions are translated again when a file
+    is modified. Optimization passes are keyed by their names and versions.
+    A definition that only moved to other lines is restored with its line
+    table shifted.
+    Entries which are no longer used by any file are dropped.
+    '''
+    def __init__(self):
+        self.entries = {} # key -> (PyDefun, sline)
+        self.keys_by_file = {} # filename -> key set
+
+    def make_key(self, lisn, context):
+        '''
+        Returns -
+            (key, set of names referenced in lisn)
+        '''
+        acc = []
+        names = set()
+        _feed_lisn(lisn, acc, names, lisn["locinfo"]["sline"])
+
+        comp_env = context.comp_env
+        bindings = []
+        for name in sorted(names):
+            if comp_env.has_name(name):
+                _, info = comp_env.lookup_name(name)
+                bindings.append((name, _describe_id_info(info)))
+            else:
+                bindings.append((name, None))
+        for name in _IMPLICIT_GLOBAL_NAMES:
+            _, info = comp_env.lookup_global_name(name)
+            bindings.append((name, _describe_id_info(info)))
+        acc.append(repr(bindings))
+        acc.append(repr(_describe_config(context.config)))
+        return (hashlib.sha1("".join(acc)).hexdigest(), names)
+
+    def get(self, key, sline, ref_ids=None):
+        '''
+        Returns -
+            None | PyFrozenStmt of the definition located at sline
+        '''
+        if key not in self.entries:
+            return None
+        defun, cached_sline = self.entries[key]
+        return PyFrozenStmt(defun, sline - cached_sline, ref_ids)
+
+    def update(self, filename, used_keys, candidates):
+        '''
+        Store candidates, (key, PyDefun, sline) list whose meta ids are
+        converted, and forget entries that were used by filename only.
+        '''
+        for key, defun, sline in candidates:
+            self.entries[key] = (defun, sline)
+
+        old_keys = self.keys_by_file.get(filename, set())
+        self.keys_by_file[filename] = used_keys
+        for key in old_keys - used_keys:
+            if not any(key in keys for keys in self.keys_by_file.values()):
+                del self.entries[key]
+
+
+class RenamingScope:
+    '''
+    Name table of a python scope, used by Renamer
+    '''
+    def __init__(self):
+        self.names = {} # name -> id
+        self.id_names = {} # id -> name
+        self.trial_counts = {} # (first name, suffix) -> trial count to start with
+
+
+class Renamer:
+    '''
+    Driver of convert_meta_id which gives python names to meta ids.
+
+    Ids whose hints have the same name get suffixes in a scope.
+    e.g) x, x_1, x_2 for local variables and _, __imd1, __imd2 for immediates
+
+    Names are never removed from a scope, so every trial count below
+    the one which was given last to a base name is known to be taken.
+    Counting is resumed from there instead of from zero, which keeps renaming
+    linear in the number of ids.
+    '''
+    SUFFIXES = {
+        "argument": "_arg",
+        "local": "_",
+        "immediate": "_imd",
+        "lambda": "_lam",
+        "function": "_f",
+    }
+
+    def __init__(self, hint_dict):
+        self.hint_dict = hint_dict
+
+    def new_scope(self):
+        return RenamingScope()
+
+    def __call__(self, _id, scope):
+        id_hint = self.hint_dict[_id]
+        if not isinstance(id_hint, IDHint):
+            return id_hint
+        if _id in scope.id_names:
+            return scope.id_names[_id]
+
+        name_source = id_hint.name_source
+        if name_source not in Renamer.SUFFIXES:
+            raise ValueError("Invalid name source: %r"%(name_source, ))
+        suffix = Renamer.SUFFIXES[name_source]
+
+        first_name = id_hint.original_name \
+                     if not is_python_reserved_word(id_hint.original_name) \
+                     else "_" + id_hint.original_name
+        if first_name == "":
+            first_name = "_"
+        base = (first_name, suffix)
+        trial_count = scope.trial_counts.get(base, 0)
+        while True:
+            trial_name = first_name if trial_count == 0 else (first_name + suffix + str(trial_count))
+            if trial_name not in scope.names:
+                break
+            trial_count += 1
+        scope.trial_counts[base] = trial_count + 1
+        scope.names[trial_name] = _id
+        scope.id_names[_id] = trial_name
+        return trial_name
+
+
+def main_translate(suite, filename, config=None, extimport=None, translation_cache=None):
     config = config or Config()
     extimport = extimport or {}
     comp_env = CompEnv()
@@ -3262,7 +4402,8 @@ def main_translate(suite, filename, config=None, extimport=None):
     context = Context(comp_env,
                       config,
                       RuntimeStore(runtime_obj_id, importer_id, line_info_id),
-                      filename)
+                      filename,
+                      translation_cache)
 
     def_stmts = []
     success = True
@@ -3275,10 +4416,15 @@ def main_translate(suite, filename, config=None, extimport=None):
             def_stmts.append(PyImportStmt(name_obj, PyMetaID(_id)))
         elif _type == "name":
             mod_name, name_str = name_obj
-            def_stmts.append(PyImportFromStmt(mod_name, [(name_str, PyMetaID(_id))]))
+            def_stmts.append(PyImportFromStmt(mod_name,
+                                              [(name_str, PyMetaID(_id))],
+                                              pure=(name_in_src == HTML_TAGPOOL_NAME)))
         else:
             raise ValueError("%s is not appropriate type tag for dynscope value"%_type)
 
+    outer_created_stmts = _created_stmts.stmts
+    if config.emit_line_info:
+        _created_stmts.stmts = []
     try:
         main_concl = node_translator(suite, Premise(False), context)
         if main_concl.error_occurred():
@@ -3287,6 +4433,8 @@ def main_translate(suite, filename, config=None, extimport=None):
             def_stmts += main_concl.preseq_stmts
     except NoMoreErrorAcceptable:
         error_flooded = True
+    finally:
+        _created_stmts.stmts = outer_created_stmts
 
     if context.errors:
         success = False
@@ -3317,44 +4465,19 @@ def main_translate(suite, filename, config=None, extimport=None):
                          None,
                          def_stmts)
     result_stmts.append(def_mk_tmp)
-    hint_dict = comp_env.get_hint_dict()
-    def naive_renaming_driver(_id, local_dict):
-        id_hint = hint_dict[_id]
-        if isinstance(id_hint, IDHint):
-            name_source = id_hint.name_source
-            if name_source == "argument":
-                suffix = "_arg"
-            elif name_source == "local":
-                suffix = "_"
-            elif name_source == "immediate":
-                suffix = "_imd"
-            elif name_source == "lambda":
-                suffix = "_lam"
-            elif name_source == "function":
-                suffix = "_f"
-            else:
-                print "INVALID NAME SOURCE:", name_source
-                NOT_REACHABLE()
-
-            first_name = id_hint.original_name \
-                         if not is_python_reserved_word(id_hint.original_name) \
-                         else "_" + id_hint.original_name
-            if first_name == "":
-                first_name = "_"
-            trial_count = 0
-            while True:
-                trial_name = first_name if trial_count == 0 else (first_name + suffix + str(trial_count))
-                if trial_name not in local_dict or local_dict[trial_name] == _id:
-                    local_dict[trial_name] = _id
-                    return trial_name
-                trial_count += 1
-            NOT_REACHABLE()
-        else:
-            return id_hint
-    local_dict = {}
+    if config.optimization_level > 0 or config.passes:
+        # optimize.py depends on this module
+        from optimize import optimize_stmts
+        optimize_stmts(result_stmts, config, comp_env)
+    renamer = Renamer(comp_env.get_hint_dict())
+    scope = renamer.new_scope()
     for stmt in result_stmts:
-        stmt.convert_meta_id(naive_renaming_driver, local_dict)
+        stmt.convert_meta_id(renamer, scope)
 
+    if translation_cache is not None:
+        translation_cache.update(filename,
+                                 context.cache_keys,
+                                 context.cache_candidates)
     return result_stmts
 
 def _raise_formated_syntax_error(err, filename):
@@ -3375,7 +4498,7 @@ def _raise_formated_syntax_error(err, filename):
 
 
 
-def translate_string(s, config=None, extimport=None, filename="<string>"):
+def translate_string(s, config=None, extimport=None, filename="<string>", translation_cache=None):
     '''
     Translate tempy file to python code string
 
@@ -3386,15 +4509,17 @@ def translate_string(s, config=None, extimport=None, filename="<string>"):
             string(name in compiled source) to
                 ("module", string)
                 ("name", (string, string))
+    translation_cache:
+        None | TranslationCache
     '''
     try:
-        suite = loads(s)
+        suite = loads(s, lazy=True)
     except LISNSyntaxException as e:
         _raise_formated_syntax_error(e, filename)
-    return main_translate(suite, filename, config, extimport)
+    return main_translate(suite, filename, config, extimport, translation_cache)
 
 
-def translate_file(filepath, config=None, extimport=None, filename=None):
+def translate_file(filepath, config=None, extimport=None, filename=None, translation_cache=None):
     '''
     Translate tempy file to python code string
 
@@ -3405,17 +4530,37 @@ def translate_file(filepath, config=None, extimport=None, filename=None):
             string(name in compiled source) to
                 ("module", string)
                 ("name", (string, string))
+    translation_cache:
+        None | TranslationCache
     '''
     filename = filename or filepath
     try:
-        node = loads_file(filepath)
+        node = loads_file(filepath, lazy=True)
     except LISNSyntaxException as e:
         _raise_formated_syntax_error(e, filename)
 
     return main_translate(node, 
                           filename,
                           config, 
-                          extimport)
+                          extimport,
+                          translation_cache)
 
 def pystmts_to_string(stmts, indent=4):
-    return "".join(stmt.to_string(indent, 0) for stmt in stmts)
+    writer = PyCodeWriter(indent)
+    for stmt in stmts:
+        stmt.write(writer)
+    return writer.getvalue()
+
+def pystmts_to_ast(stmts, counter=None):
+    '''
+    Lower PyStmts into python ast module which can be passed to compile()
+    without building and parsing the source text.
+    Line numbers are the same as those of pystmts_to_string(stmts).
+    Pass an AstLineCounter to get the line table of the module.
+    '''
+    counter = counter or AstLineCounter()
+    body = []
+    for stmt in stmts:
+        counter.locate(stmt)
+        body.extend(stmt.to_ast(counter))
+    return ast.fix_missing_locations(ast.Module(body))
@@ -0,0 +1,86 @@
+'''
+Minimal WSGI adapter for serving rendered templates.
+
+The body is emitted once into chunks while its digest is computed, so the
+ETag is known before anything is sent and conditional requests
+(If-None-Match) can be answered with 304 without joining the page into
+one string.
+'''
+from tag import emit_with_digest, DEFAULT_EMIT_CHUNK_SIZE
+
+DEFAULT_CONTENT_TYPE = "text/html; charset=utf-8"
+
+
+def _strip_weak(etag):
+    if etag.startswith("W/"):
+        return etag[2:]
+    return etag
+
+
+def etag_matches(if_none_match, etag):
+    '''
+    Check If-None-Match header value against etag, using weak comparison
+    as RFC 7232 requires for If-None-Match.
+    '''
+    if if_none_match.strip() == "*":
+        return True
+    etag = _strip_weak(etag)
+    for candidate in if_none_match.split(","):
+        if _strip_weak(candidate.strip()) == etag:
+            return True
+    return False
+
+
+def respond(environ, start_response, content, status="200 OK", headers=None,
+            content_type=DEFAULT_CONTENT_TYPE, hash_name="sha1",
+            chunk_size=DEFAULT_EMIT_CHUNK_SIZE):
+    '''
+    Emit content(a tag, a string or an iterable of them) as the response body
+    of a WSGI call.
+
+    Returns -
+        WSGI response iterable
+    '''
+    result = emit_with_digest(content, hash_name, chunk_size)
+    method = environ.get("REQUEST_METHOD", "GET")
+    response_headers = [("ETag", result.etag)]
+    response_headers.extend(headers or [])
+
+    if_none_match = environ.get("HTTP_IF_NONE_MATCH")
+    if if_none_match and \
+       method in ("GET", "HEAD") and \
+       status.startswith("200") and \
+       etag_matches(if_none_match, result.etag):
+        start_response("304 Not Modified", response_headers)
+        return []
+
+    response_headers.append(("Content-Type", content_type))
+    response_headers.append(("Content-Length", str(result.length)))
+    start_response(status, response_headers)
+    if method == "HEAD":
+        return []
+    return result
+
+
+class TempyApplication:
+    '''
+    WSGI application which renders the content returned by render(environ).
+
+    e.g)
+        env = Environment("tempy-templates")
+        app = TempyApplication(lambda environ: env.module("index").MainTemplate)
+    '''
+    def __init__(self, render, content_type=DEFAULT_CONTENT_TYPE, hash_name="sha1",
+                 chunk_size=DEFAULT_EMIT_CHUNK_SIZE):
+        self.render = render
+        self.content_type = content_type
+        self.hash_name = hash_name
+        self.chunk_size = chunk_size
+
+    def __call__(self, environ, start_response):
+        return respond(environ,
+                       start_response,
+                       self.render(environ),
+                       content_type=self.content_type,
+                       hash_name=self.hash_name,
+                       chunk_size=self.chunk_size)